@@ -0,0 +1,161 @@
+"""Список каналов find_ads: полный select(Channel) на каждое нажатие против CatalogIndex.
+
+Проверяет, что порядок индекса совпадает с ORDER BY каталога и что изменение
+рейтинга/статуса через ORM видно на следующей странице, а небольшой канал со
+скачком подписчиков после StatsRefresher.refresh пропадает из каталога; затем
+замеряет выдачу страниц.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_catalog --channels 50000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import select, desc
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+import migrations
+from database import build_engine
+from models import Channel
+from utils.anomaly import DetectorState, save_states
+from utils.catalog import CatalogIndex, catalog
+from utils.channel_stats import StatsRefresher
+from utils.ratelimit import RateLimiter
+from utils.timeseries import DAY, epoch
+
+
+def seed(path: str, channels: int):
+    con = sqlite3.connect(path)
+    con.execute("INSERT INTO users (id, first_name, balance, frozen_balance) VALUES (1, 'owner', 0, 0)")
+    con.executemany(
+        "INSERT INTO channels (id, owner_id, title, subscribers, avg_views_5, price_post, price_pin, status, "
+        "is_suspicious, average_rating, quality_score, err, total_reviews, completed_orders, violation_count) "
+        "VALUES (?, 1, ?, ?, ?, 10, 20, ?, ?, ?, ?, 0, 0, 0, 0)",
+        (
+            (-1000 - i, f"Канал {i}", random.randint(100, 10 ** 6), random.randint(10, 10 ** 5),
+             "active" if random.random() < 0.9 else "pending", random.random() < 0.05,
+             round(random.choice([0, 0, 3, 4, 4.5, 5]) * random.random(), 1), random.choice([25, 30, 45, 50, 65, 70, 80, 95]))
+            for i in range(channels)
+        )
+    )
+    con.commit()
+    con.close()
+
+
+async def legacy_page(session: AsyncSession, page: int):
+    result = await session.execute(
+        select(Channel)
+        .where(Channel.status == "active", Channel.is_suspicious == False)
+        .order_by(desc(Channel.average_rating), desc(Channel.quality_score))
+    )
+    channels = result.scalars().all()
+    return channels[page * 5:page * 5 + 5], len(channels)
+
+
+class _CountBot:
+    def __init__(self, counts):
+        self.counts = counts
+
+    async def get_chat_member_count(self, chat_id):
+        return self.counts[chat_id]
+
+
+async def spiking_channel_leaves(Session):
+    async with Session() as session:
+        first, total = await catalog.page(session, 0)
+        small = await session.get(Channel, first[0].id)
+        small.subscribers, small.avg_views_5 = 2000, 0
+        await session.commit()
+        # Детектор уже обучен на ровном росте, последний замер - сутки назад
+        await save_states(session, {small.id: DetectorState(
+            last_value=2000, last_ts=epoch(datetime.utcnow()) - DAY, samples=30, mean=0.002, var=0.001 ** 2
+        )})
+        await session.commit()
+        assert small.id in [e.id for e in (await catalog.page(session, 0))[0]]
+
+    refresher = StatsRefresher(_CountBot({small.id: 6000}), Session, RateLimiter(), rate=1000)
+    await refresher.refresh([small.id])
+    async with Session() as session:
+        channel = await session.get(Channel, small.id)
+        page, total_after = await catalog.page(session, 0, per_page=total)
+        assert channel.is_suspicious and channel.suspicion_score <= 50, channel.suspicion_score
+        assert small.id not in [e.id for e in page] and total_after == total - 1
+    print(f"скачок 2000 -> 6000 подписчиков: балл {channel.suspicion_score}, канал скрыт из каталога")
+
+
+def timed(samples):
+    return f"медиана {statistics.median(samples) * 1000:.2f} мс, макс {max(samples) * 1000:.2f} мс"
+
+
+async def run(channels: int, presses: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = build_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(migrations.upgrade)
+    seed(path, channels)
+    Session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    # Порядок индекса совпадает с запросом каталога (id - лишь устойчивый тай-брейк)
+    async with Session() as session:
+        index = CatalogIndex()
+        await index.load(session)
+        rows = (await session.execute(
+            select(Channel.id).where(Channel.status == "active", Channel.is_suspicious == False)
+            .order_by(desc(Channel.average_rating), desc(Channel.quality_score), Channel.id)
+        )).scalars().all()
+        entries, total = await index.page(session, 0, per_page=len(rows))
+        assert [e.id for e in entries] == list(rows) and total == len(rows)
+
+    # Изменение через ORM: канал поднимается на первое место, заблокированный пропадает
+    async with Session() as session:
+        first, _ = await catalog.page(session, 0)
+        raised = (await session.execute(select(Channel).where(Channel.id == entries[-1].id))).scalar_one()
+        raised.average_rating = 5.1
+        blocked = await session.get(Channel, first[0].id)
+        blocked.status = "blocked"
+        await session.commit()
+        started = time.perf_counter()
+        page, total_after = await catalog.page(session, 0)
+        refresh = time.perf_counter() - started
+        assert page[0].id == raised.id and blocked.id not in [e.id for e in page] and total_after == total - 1
+        print(f"инкрементальное обновление 2 каналов: {refresh * 1000:.2f} мс")
+
+    # Небольшой канал без просмотров со скачком подписчиков: флаг детектора скрывает его и без высокого балла
+    await spiking_channel_leaves(Session)
+
+    pages = [random.randint(0, total // 5) for _ in range(presses)]
+    async with Session() as session:
+        legacy = []
+        for p in pages[:max(1, presses // 10)]:
+            started = time.perf_counter()
+            await legacy_page(session, p)
+            legacy.append(time.perf_counter() - started)
+        indexed = []
+        for p in pages:
+            started = time.perf_counter()
+            await catalog.page(session, p)
+            indexed.append(time.perf_counter() - started)
+    print(f"{total} каналов в каталоге")
+    print(f"select(Channel) на нажатие: {timed(legacy)}")
+    print(f"CatalogIndex.page:          {timed(indexed)}")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=50000)
+    parser.add_argument("--presses", type=int, default=200)
+    args = parser.parse_args()
+    random.seed(1)
+    asyncio.run(run(args.channels, args.presses))
+
+
+if __name__ == "__main__":
+    main()
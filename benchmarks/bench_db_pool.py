@@ -0,0 +1,76 @@
+"""Пропускная способность БД на апдейт: NullPool против пула с PRAGMA.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_db_pool --updates 5000 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import NullPool
+
+from database import build_engine
+from models import Base, User
+
+
+async def seed(engine, users: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        session.add_all(User(id=i, first_name=f"user{i}", balance=0.0) for i in range(1, users + 1))
+        await session.commit()
+
+
+async def run_updates(engine, updates: int, concurrency: int, users: int, write_ratio: float) -> float:
+    """Имитация DbSessionMiddleware: сессия на апдейт, чтение пользователя, иногда запись"""
+    factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    queue = asyncio.Queue()
+    for _ in range(updates):
+        queue.put_nowait(None)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            async with factory() as session:
+                user = await session.get(User, random.randint(1, users))
+                if random.random() < write_ratio:
+                    user.balance += 0.01
+                    await session.commit()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return updates / (time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name in ("nullpool", "pooled"):
+            url = f"sqlite+aiosqlite:///{os.path.join(tmp, name)}.db"
+            if name == "nullpool":
+                engine = create_async_engine(url, poolclass=NullPool, connect_args={"check_same_thread": False})
+            else:
+                engine = build_engine(url)
+            await seed(engine, args.users)
+            results[name] = await run_updates(engine, args.updates, args.concurrency, args.users, args.write_ratio)
+            await engine.dispose()
+
+    for name, rate in results.items():
+        print(f"{name:>10}: {rate:8.0f} updates/s")
+    print(f"{'speedup':>10}: {results['pooled'] / results['nullpool']:8.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
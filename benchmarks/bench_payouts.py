@@ -0,0 +1,172 @@
+"""Поденные выплаты на синтетических данных: старый построчный цикл против PayoutEngine.
+
+--rows - число наступивших, но не выплаченных дней. Для старого цикла это строки
+daily_payments, для PayoutEngine - графики кампаний с тем же числом дней.
+
+Во время прогона параллельно работает "хендлер", который делает короткие записи,
+и замеряется его задержка - она показывает, как долго выплаты держат блокировку записи.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_payouts --rows 1000000
+    python -m benchmarks.bench_payouts --rows 100000 --legacy
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+import migrations
+from database import build_engine
+from models import User, AdCampaign, DailyPayment, DailyPaymentStatus, AdStatus
+from utils.payouts import PayoutEngine, payout_slot
+
+
+def seed(path: str, rows: int, days: int, owners: int, inactive_ratio: float, schedules: bool):
+    """Быстрое наполнение через sqlite3: rows дней выплат по days дней на кампанию"""
+    con = sqlite3.connect(path)
+    campaigns = rows // days
+    start = payout_slot() - timedelta(days=days)
+    con.executemany(
+        "INSERT INTO users (id, first_name, balance, frozen_balance, total_earned) VALUES (?, ?, 0, 0, 0)",
+        ((i, f"owner{i}") for i in range(1, owners + 1))
+    )
+    con.executemany(
+        "INSERT INTO channels (id, owner_id, title) VALUES (?, ?, ?)",
+        ((-i, i, f"channel{i}") for i in range(1, owners + 1))
+    )
+    con.executemany(
+        "INSERT INTO ad_campaigns (id, channel_id, status, price_per_day, duration_days, payout_start_date, paid_days) "
+        "VALUES (?, ?, ?, 1.0, ?, ?, 0)",
+        (
+            (c, -(c % owners + 1),
+             AdStatus.COMPLETED.value if random.random() < inactive_ratio else AdStatus.ACTIVE.value,
+             days, start.isoformat(" ") if schedules else None)
+            for c in range(1, campaigns + 1)
+        )
+    )
+    if not schedules:
+        con.executemany(
+            "INSERT INTO daily_payments (campaign_id, channel_id, owner_id, day_number, amount, payment_date, status) "
+            "VALUES (?, ?, ?, ?, 1.0, ?, ?)",
+            (
+                (c, -(c % owners + 1), c % owners + 1, d, (start + timedelta(days=d - 1)).isoformat(" "),
+                 DailyPaymentStatus.PENDING.value)
+                for c in range(1, campaigns + 1) for d in range(1, days + 1)
+            )
+        )
+    con.commit()
+    con.execute("ANALYZE")
+    con.close()
+
+
+async def legacy_payouts(session_factory):
+    """Прежняя реализация process_daily_payouts"""
+    async with session_factory() as session:
+        today = payout_slot()
+        result = await session.execute(
+            select(DailyPayment).where(
+                DailyPayment.payment_date <= today,
+                DailyPayment.status == DailyPaymentStatus.PENDING.value
+            )
+        )
+        for payment in result.scalars().all():
+            campaign = await session.get(AdCampaign, payment.campaign_id)
+            if campaign.status != AdStatus.ACTIVE.value:
+                payment.status = DailyPaymentStatus.CANCELLED.value
+                continue
+            owner = await session.get(User, payment.owner_id)
+            owner.balance += payment.amount
+            owner.total_earned = (owner.total_earned or 0) + payment.amount
+            payment.status = DailyPaymentStatus.PAID.value
+            payment.paid_at = datetime.utcnow()
+        await session.commit()
+
+
+async def handler_probe(session_factory, stop: asyncio.Event, latencies: list, failures: list):
+    """Короткие пишущие транзакции, как у обычных хендлеров"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            async with session_factory() as session:
+                user = await session.get(User, 1)
+                user.frozen_balance = 0.0 if user.frozen_balance else 0.0001
+                await session.commit()
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            # database is locked: хендлер не дождался busy_timeout
+            failures.append(time.perf_counter() - started)
+        await asyncio.sleep(0.01)
+
+
+async def measure(name: str, url: str, job):
+    engine = build_engine(url)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    stop, latencies, failures = asyncio.Event(), [], []
+    probe = asyncio.create_task(handler_probe(session_factory, stop, latencies, failures))
+
+    started = time.perf_counter()
+    await job(session_factory)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    async with session_factory() as session:
+        paid_days = (await session.execute(
+            select(func.sum(DailyPayment.days)).where(DailyPayment.status == DailyPaymentStatus.PAID.value)
+        )).scalar() or 0
+    await engine.dispose()
+
+    latencies.sort()
+    if latencies:
+        p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+        probe_stats = (
+            f"median {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p99 {p99 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms"
+        )
+    else:
+        probe_stats = "no successful writes"
+    print(
+        f"{name:>8}: {elapsed:8.2f} s, {paid_days / elapsed:10.0f} paid days/s | "
+        f"handler writes: {len(latencies)} ok, {len(failures)} locked out, {probe_stats}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=25)
+    parser.add_argument("--owners", type=int, default=5000)
+    parser.add_argument("--inactive-ratio", type=float, default=0.05)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--legacy", action="store_true", help="прогнать и старую реализацию (медленно)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        variants = {"engine": lambda factory: PayoutEngine(factory, args.chunk_size).run()}
+        if args.legacy:
+            variants["legacy"] = legacy_payouts
+
+        for name, job in variants.items():
+            path = os.path.join(tmp, f"{name}.db")
+            url = f"sqlite+aiosqlite:///{path}"
+            engine = build_engine(url)
+            async with engine.execution_options(sqlite_begin="IMMEDIATE").begin() as conn:
+                await conn.run_sync(migrations.upgrade)
+            await engine.dispose()
+
+            random.seed(42)
+            seed(path, args.rows, args.days, args.owners, args.inactive_ratio, schedules=(name == "engine"))
+            await measure(name, url, job)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""Проход проверки постов: старый последовательный цикл против PostChecker.
+
+Bot работает через фейковую сессию: она отвечает с задержкой, как Bot API,
+ведет журнал запросов и по нему проверяет, что лимиты не нарушены.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_post_checker --posts 5000 --channels 2000
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import EditMessageReplyMarkup, ForwardMessage
+
+from utils.post_checker import PostChecker, PostRef
+from utils.ratelimit import RateLimiter
+
+
+class FakeSession(BaseSession):
+    """Ответы Bot API без сети: пост есть, удален или канал недоступен"""
+
+    def __init__(self, latency: float, deleted: set, kicked: set):
+        super().__init__()
+        self.latency = latency
+        self.deleted = deleted
+        self.kicked = kicked
+        self.calls = []
+
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = method.from_chat_id if isinstance(method, ForwardMessage) else method.chat_id
+        self.calls.append((time.monotonic(), chat_id))
+        await asyncio.sleep(self.latency)
+        if chat_id in self.kicked:
+            raise TelegramForbiddenError(method, "Forbidden: bot was kicked from the channel chat")
+        if (chat_id, method.message_id) in self.deleted:
+            message = "message to forward not found" if isinstance(method, ForwardMessage) else "message to edit not found"
+            raise TelegramBadRequest(method, f"Bad Request: {message}")
+        if isinstance(method, EditMessageReplyMarkup):
+            raise TelegramBadRequest(method, "Bad Request: message is not modified")
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+def max_in_window(timestamps, window: float) -> int:
+    best, queue = 0, deque()
+    for ts in sorted(timestamps):
+        queue.append(ts)
+        while queue[0] <= ts - window:
+            queue.popleft()
+        best = max(best, len(queue))
+    return best
+
+
+async def legacy_sweep(bot: Bot, refs, sample: int) -> float:
+    """Прежний цикл: forward_message админу и sleep(0.5) на каждый пост"""
+    started = time.perf_counter()
+    for ref in refs[:sample]:
+        try:
+            await bot.forward_message(chat_id=1, from_chat_id=ref.channel_id, message_id=ref.post_id, disable_notification=True)
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    return (time.perf_counter() - started) / sample * len(refs)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--channels", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.08)
+    parser.add_argument("--deleted-ratio", type=float, default=0.02)
+    parser.add_argument("--kicked-ratio", type=float, default=0.01)
+    parser.add_argument("--global-rate", type=float, default=25)
+    parser.add_argument("--chat-rate", type=float, default=20 / 60)
+    parser.add_argument("--chat-burst", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--legacy-sample", type=int, default=40, help="постов для замера старого цикла")
+    args = parser.parse_args()
+
+    random.seed(42)
+    refs = [
+        PostRef(campaign_id=i, channel_id=-1000 - random.randrange(args.channels), post_id=i)
+        for i in range(1, args.posts + 1)
+    ]
+    deleted = {(r.channel_id, r.post_id) for r in refs if random.random() < args.deleted_ratio}
+    kicked = {-1000 - c for c in range(args.channels) if random.random() < args.kicked_ratio}
+
+    session = FakeSession(args.latency, deleted, kicked)
+    bot = Bot("123456:fake", session=session)
+
+    legacy = await legacy_sweep(bot, refs, args.legacy_sample)
+    session.calls.clear()
+
+    limiter = RateLimiter(args.global_rate, args.chat_rate, args.chat_burst)
+    checker = PostChecker(bot, limiter=limiter, concurrency=args.concurrency)
+    found = []
+
+    async def on_deleted(ref):
+        found.append(ref)
+
+    started = time.perf_counter()
+    counts = await checker.sweep(refs, on_deleted=on_deleted)
+    elapsed = time.perf_counter() - started
+
+    per_chat = defaultdict(list)
+    for ts, chat_id in session.calls:
+        per_chat[chat_id].append(ts)
+    expected_deleted = sum(1 for r in refs if (r.channel_id, r.post_id) in deleted and r.channel_id not in kicked)
+
+    print(f"  legacy: {legacy:8.1f} s (оценка по {args.legacy_sample} постам)")
+    print(f" checker: {elapsed:8.1f} s, {len(session.calls) / elapsed:6.1f} req/s, {counts}")
+    print(f"  bound : {args.posts / args.global_rate:8.1f} s при {args.global_rate:g} req/s")
+    print(f" limits : max {max_in_window([ts for ts, _ in session.calls], 1.0)} req/1s globally, "
+          f"max {max(max_in_window(t, 60.0) for t in per_chat.values())} req/60s per chat")
+    print(f" deleted: {len(found)} найдено из {expected_deleted} (без недоступных каналов)")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
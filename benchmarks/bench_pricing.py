@@ -0,0 +1,141 @@
+"""Рекомендованные цены каталога: поштучный расчет против price_catalog и reprice_catalog.
+
+Сначала сверяет price_catalog с calculate_recommended_price, calculate_quality и
+calculate_suspicion на случайных и граничных значениях, затем замеряет расчет
+и ночной пересчет цен в БД (один UPDATE против UPDATE с коммитом на канал).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_pricing --channels 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+import migrations
+from database import build_engine
+from models import Channel
+from utils.analytics import (
+    calculate_recommended_price, calculate_err, calculate_quality, calculate_suspicion, is_suspicious, is_uniform, price_catalog
+)
+from utils.channel_stats import reprice_catalog
+
+# Границы ступеней CPM, ERR и оценок качества - в выборку попадают они и соседние значения
+EDGES = [0, 1, 99, 100, 101, 499, 500, 999, 1000, 4999, 5000, 9999, 10000, 10001, 20000, 20001, 49999, 50000]
+
+
+def sample(n: int):
+    subscribers, views, recent = [], [], []
+    for _ in range(n):
+        subs = random.choice(EDGES) if random.random() < 0.2 else int(random.lognormvariate(8, 2))
+        if random.random() < 0.2:
+            # ERR ровно на границе: 3, 5, 10, 15, 25, 30, 40, 50, 70 процентов
+            avg = subs * random.choice([3, 5, 10, 15, 25, 30, 40, 50, 70]) // 100
+        else:
+            avg = int(subs * random.uniform(0, 0.9))
+        posts = [avg] * 5 if random.random() < 0.1 else [max(0, avg + random.randint(-50, 50)) for _ in range(5)]
+        subscribers.append(subs)
+        views.append(avg)
+        recent.append(posts)
+    return subscribers, views, recent
+
+
+def scalar(subscribers, views, recent, spikes=None, growths=None):
+    spikes = spikes or [False] * len(subscribers)
+    growths = growths or [None] * len(subscribers)
+    out = []
+    for subs, avg, posts, spike, change in zip(subscribers, views, recent, spikes, growths):
+        err = calculate_err(subs, avg)
+        price = calculate_recommended_price(subs, avg)
+        score = calculate_suspicion(subs, err, is_uniform(posts), spike)
+        out.append((price["post"], price["pin"], round(err, 2), *calculate_quality(subs, err, change),
+                    score, is_suspicious(score, spike)))
+    return out
+
+
+def check(n: int):
+    subscribers, views, recent = sample(n)
+    spikes = [random.random() < 0.05 for _ in subscribers]
+    growths = [random.choice([None, -12, -10, -5, -3, 0, 2, 20, 50, 80, random.uniform(-30, 80)]) for _ in subscribers]
+    expected = scalar(subscribers, views, recent, spikes, growths)
+    batch = price_catalog(subscribers, views, recent, spikes, growths)
+    got = list(zip(batch.post, batch.pin, batch.err, batch.quality_score, batch.quality_label, batch.suspicion_score,
+                   batch.suspicious))
+    mismatches = sum(1 for a, b in zip(expected, got) if a != b)
+    print(f"сверка на {n} каналах: расхождений {mismatches}")
+    assert mismatches == 0
+
+
+def bench_compute(n: int, repeat: int = 5):
+    subscribers, views, recent = sample(n)
+    spikes = [random.random() < 0.05 for _ in subscribers]
+    growths = [random.choice([None, random.uniform(-30, 80)]) for _ in subscribers]
+    # Лучшее из repeat запусков: меньше шума от сборщика мусора и соседних процессов
+    t_scalar = t_batch = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        scalar(subscribers, views, recent, spikes, growths)
+        t_scalar = min(t_scalar, time.perf_counter() - started)
+        started = time.perf_counter()
+        price_catalog(subscribers, views, recent, spikes, growths)
+        t_batch = min(t_batch, time.perf_counter() - started)
+    print(f"расчет {n}: поштучно {t_scalar:.3f} с, price_catalog {t_batch:.3f} с (x{t_scalar / t_batch:.1f})")
+
+
+async def bench_db(n: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = build_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(migrations.upgrade)
+    subscribers, views, _ = sample(n)
+    con = sqlite3.connect(path)
+    con.execute("INSERT INTO users (id, first_name, balance, frozen_balance) VALUES (1, 'owner', 0, 0)")
+    con.executemany(
+        "INSERT INTO channels (id, owner_id, title, subscribers, avg_views_5, price_post) VALUES (?, 1, 'c', ?, ?, 1.0)",
+        ((-1000 - i, s, v) for i, (s, v) in enumerate(zip(subscribers, views)))
+    )
+    con.commit()
+    con.close()
+    Session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    # Поштучно, как при обновлении статистики канала: UPDATE и коммит на канал
+    started = time.perf_counter()
+    async with Session() as session:
+        for i, (s, v) in enumerate(zip(subscribers, views)):
+            price = calculate_recommended_price(s, v)
+            await session.execute(
+                update(Channel).where(Channel.id == -1000 - i)
+                .values(suggested_price_post=price["post"], suggested_price_pin=price["pin"])
+            )
+            await session.commit()
+    t_rows = time.perf_counter() - started
+
+    async with Session() as session:
+        await session.execute(update(Channel).values(suggested_price_post=None, suggested_price_pin=None))
+        await session.commit()
+    started = time.perf_counter()
+    changed = await reprice_catalog(Session)
+    t_bulk = time.perf_counter() - started
+    print(f"БД {n}: поштучно {t_rows:.2f} с, reprice_catalog {t_bulk:.2f} с (изменено {changed})")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=100000)
+    parser.add_argument("--db-channels", type=int, default=20000)
+    args = parser.parse_args()
+    random.seed(1)
+    check(args.channels)
+    bench_compute(args.channels)
+    asyncio.run(bench_db(args.db_channels))
+
+
+if __name__ == "__main__":
+    main()
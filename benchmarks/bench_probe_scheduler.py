@@ -0,0 +1,138 @@
+"""Трафик проб и задержка обнаружения удалений: проход всех постов раз в минуту
+против ProbeScheduler. Моделируются несколько суток на виртуальных часах, без сети.
+
+Удаления случаются в основном в первые часы после публикации и перед сроком
+окончания, остальные - равномерно. Удаление, замеченное после выплаты в 12:00,
+значит, что владелец получил деньги за день, когда поста уже не было.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_probe_scheduler --posts 5000 --days 3
+"""
+import argparse
+import random
+import statistics
+from datetime import datetime, timedelta
+
+from utils.payouts import payout_slot
+from utils.post_checker import PostRef, EXISTS, DELETED
+from utils.probe_scheduler import ProbeScheduler
+
+
+class Clock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def make_posts(count: int, start: datetime, horizon: timedelta, deleted_ratio: float):
+    """(ref, опубликован, конец, момент удаления или None)"""
+    posts = []
+    for i in range(1, count + 1):
+        duration = timedelta(days=random.randint(1, 30))
+        # Часть постов публикуется уже во время моделирования
+        published = start + random.uniform(-1.0, horizon / duration * 0.2) * duration
+        end = published + duration
+        deleted_at = None
+        if random.random() < deleted_ratio:
+            kind = random.random()
+            if kind < 0.4:
+                deleted_at = published + timedelta(minutes=random.uniform(1, 60))
+            elif kind < 0.7:
+                deleted_at = end - timedelta(minutes=random.uniform(1, 30))
+            else:
+                deleted_at = published + random.random() * duration
+        posts.append((PostRef(i, -1000 - i % 2000, i), published, end, deleted_at))
+    return posts
+
+
+def payout_after(moment: datetime) -> datetime:
+    slot = payout_slot(moment)
+    return slot if slot > moment else slot + timedelta(days=1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--days", type=float, default=3)
+    parser.add_argument("--deleted-ratio", type=float, default=0.05)
+    parser.add_argument("--tick", type=float, default=5)
+    parser.add_argument("--budget", type=int, default=20000)
+    args = parser.parse_args()
+
+    random.seed(42)
+    start = datetime(2026, 1, 1, 0, 0)
+    horizon = timedelta(days=args.days)
+    posts = make_posts(args.posts, start, horizon, args.deleted_ratio)
+    clock = Clock(start)
+    scheduler = ProbeScheduler(budget_per_hour=args.budget, clock=clock)
+
+    tick = timedelta(seconds=args.tick)
+    sync_every = timedelta(minutes=5)
+    next_sync = start
+    watched = set()
+    detected = {}
+    probes = legacy_probes = 0
+    legacy_next_sweep = start
+    legacy_detected = {}
+
+    active, live, by_id, next_refresh = [], [], {}, start
+    while clock.now < start + horizon:
+        now = clock.now
+        if now >= next_refresh:
+            # Состав активных постов пересчитывается раз в виртуальную минуту
+            active = [p for p in posts if p[1] <= now < p[2]]
+            # Замеченные удаления переходят в VIOLATION и из выборки для планировщика выпадают
+            live = [p for p in active if p[0].campaign_id not in detected]
+            by_id = {p[0].campaign_id: p for p in live}
+            next_refresh = now + timedelta(minutes=1)
+
+            # Публикация в моменте - watch() из approve_and_publish
+            for ref, published, end, _ in live:
+                if ref.campaign_id not in watched and published > start:
+                    scheduler.watch(ref, published, end)
+                    watched.add(ref.campaign_id)
+        if now >= next_sync:
+            scheduler.sync((ref, published, end) for ref, published, end, _ in live)
+            watched.update(ref.campaign_id for ref, *_ in live)
+            next_sync = now + sync_every
+
+        for ref in scheduler.due():
+            probes += 1
+            post = by_id.get(ref.campaign_id)
+            gone = post is not None and post[3] is not None and post[3] <= now
+            if gone:
+                detected[ref.campaign_id] = now
+            scheduler.record(ref, DELETED if gone else EXISTS)
+
+        # Старый цикл: все активные посты раз в минуту
+        if now >= legacy_next_sweep:
+            for ref, _, _, deleted_at in active:
+                if ref.campaign_id in legacy_detected:
+                    continue
+                legacy_probes += 1
+                if deleted_at is not None and deleted_at <= now:
+                    legacy_detected[ref.campaign_id] = now
+            legacy_next_sweep = now + timedelta(minutes=1)
+
+        clock.now += tick
+
+    def report(name, found, count):
+        deletions = [p for p in posts if p[3] is not None and start <= p[3] < start + horizon - timedelta(hours=1)]
+        latencies = [(found[p[0].campaign_id] - p[3]).total_seconds() for p in deletions if p[0].campaign_id in found]
+        late = sum(1 for p in deletions if p[0].campaign_id in found and found[p[0].campaign_id] > payout_after(p[3]))
+        missed = sum(1 for p in deletions if p[0].campaign_id not in found)
+        print(
+            f"{name:>9}: {count / args.days:9.0f} probes/day | latency median {statistics.median(latencies):6.0f} s, "
+            f"p95 {sorted(latencies)[int(len(latencies) * 0.95)]:6.0f} s, max {max(latencies):6.0f} s | "
+            f"paid after deletion {late}, missed {missed} of {len(deletions)}"
+        )
+
+    report("legacy", legacy_detected, legacy_probes)
+    report("scheduler", detected, probes)
+    print(f"{'reduction':>9}: {legacy_probes / max(probes, 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Поиск каналов: фильтр в Python по полному select + OFFSET против ChannelSearch.
+
+Проверяет, что keyset-страницы ChannelSearch подряд дают ту же выдачу, что и
+один запрос с фильтрами, затем замеряет листание первых страниц: полная выборка
+с фильтрацией в Python, SQL с OFFSET, keyset по индексу и повтор из LRU-кэша.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_search --channels 50000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import select, desc
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+import migrations
+from database import build_engine
+from models import Channel
+from utils.search import ChannelSearch, SearchFilters, _conditions, fts_query
+
+WORDS = ["Крипто", "Новости", "Кулинария", "Авто", "Спорт", "Юмор", "Финансы", "Игры", "Путешествия", "Технологии"]
+
+FILTERS = [
+    SearchFilters(),
+    SearchFilters(query="крипт"),
+    SearchFilters(min_subscribers=10000, max_subscribers=200000, max_price_post=50),
+    SearchFilters(query="авто спорт", min_rating=3),
+    SearchFilters(min_err=20, min_quality=60),
+    SearchFilters(min_subscribers=900000),
+    SearchFilters(query="юмор", min_price_pin=10, max_price_pin=40, min_quality=50),
+]
+
+
+def seed(path: str, channels: int):
+    con = sqlite3.connect(path)
+    con.execute("INSERT INTO users (id, first_name, balance, frozen_balance) VALUES (1, 'owner', 0, 0)")
+    con.executemany(
+        "INSERT INTO channels (id, owner_id, title, subscribers, avg_views_5, price_post, price_pin, status, "
+        "is_suspicious, average_rating, quality_score, err, total_reviews, completed_orders, violation_count) "
+        "VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 0, 0)",
+        (
+            (-1000 - i, f"{random.choice(WORDS)} {random.choice(WORDS).lower()} {i}", random.randint(100, 10 ** 6),
+             random.randint(10, 10 ** 5), random.randint(1, 100), random.randint(2, 200),
+             "active" if random.random() < 0.9 else "pending", random.random() < 0.05,
+             round(random.choice([0, 0, 3, 4, 4.5, 5]) * random.random(), 1), random.choice([25, 30, 45, 50, 65, 70, 80, 95]),
+             round(random.random() * 40, 1))
+            for i in range(channels)
+        )
+    )
+    con.execute("ANALYZE")
+    con.commit()
+    con.close()
+
+
+def matches(channel: Channel, f: SearchFilters, found_ids) -> bool:
+    for value, low, high in (
+        (channel.subscribers, f.min_subscribers, f.max_subscribers),
+        (channel.price_post, f.min_price_post, f.max_price_post),
+        (channel.price_pin, f.min_price_pin, f.max_price_pin),
+        (channel.err, f.min_err, None),
+        (channel.quality_score, f.min_quality, None),
+        (channel.average_rating, f.min_rating, None),
+    ):
+        if (low is not None and value < low) or (high is not None and value > high):
+            return False
+    return found_ids is None or channel.id in found_ids
+
+
+async def python_page(session: AsyncSession, f: SearchFilters, page: int):
+    # Как листал бы каталог без поиска: весь список и фильтр в Python
+    found_ids = None
+    if f.query:
+        found_ids = set((await session.execute(
+            select(Channel.id).where(Channel.title.ilike(f"%{f.query.split()[0]}%"))
+        )).scalars())
+    result = await session.execute(
+        select(Channel)
+        .where(Channel.status == "active", Channel.is_suspicious == False)
+        .order_by(desc(Channel.average_rating), desc(Channel.quality_score), desc(Channel.id))
+    )
+    channels = [c for c in result.scalars() if matches(c, f, found_ids)]
+    return channels[page * 5:page * 5 + 5]
+
+
+async def offset_page(session: AsyncSession, f: SearchFilters, page: int):
+    return (await session.execute(
+        select(Channel.id).where(*_conditions(f))
+        .order_by(desc(Channel.average_rating), desc(Channel.quality_score), desc(Channel.id))
+        .offset(page * 5).limit(5)
+    )).all()
+
+
+def timed(samples):
+    return f"медиана {statistics.median(samples) * 1000:.2f} мс, макс {max(samples) * 1000:.2f} мс"
+
+
+async def run(channels: int, pages: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = build_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(migrations.upgrade)
+    seed(path, channels)
+    Session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    # Keyset-страницы подряд совпадают с одним запросом по тем же условиям
+    async with Session() as session:
+        for f in FILTERS:
+            expected = (await session.execute(
+                select(Channel.id).where(*_conditions(f))
+                .order_by(desc(Channel.average_rating), desc(Channel.quality_score), desc(Channel.id))
+            )).scalars().all()
+            got, cursor = [], None
+            while True:
+                entries, cursor = await ChannelSearch(ttl=0).page(session, f, cursor, per_page=50)
+                got.extend(e.id for e in entries)
+                if cursor is None:
+                    break
+            assert got == list(expected), f
+            print(f"{f.describe()}: {len(expected)} каналов, FTS: {fts_query(f.query)}")
+
+    timings = {"python": [], "offset": [], "keyset": [], "cache": []}
+    async with Session() as session:
+        for f in FILTERS:
+            for page in range(min(pages, 3)):
+                started = time.perf_counter()
+                await python_page(session, f, page)
+                timings["python"].append(time.perf_counter() - started)
+            for page in range(pages):
+                started = time.perf_counter()
+                await offset_page(session, f, page)
+                timings["offset"].append(time.perf_counter() - started)
+            searcher = ChannelSearch()
+            for key in ("keyset", "cache"):
+                cursor = None
+                for _ in range(pages):
+                    started = time.perf_counter()
+                    _, cursor = await searcher.page(session, f, cursor)
+                    timings[key].append(time.perf_counter() - started)
+                    if cursor is None:
+                        break
+    print(f"полный select + фильтр в Python: {timed(timings['python'])}")
+    print(f"SQL с OFFSET:                    {timed(timings['offset'])}")
+    print(f"ChannelSearch, keyset:           {timed(timings['keyset'])}")
+    print(f"ChannelSearch, из кэша:          {timed(timings['cache'])}")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=50000)
+    parser.add_argument("--pages", type=int, default=30)
+    args = parser.parse_args()
+    random.seed(1)
+    asyncio.run(run(args.channels, args.pages))
+
+
+if __name__ == "__main__":
+    main()
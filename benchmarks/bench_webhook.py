@@ -0,0 +1,197 @@
+"""Доставка апдейтов: long polling против вебхука (TelegramWebhook) под нагрузкой.
+
+Telegram заменен фейком: апдейты появляются с заданным темпом, getUpdates и
+sendMessage отвечают с сетевой задержкой. В режиме вебхука фейк шлет апдейты
+POST-запросами на локальный сервер не более чем max_connections за раз, как
+настоящий Telegram. Обработчик каждого апдейта отвечает одним sendMessage.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_webhook --rate 400 --seconds 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetUpdates, GetMe
+from aiogram.types import Message, Update, User
+
+from utils.webhook import TelegramWebhook, create_app, start_server, SECRET_HEADER
+
+
+def make_update(update_id: int) -> dict:
+    chat_id = 1000 + update_id % 5000
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(datetime.now().timestamp()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "u"},
+            "text": "hi"
+        }
+    }
+
+
+class FakeTelegram(BaseSession):
+    """Источник апдейтов с темпом rate и Bot API с задержкой latency"""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.pending = []
+        self.arrived = asyncio.Event()
+        self.created = {}
+
+    def emit(self, update_id: int):
+        self.created[update_id] = time.perf_counter()
+        self.pending.append(make_update(update_id))
+        self.arrived.set()
+
+    async def make_request(self, bot, method, timeout=None):
+        await asyncio.sleep(self.latency)
+        if isinstance(method, GetUpdates):
+            if not self.pending:
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), timeout=method.timeout or 1)
+                except asyncio.TimeoutError:
+                    return []
+            batch, self.pending = self.pending[:100], self.pending[100:]
+            # Ответ еще идет по сети обратно
+            await asyncio.sleep(self.latency)
+            return [Update.model_validate(u, context={"bot": bot}) for u in batch]
+        if isinstance(method, GetMe):
+            return User(id=123456, is_bot=True, first_name="bench", username="bench_bot")
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+def build(latency: float, done: dict, in_flight: list):
+    session = FakeTelegram(latency)
+    bot = Bot("123456:fake", session=session)
+    dp = Dispatcher()
+    router = Router()
+
+    @router.message()
+    async def answer(message: Message, bot: Bot):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight[1], in_flight[0])
+        try:
+            await bot.send_message(message.chat.id, "ok")
+        finally:
+            in_flight[0] -= 1
+            done[message.message_id] = time.perf_counter()
+
+    dp.include_router(router)
+    return session, bot, dp
+
+
+async def produce(session: FakeTelegram, rate: float, seconds: float, on_update=None):
+    total = int(rate * seconds)
+    started = time.perf_counter()
+    for i in range(1, total + 1):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        session.emit(i)
+        if on_update:
+            on_update(i)
+    return total
+
+
+async def wait_done(done: dict, total: int, limit: float):
+    deadline = time.perf_counter() + limit
+    while len(done) < total and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+
+def report(name: str, session: FakeTelegram, done: dict, total: int, elapsed: float, peak: int, extra: str = ""):
+    latencies = sorted((done[i] - session.created[i]) * 1000 for i in done)
+    print(
+        f"{name:>8}: {len(done):6d}/{total} за {elapsed:5.1f} s = {len(done) / elapsed:7.1f} upd/s | "
+        f"задержка median {statistics.median(latencies):6.0f} ms, p95 {latencies[int(len(latencies) * 0.95)]:6.0f} ms | "
+        f"обработчиков одновременно до {peak}{extra}"
+    )
+
+
+async def bench_polling(args):
+    done, in_flight = {}, [0, 0]
+    session, bot, dp = build(args.latency, done, in_flight)
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    started = time.perf_counter()
+    total = await produce(session, args.rate, args.seconds)
+    await wait_done(done, total, args.seconds * 3)
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    report("polling", session, done, total, elapsed, in_flight[1])
+
+
+async def bench_webhook(args):
+    done, in_flight = {}, [0, 0]
+    session, bot, dp = build(args.latency, done, in_flight)
+    webhook = TelegramWebhook(
+        dp, bot, secret="bench", workers=args.workers,
+        queue_size=args.queue_size, put_timeout=args.put_timeout
+    )
+    runner = await start_server(create_app(webhook), "127.0.0.1", args.port)
+    url = f"http://127.0.0.1:{args.port}/telegram-webhook"
+
+    # Telegram держит не больше max_connections запросов одновременно и повторяет неуспешные
+    connections = asyncio.Semaphore(args.max_connections)
+    retries = [0]
+    deliveries = []
+    http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.max_connections))
+
+    async def deliver(update_id: int):
+        body = make_update(update_id)
+        async with connections:
+            await asyncio.sleep(args.latency)
+            while True:
+                async with http.post(url, json=body, headers={SECRET_HEADER: "bench"}) as response:
+                    if response.status == 200:
+                        return
+                retries[0] += 1
+                await asyncio.sleep(1)
+
+    started = time.perf_counter()
+    total = await produce(session, args.rate, args.seconds, lambda i: deliveries.append(asyncio.create_task(deliver(i))))
+    await asyncio.gather(*deliveries)
+    await wait_done(done, total, args.seconds * 3)
+    elapsed = time.perf_counter() - started
+
+    async with http.post(url, json=make_update(1), headers={SECRET_HEADER: "wrong"}) as response:
+        unauthorized = response.status
+    await http.close()
+    await runner.cleanup()
+    report("webhook", session, done, total, elapsed, in_flight[1], f" | повторов {retries[0]}, чужой секрет -> {unauthorized}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=400, help="апдейтов в секунду")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="сетевая задержка в одну сторону")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--put-timeout", type=float, default=5)
+    parser.add_argument("--max-connections", type=int, default=40)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    await bench_polling(args)
+    await bench_webhook(args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,18 +1,31 @@
 import asyncio
 import logging
+import signal
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand, BotCommandScopeDefault
 
 from config import config
-from database import init_db, AsyncSessionLocal
+from database import init_db, close_db, AsyncSessionLocal
 from handlers import owners, advertisers, publishing, withdraw_auto
 from utils.balance import BalanceService
-from utils.cryptopay_withdraw import CryptoPayWithdraw
+from utils.payouts import PayoutEngine
+from utils.cryptopay_withdraw import CryptoPayWithdraw, WithdrawalWorker
+from utils.cryptopay import CryptoPayWebhook
+from utils.cryptopay_client import cp
+from utils.invoices import InvoiceReconciler
+from utils.outbox import OutboxDispatcher
+from utils.rates import rates
+from utils.channel_stats import StatsRefresher, reprice_catalog
+from utils.fsm_storage import SQLiteStorage, create_fsm_storage
+from utils.webhook import TelegramWebhook, create_app, start_server, webhook_secret
+from handlers import auto_cleanup
 from handlers.auto_cleanup import DeletionTracker
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -35,32 +48,115 @@ async def daily_payout_job():
     await balance_service.process_daily_payouts()
 
 
+async def payout_catch_up_job():
+    """Дозавершение прерванных и пропущенных выплат"""
+    await PayoutEngine(AsyncSessionLocal).catch_up()
+
+
+async def catalog_reprice_job():
+    """Ночной пересчет рекомендованных цен каталога"""
+    await reprice_catalog(AsyncSessionLocal)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Режим вебхука: регистрируем адрес в Telegram и работаем до сигнала остановки"""
+    await bot.set_webhook(
+        url=config.WEBHOOK_URL.rstrip("/") + config.TELEGRAM_WEBHOOK_PATH,
+        secret_token=webhook_secret(),
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS
+    )
+    logger.info("🔗 Вебхук установлен, ожидание апдейтов...")
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    await dp.emit_startup(bot=bot)
+    try:
+        await stop.wait()
+    finally:
+        await dp.emit_shutdown(bot=bot)
+
+
 async def main():
     logger.info("🚀 Запуск бота...")
     
     bot = Bot(token=config.BOT_TOKEN, parse_mode=ParseMode.HTML)
-    dp = Dispatcher(storage=MemoryStorage())
+    # Состояния диалогов переживают рестарт и не копятся в памяти
+    storage = create_fsm_storage(AsyncSessionLocal)
+    dp = Dispatcher(storage=storage)
     
     # Инициализация БД
     await init_db()
+    await cp.start()
     
     # Middleware
     from database import DbSessionMiddleware
     dp.update.middleware(DbSessionMiddleware(AsyncSessionLocal))
     
-    # Сервисы
-    balance_service = BalanceService(AsyncSessionLocal)
-    publishing.balance_service = balance_service
+    # Планировщик: периодические задачи - в памяти (добавляются при каждом старте),
+    # отложенные удаления постов - в БД, чтобы пережить рестарт
+    scheduler = AsyncIOScheduler(jobstores={
+        "default": MemoryJobStore(),
+        "persistent": SQLAlchemyJobStore(
+            url=config.JOBSTORE_URL,
+            engine_options={"connect_args": {"timeout": config.DB_BUSY_TIMEOUT_MS / 1000}}
+        )
+    })
+    scheduler.add_job(
+        daily_payout_job, CronTrigger(hour=12, minute=0), id="daily_payouts",
+        misfire_grace_time=3600, coalesce=True
+    )
+    scheduler.add_job(payout_catch_up_job, IntervalTrigger(minutes=10), id="payout_catch_up", coalesce=True)
+    scheduler.add_job(
+        catalog_reprice_job, CronTrigger(hour=4, minute=0), id="catalog_reprice",
+        misfire_grace_time=3600, coalesce=True
+    )
+    # Оплаты, которые не подтвердили ни вебхук, ни кнопка, и истекшие счета
+    scheduler.add_job(
+        InvoiceReconciler(AsyncSessionLocal).run_once, IntervalTrigger(seconds=config.INVOICE_RECONCILE_INTERVAL),
+        id="invoice_reconcile", coalesce=True
+    )
+    # Статистика каталога: самые устаревшие каналы небольшими порциями, весь каталог за окно
+    stats_refresher = StatsRefresher(bot, AsyncSessionLocal)
+    owners.stats_refresher = stats_refresher
+    scheduler.add_job(
+        stats_refresher.run_once, IntervalTrigger(seconds=config.STATS_REFRESH_INTERVAL),
+        id="stats_refresh", coalesce=True
+    )
+    if isinstance(storage, SQLiteStorage):
+        # В Redis истечение встроенное, в БД истекшие диалоги чистим сами
+        scheduler.add_job(
+            storage.sweep, IntervalTrigger(seconds=config.FSM_SWEEP_INTERVAL), id="fsm_sweep", coalesce=True
+        )
     
-    # Планировщик выплат
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(daily_payout_job, CronTrigger(hour=12, minute=0), id="daily_payouts")
-    scheduler.start()
+    # Отслеживание удалений; до старта планировщика, чтобы просроченные задачи удаления его застали
+    tracker = DeletionTracker(bot, AsyncSessionLocal, jobs=scheduler)
+    publishing.deletion_tracker = tracker
+    auto_cleanup.deletion_tracker = tracker
     
-    # Отслеживание удалений
-    tracker = DeletionTracker(bot, AsyncSessionLocal)
+    # На паузе задачи уже загружены из хранилища, но еще не запущены - восстановление их видит
+    scheduler.start(paused=True)
+    await tracker.restore_expiry_jobs()
+    scheduler.resume()
     asyncio.create_task(tracker.start_polling())
     
+    # Очередь исходящих уведомлений
+    outbox = OutboxDispatcher(bot, AsyncSessionLocal)
+    asyncio.create_task(outbox.run())
+    
+    # Очередь выводов: чеки создаются в фоне, пользователь получает их сообщением
+    withdrawals = WithdrawalWorker(AsyncSessionLocal)
+    asyncio.create_task(withdrawals.run())
+    
+    # Курсы валют вывода обновляются в фоне
+    asyncio.create_task(rates.run())
+    
+    # Выплаты, пропущенные пока бот был выключен
+    asyncio.create_task(payout_catch_up_job())
+    
     # Регистрация роутеров
     dp.include_router(owners.router)
     dp.include_router(advertisers.router)
@@ -73,13 +169,26 @@ async def main():
     # Команды
     await set_commands(bot)
     
+    # Общий HTTP-сервер: вебхук Crypto Pay, вебхук Telegram - только в режиме webhook
+    webhook = TelegramWebhook(dp, bot) if config.BOT_MODE == "webhook" else None
+    runner = await start_server(create_app(webhook, CryptoPayWebhook(AsyncSessionLocal)))
+    
     try:
-        # Сброс вебхука и запуск лонг поллинга
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if webhook:
+            await run_webhook(bot, dp)
+        else:
+            # Сброс вебхука и запуск лонг поллинга
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        await runner.cleanup()
+        withdrawals.stop()
+        outbox.stop()
+        await rates.close()
+        await cp.close()
         await bot.session.close()
         scheduler.shutdown()
+        await close_db()
 
 
 if __name__ == "__main__":
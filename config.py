@@ -13,6 +13,24 @@ class Config:
     BASE_DIR: Path = Path(__file__).parent
     DATABASE_URL: str = f"sqlite+aiosqlite:///{BASE_DIR}/bot_database.db"
     
+    # Хранилище отложенных задач планировщика (удаление постов по сроку). Отдельный файл:
+    # синхронная запись в него идет из event loop и не должна ждать блокировку основной БД
+    JOBSTORE_URL: str = os.getenv("JOBSTORE_URL", f"sqlite:///{BASE_DIR}/jobs.db")
+    
+    # Пул соединений с БД
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+    
+    # PRAGMA, применяемые к каждому новому соединению
+    DB_JOURNAL_MODE: str = os.getenv("DB_JOURNAL_MODE", "WAL")
+    DB_SYNCHRONOUS: str = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+    DB_BUSY_TIMEOUT_MS: int = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    DB_FOREIGN_KEYS: bool = os.getenv("DB_FOREIGN_KEYS", "1") == "1"
+    DB_CACHE_SIZE_KB: int = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+    DB_MMAP_SIZE: int = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+    
     # ID админов (кто получает уведомления)
     ADMIN_IDS: list = None
     
@@ -22,13 +40,152 @@ class Config:
     # Штраф за досрочное удаление 50%
     PENALTY_PERCENT: float = 0.5
     
+    # Выплаты обрабатываются пакетами, каждый в своей короткой транзакции
+    PAYOUT_CHUNK_SIZE: int = int(os.getenv("PAYOUT_CHUNK_SIZE", "500"))
+    PAYOUT_CHUNK_PAUSE: float = float(os.getenv("PAYOUT_CHUNK_PAUSE", "0.02"))
+    # Прогон без heartbeat дольше этого срока считается брошенным и продолжается
+    PAYOUT_RUN_LEASE: int = int(os.getenv("PAYOUT_RUN_LEASE", "120"))
+    
+    # Снимок доступного баланса кэшируется на столько секунд (сбрасывается при изменениях)
+    BALANCE_CACHE_TTL: float = float(os.getenv("BALANCE_CACHE_TTL", "30"))
+    
+    # Лимиты Bot API: общий (запросов в секунду) и на один чат (в секунду + запас)
+    TG_GLOBAL_RATE: float = float(os.getenv("TG_GLOBAL_RATE", "25"))
+    TG_CHAT_RATE: float = float(os.getenv("TG_CHAT_RATE", str(20 / 60)))
+    TG_CHAT_BURST: int = int(os.getenv("TG_CHAT_BURST", "3"))
+    
+    # Очередь исходящих сообщений
+    OUTBOX_CONCURRENCY: int = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    OUTBOX_POLL_INTERVAL: float = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+    OUTBOX_LEASE: int = int(os.getenv("OUTBOX_LEASE", "120"))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    OUTBOX_RETRY_BASE: int = int(os.getenv("OUTBOX_RETRY_BASE", "5"))
+    OUTBOX_RETRY_MAX: int = int(os.getenv("OUTBOX_RETRY_MAX", "900"))
+    # Дольше этого сообщение не ждет лимит чата в воркере, а откладывается в БД
+    OUTBOX_MAX_WAIT: float = float(os.getenv("OUTBOX_MAX_WAIT", "2"))
+    OUTBOX_RETENTION_DAYS: int = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+    
+    # Срок жизни инвойса Crypto Pay; активные инвойсы сверяются пакетами раз в INVOICE_RECONCILE_INTERVAL,
+    # брошенные заказы (неоплаченные и отмененные из-за истекшего счета) старше INVOICE_GC_AGE удаляются
+    INVOICE_EXPIRES_IN: int = int(os.getenv("INVOICE_EXPIRES_IN", "3600"))
+    INVOICE_RECONCILE_INTERVAL: int = int(os.getenv("INVOICE_RECONCILE_INTERVAL", "60"))
+    INVOICE_RECONCILE_BATCH: int = int(os.getenv("INVOICE_RECONCILE_BATCH", "100"))
+    INVOICE_GC_AGE: int = int(os.getenv("INVOICE_GC_AGE", str(3 * 86400)))
+    
+    # Клиент Crypto Pay: таймауты вызовов (get_* и остальные), пул соединений;
+    # после CRYPTOPAY_BREAKER_FAILURES сбоев подряд вызовы отклоняются CRYPTOPAY_BREAKER_RESET секунд
+    CRYPTOPAY_READ_TIMEOUT: float = float(os.getenv("CRYPTOPAY_READ_TIMEOUT", "5"))
+    CRYPTOPAY_TIMEOUT: float = float(os.getenv("CRYPTOPAY_TIMEOUT", "10"))
+    CRYPTOPAY_POOL_SIZE: int = int(os.getenv("CRYPTOPAY_POOL_SIZE", "10"))
+    CRYPTOPAY_BREAKER_FAILURES: int = int(os.getenv("CRYPTOPAY_BREAKER_FAILURES", "5"))
+    CRYPTOPAY_BREAKER_RESET: float = float(os.getenv("CRYPTOPAY_BREAKER_RESET", "30"))
+    
+    # Очередь выводов: заявки обрабатываются в фоне не больше WITHDRAW_CONCURRENCY одновременно;
+    # сбой Crypto Pay повторяется с паузой WITHDRAW_RETRY_BASE * 2^(попытка-1), до WITHDRAW_MAX_ATTEMPTS попыток
+    WITHDRAW_CONCURRENCY: int = int(os.getenv("WITHDRAW_CONCURRENCY", "4"))
+    WITHDRAW_POLL_INTERVAL: float = float(os.getenv("WITHDRAW_POLL_INTERVAL", "5"))
+    WITHDRAW_LEASE: int = int(os.getenv("WITHDRAW_LEASE", "120"))
+    WITHDRAW_MAX_ATTEMPTS: int = int(os.getenv("WITHDRAW_MAX_ATTEMPTS", "6"))
+    WITHDRAW_RETRY_BASE: int = int(os.getenv("WITHDRAW_RETRY_BASE", "10"))
+    WITHDRAW_RETRY_MAX: int = int(os.getenv("WITHDRAW_RETRY_MAX", "600"))
+    
+    # Не чаще раза в столько секунд кнопка "проверить оплату" спрашивает Crypto Pay об одном инвойсе
+    PAYMENT_CHECK_COOLDOWN: float = float(os.getenv("PAYMENT_CHECK_COOLDOWN", "10"))
+    
+    # Курсы валют вывода: источники по приоритету, свежесть кэша и срок,
+    # дольше которого устаревший курс не отдается; котировка в диалоге вывода живет RATES_QUOTE_TTL
+    RATE_SOURCES: str = os.getenv("RATE_SOURCES", "cryptopay,coingecko")
+    RATES_TTL: float = float(os.getenv("RATES_TTL", "60"))
+    RATES_STALE_TTL: float = float(os.getenv("RATES_STALE_TTL", "900"))
+    RATES_TIMEOUT: float = float(os.getenv("RATES_TIMEOUT", "5"))
+    RATES_QUOTE_TTL: int = int(os.getenv("RATES_QUOTE_TTL", "300"))
+    
+    # Состояния диалогов (FSM): в БД бота или в Redis, если задан FSM_REDIS_URL
+    FSM_REDIS_URL: str = os.getenv("FSM_REDIS_URL", "")
+    # Брошенный на середине диалог забывается через FSM_TTL секунд после последнего шага
+    FSM_TTL: int = int(os.getenv("FSM_TTL", "86400"))
+    FSM_SWEEP_INTERVAL: int = int(os.getenv("FSM_SWEEP_INTERVAL", "600"))
+    
+    # Проверка наличия рекламных постов в каналах
+    POST_CHECK_CONCURRENCY: int = int(os.getenv("POST_CHECK_CONCURRENCY", "16"))
+    # Недоступный канал проверяется реже: база * 2^(ошибок-1), но не реже максимума
+    POST_CHECK_BACKOFF_BASE: int = int(os.getenv("POST_CHECK_BACKOFF_BASE", "300"))
+    POST_CHECK_BACKOFF_MAX: int = int(os.getenv("POST_CHECK_BACKOFF_MAX", "21600"))
+    
+    # Расписание проб: часто сразу после публикации и в окнах риска, реже для стабильных постов
+    POST_PROBE_TICK: float = float(os.getenv("POST_PROBE_TICK", "5"))
+    POST_PROBE_MIN_INTERVAL: int = int(os.getenv("POST_PROBE_MIN_INTERVAL", "60"))
+    POST_PROBE_BASE_INTERVAL: int = int(os.getenv("POST_PROBE_BASE_INTERVAL", "120"))
+    POST_PROBE_MAX_INTERVAL: int = int(os.getenv("POST_PROBE_MAX_INTERVAL", "1800"))
+    POST_PROBE_DENSE_PERIOD: int = int(os.getenv("POST_PROBE_DENSE_PERIOD", "3600"))
+    POST_PROBE_RISK_WINDOW: int = int(os.getenv("POST_PROBE_RISK_WINDOW", "1800"))
+    # Бюджет проб в час на весь бот; сверх него пробы откладываются
+    POST_PROBE_BUDGET: int = int(os.getenv("POST_PROBE_BUDGET", "20000"))
+    POST_PROBE_SYNC_INTERVAL: int = int(os.getenv("POST_PROBE_SYNC_INTERVAL", "300"))
+    
+    # Обновление статистики каналов: весь каталог за STATS_REFRESH_WINDOW секунд, тик раз в
+    # STATS_REFRESH_INTERVAL, не больше STATS_REFRESH_RATE запросов get_chat_member_count в секунду
+    STATS_REFRESH_WINDOW: int = int(os.getenv("STATS_REFRESH_WINDOW", "86400"))
+    STATS_REFRESH_INTERVAL: int = int(os.getenv("STATS_REFRESH_INTERVAL", "300"))
+    STATS_REFRESH_RATE: float = float(os.getenv("STATS_REFRESH_RATE", "5"))
+    STATS_REFRESH_CONCURRENCY: int = int(os.getenv("STATS_REFRESH_CONCURRENCY", "8"))
+    # Кнопка "обновить данные" не чаще раза в столько секунд на канал
+    STATS_REFRESH_COOLDOWN: int = int(os.getenv("STATS_REFRESH_COOLDOWN", "300"))
+    
+    # История подписчиков: сырые точки хранятся HISTORY_RAW_RETENTION секунд, затем сворачиваются
+    # в почасовые (HISTORY_HOURLY_RETENTION), затем в посуточные (HISTORY_DAILY_RETENTION)
+    HISTORY_RAW_RETENTION: int = int(os.getenv("HISTORY_RAW_RETENTION", str(2 * 86400)))
+    HISTORY_HOURLY_RETENTION: int = int(os.getenv("HISTORY_HOURLY_RETENTION", str(30 * 86400)))
+    HISTORY_DAILY_RETENTION: int = int(os.getenv("HISTORY_DAILY_RETENTION", str(730 * 86400)))
+    
+    # Детектор накрутки подписчиков: сглаживание EWMA, порог z-оценки скачка, параметры CUSUM
+    # (допуск k и порог h), минимальный прирост для срабатывания, нижняя граница разброса
+    # суточного прироста, замеров на обучение, минимальный интервал замеров и срок флага
+    ANOMALY_ALPHA: float = float(os.getenv("ANOMALY_ALPHA", "0.1"))
+    ANOMALY_Z: float = float(os.getenv("ANOMALY_Z", "4"))
+    ANOMALY_CUSUM_K: float = float(os.getenv("ANOMALY_CUSUM_K", "0.5"))
+    ANOMALY_CUSUM_H: float = float(os.getenv("ANOMALY_CUSUM_H", "8"))
+    ANOMALY_MIN_JUMP: int = int(os.getenv("ANOMALY_MIN_JUMP", "100"))
+    ANOMALY_MIN_STD: float = float(os.getenv("ANOMALY_MIN_STD", "0.01"))
+    ANOMALY_WARMUP: int = int(os.getenv("ANOMALY_WARMUP", "5"))
+    ANOMALY_MIN_INTERVAL: int = int(os.getenv("ANOMALY_MIN_INTERVAL", "3600"))
+    ANOMALY_HOLD: int = int(os.getenv("ANOMALY_HOLD", str(7 * 86400)))
+    
+    # Каталог каналов в памяти: полная перезагрузка раз в столько секунд (изменения из других процессов)
+    CATALOG_RELOAD_INTERVAL: int = int(os.getenv("CATALOG_RELOAD_INTERVAL", "300"))
+    
+    # Поиск каналов: LRU-кэш страниц выдачи по сочетанию фильтров (записей) и срок жизни записи (сек)
+    SEARCH_CACHE_SIZE: int = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+    SEARCH_CACHE_TTL: int = int(os.getenv("SEARCH_CACHE_TTL", "60"))
+    
+    # Inline-поиск (@бот запрос): результатов на страницу (не больше 50) и сколько секунд Telegram кэширует ответ
+    INLINE_PAGE_SIZE: int = int(os.getenv("INLINE_PAGE_SIZE", "20"))
+    INLINE_CACHE_TIME: int = int(os.getenv("INLINE_CACHE_TIME", "300"))
+    
     # Доступные валюты для оплаты/вывода
     CRYPTO_CURRENCIES: list = None
     
-    # Webhook для Crypto Pay (если нужен)
-    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "https://your-domain.com/cryptopay-webhook")
-    WEBHOOK_PORT: int = 8080
-    WEBHOOK_HOST: str = "0.0.0.0"
+    # Получение апдейтов: polling или webhook
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+    
+    # Общий HTTP-сервер бота (вебхук Telegram и служебные эндпоинты)
+    # WEBHOOK_URL - внешний адрес сервера, пути эндпоинтов добавляются к нему
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "https://your-domain.com")
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    TELEGRAM_WEBHOOK_PATH: str = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram-webhook")
+    # Сюда Crypto Pay шлет invoice_paid: WEBHOOK_URL + путь указывается в @CryptoBot -> My Apps -> Webhooks
+    CRYPTOPAY_WEBHOOK_PATH: str = os.getenv("CRYPTOPAY_WEBHOOK_PATH", "/cryptopay-webhook")
+    # Пусто - секрет выводится из BOT_TOKEN
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    # Одновременных соединений от Telegram (1-100)
+    WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    # Обработчиков апдейтов и размер очереди перед ними; при полной очереди
+    # запрос ждет WEBHOOK_QUEUE_TIMEOUT секунд, затем 503 и повтор от Telegram
+    WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "32"))
+    WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    WEBHOOK_QUEUE_TIMEOUT: float = float(os.getenv("WEBHOOK_QUEUE_TIMEOUT", "5"))
 
     def __post_init__(self):
         if self.ADMIN_IDS is None:
@@ -1,16 +1,46 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from config import config
-from models import Base
+import migrations
 
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
-from typing import Callable, Dict, Any, Awaitable
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Awaitable, List, Optional
+
+from models import User
 
 class DbSessionMiddleware(BaseMiddleware):
+    """Сессия на апдейт. Заодно заводит строку users для нового пользователя:
+    с foreign_keys=ON заказ, выплата или статистика без нее не запишутся,
+    а /start пользователь может и не нажимать (например, пришел из inline-поиска)."""
+
+    KNOWN_LIMIT = 10000
+
     def __init__(self, session_pool):
         super().__init__()
         self.session_pool = session_pool
+        self._known: "OrderedDict[int, None]" = OrderedDict()
+
+    async def _ensure_user(self, session: AsyncSession, from_user):
+        if from_user.id in self._known:
+            self._known.move_to_end(from_user.id)
+            return
+        if (await session.execute(select(User.id).where(User.id == from_user.id))).first() is None:
+            await session.execute(
+                insert(User)
+                .values(id=from_user.id, username=from_user.username, first_name=from_user.first_name)
+                .on_conflict_do_nothing(index_elements=[User.id])
+            )
+            await session.commit()
+        else:
+            # Закрыть читающую транзакцию: обработчику нужна свежая (begin_immediate - до первого запроса)
+            await session.rollback()
+        self._known[from_user.id] = None
+        if len(self._known) > self.KNOWN_LIMIT:
+            self._known.popitem(last=False)
 
     async def __call__(
         self,
@@ -19,15 +49,59 @@ class DbSessionMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         async with self.session_pool() as session:
+            from_user = data.get("event_from_user")
+            if from_user is not None and not from_user.is_bot:
+                await self._ensure_user(session, from_user)
             data["session"] = session
             return await handler(event, data)
 
-engine = create_async_engine(
-    config.DATABASE_URL,
-    echo=False,
-    poolclass=NullPool,
-    connect_args={"check_same_thread": False}
-)
+
+def _connection_pragmas() -> List[str]:
+    """PRAGMA для нового соединения"""
+    return [
+        f"PRAGMA journal_mode={config.DB_JOURNAL_MODE}",
+        f"PRAGMA synchronous={config.DB_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT_MS)}",
+        f"PRAGMA foreign_keys={'ON' if config.DB_FOREIGN_KEYS else 'OFF'}",
+        # Отрицательное значение - размер кэша в KiB, а не в страницах
+        f"PRAGMA cache_size=-{int(config.DB_CACHE_SIZE_KB)}",
+        f"PRAGMA mmap_size={int(config.DB_MMAP_SIZE)}",
+    ]
+
+
+def _on_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in _connection_pragmas():
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _on_begin(conn):
+    # Обычные транзакции драйвер открывает сам перед первой записью.
+    # IMMEDIATE сразу берет блокировку записи: read-modify-write внутри такой
+    # транзакции ждет busy_timeout, а не падает с SQLITE_BUSY при апгрейде блокировки
+    if conn.get_execution_options().get("sqlite_begin") == "IMMEDIATE":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def build_engine(url: Optional[str] = None) -> AsyncEngine:
+    """Движок с ограниченным пулом соединений и PRAGMA на каждое соединение"""
+    engine = create_async_engine(
+        url or config.DATABASE_URL,
+        echo=False,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        connect_args={"check_same_thread": False}
+    )
+    event.listen(engine.sync_engine, "connect", _on_connect)
+    event.listen(engine.sync_engine, "begin", _on_begin)
+    return engine
+
+
+engine = build_engine()
 
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -36,9 +110,19 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 
+async def begin_immediate(session: AsyncSession):
+    """Открыть пишущую транзакцию (BEGIN IMMEDIATE) до первого запроса сессии"""
+    await session.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
+
+
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # IMMEDIATE: миграции атомарны и не выполняются параллельно из двух процессов
+    async with engine.execution_options(sqlite_begin="IMMEDIATE").begin() as conn:
+        await conn.run_sync(migrations.upgrade)
+
+
+async def close_db():
+    await engine.dispose()
 
 
 async def get_session():
@@ -1,16 +1,26 @@
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import (
+    Message, CallbackQuery, InlineQuery, InlineQueryResultArticle, InputTextMessageContent, LinkPreviewOptions
+)
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
 from sqlalchemy import select, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
+from html import escape
 
-from models import User, Channel, AdCampaign, AdStatus
-from keyboards import ad_offers, channel_offer, negotiate_keyboard, payment_keyboard
+from models import Channel, AdCampaign, AdStatus
+from keyboards import ad_offers, search_results, inline_channel_offer, channel_offer, negotiate_keyboard, payment_keyboard
 from utils.analytics import calculate_total_price
+from utils.timeseries import load_histories, growth, epoch, DAY
 from utils.cryptopay import create_payment
+from utils.outbox import enqueue
+from utils.catalog import catalog
+from utils.search import (
+    SearchFilters, search, parse_filters, normalize_query, encode_cursor, decode_cursor, CURSOR_PREFIX
+)
+from config import config
 
 router = Router()
 
@@ -26,6 +36,10 @@ class CreateAdStates(StatesGroup):
     waiting_for_owner_price = State()
 
 
+class SearchStates(StatesGroup):
+    waiting_for_filters = State()
+
+
 @router.callback_query(F.data == "find_ads")
 async def find_ads(callback: CallbackQuery, session: AsyncSession):
     await find_ads_logic(callback.message, session)
@@ -35,18 +49,80 @@ async def find_ads(callback: CallbackQuery, session: AsyncSession):
 async def cmd_find_ads(message: Message, session: AsyncSession):
     await find_ads_logic(message, session)
 
-async def find_ads_logic(message: Message, session: AsyncSession):
-    """Логика поиска каналов"""
-    result = await session.execute(
-        select(Channel)
-        .where(Channel.status == "active", Channel.is_suspicious == False)
-        .order_by(desc(Channel.average_rating), desc(Channel.quality_score))
-    )
-    channels = result.scalars().all()
-    channels_data = [{'channel': c} for c in channels]
+async def find_ads_logic(message: Message, session: AsyncSession, page: int = 0):
+    """Логика поиска каналов: страница из индекса каталога"""
+    channels, total = await catalog.page(session, page)
+    if not channels and page > 0:
+        # Каталог сократился, пока пользователь листал
+        page = max(0, (total - 1) // 5)
+        channels, total = await catalog.page(session, page)
     
     text = "🔍 **Доступные каналы**\n👥 подписчики | 👀 просмотры | ⭐ рейтинг"
-    reply_markup = ad_offers(channels_data)
+    reply_markup = ad_offers(channels, page, total)
+    
+    if message.from_user.id == message.bot.id:
+        await message.edit_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+    else:
+        await message.answer(text, parse_mode="Markdown", reply_markup=reply_markup)
+
+
+@router.callback_query(F.data.startswith("offers_page_"))
+async def offers_page(callback: CallbackQuery, session: AsyncSession):
+    page = int(callback.data.split("_")[2])
+    await find_ads_logic(callback.message, session, page)
+    await callback.answer()
+
+
+SEARCH_HELP = (
+    "🔎 **Поиск каналов**\n\n"
+    "Отправьте условия одним сообщением, например:\n"
+    "`крипто подписчики 1000-50000 пост -30 err 10 рейтинг 4`\n\n"
+    "• `подписчики`, `пост`, `закреп` - диапазон `от-до`, `от-` или `-до` (цены в $)\n"
+    "• `err`, `качество`, `рейтинг` - минимальное значение\n"
+    "• остальные слова ищутся в названии канала\n\n"
+    "Отправьте `-`, чтобы показать все каналы."
+)
+
+
+@router.callback_query(F.data == "search_start")
+async def search_start(callback: CallbackQuery, state: FSMContext):
+    await state.set_state(SearchStates.waiting_for_filters)
+    await callback.message.edit_text(SEARCH_HELP, parse_mode="Markdown")
+    await callback.answer()
+
+
+@router.message(SearchStates.waiting_for_filters)
+async def process_search_filters(message: Message, state: FSMContext, session: AsyncSession):
+    if not message.text:
+        await message.answer("❌ Отправьте условия текстом")
+        return
+    try:
+        filters = parse_filters("" if message.text.strip() == "-" else message.text)
+    except ValueError as e:
+        await message.answer(f"❌ {e}", parse_mode=None)
+        return
+    # Фильтры живут в данных диалога: в callback_data кнопок помещается только курсор
+    await state.set_state(None)
+    await state.update_data(search=filters.to_dict())
+    await show_search_page(message, session, filters, None)
+
+
+@router.callback_query(F.data.startswith(CURSOR_PREFIX))
+async def search_page(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    data = await state.get_data()
+    if "search" not in data:
+        await callback.answer("Поиск устарел, задайте условия заново", show_alert=True)
+        return
+    await show_search_page(callback.message, session, SearchFilters.from_dict(data["search"]), decode_cursor(callback.data))
+    await callback.answer()
+
+
+async def show_search_page(message: Message, session: AsyncSession, filters: SearchFilters, after):
+    channels, next_cursor = await search.page(session, filters, after)
+    text = f"🔎 **Результаты поиска**\n{filters.describe()}"
+    if not channels:
+        text += "\n\nНичего не найдено" if after is None else "\n\nБольше каналов нет"
+    reply_markup = search_results(channels, encode_cursor(next_cursor) if next_cursor else None, after is None)
     
     if message.from_user.id == message.bot.id:
         await message.edit_text(text, parse_mode="Markdown", reply_markup=reply_markup)
@@ -63,9 +139,41 @@ async def view_channel(callback: CallbackQuery, session: AsyncSession):
     if not channel:
         return
     
-    text = (
+    await callback.message.edit_text(
+        await channel_offer_text(session, channel),
+        parse_mode="Markdown",
+        reply_markup=channel_offer(int(channel.id), str(channel.username))
+    )
+    await callback.answer()
+
+
+async def show_channel_offer(message: Message, session: AsyncSession, channel_id: int):
+    """Карточка канала новым сообщением (переход по ссылке из inline-поиска)"""
+    channel = await session.get(Channel, channel_id)
+    if not channel:
+        await message.answer("❌ Канал не найден")
+        return
+    await message.answer(
+        await channel_offer_text(session, channel),
+        parse_mode="Markdown",
+        reply_markup=channel_offer(int(channel.id), str(channel.username))
+    )
+
+
+async def channel_offer_text(session: AsyncSession, channel: Channel) -> str:
+    # Динамика подписчиков по истории замеров
+    series = (await load_histories(session, [channel.id]))[channel.id].series()
+    now = epoch(datetime.utcnow())
+    dynamics = ""
+    for label, period in (("7 дней", 7 * DAY), ("30 дней", 30 * DAY)):
+        change = growth(series, period, now)
+        if change:
+            dynamics += f"📈 За {label}: {change[0]:+,} ({change[1]:+.1f}%)\n"
+    
+    return (
         f"📢 **{channel.title}**\n\n"
         f"👥 Подписчики: {channel.subscribers:,}\n"
+        f"{dynamics}"
         f"👀 Просмотры: {channel.avg_views_5:,}\n"
         f"📈 ERR: {channel.err:.1f}%\n"
         f"⭐ Рейтинг: {channel.average_rating:.1f}/5.0\n"
@@ -77,13 +185,65 @@ async def view_channel(callback: CallbackQuery, session: AsyncSession):
         f"🛡 **Гарантия: возврат 50% при удалении**\n\n"
         f"Выберите тип:"
     )
-    
-    await callback.message.edit_text(
-        text,
-        parse_mode="Markdown",
-        reply_markup=channel_offer(int(channel.id), str(channel.username))
+
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery, session: AsyncSession, bot: Bot):
+    """@бот запрос: карточки каналов из поиска.
+
+    Ответ не персональный, поэтому Telegram отдает его из своего кэша всем, кто
+    наберет тот же запрос в течение INLINE_CACHE_TIME секунд, не обращаясь к боту.
+    offset - keyset-курсор следующей страницы.
+    """
+    try:
+        filters = parse_filters(inline_query.query)
+    except ValueError:
+        # Недописанный фильтр при наборе - ищем по словам
+        filters = SearchFilters(query=normalize_query(inline_query.query))
+    try:
+        after = decode_cursor(inline_query.offset, prefix="")
+    except ValueError:
+        after = None
+    
+    per_page = min(config.INLINE_PAGE_SIZE, 50)
+    channels, next_cursor = await search.page(session, filters, after, per_page=per_page)
+    bot_username = (await bot.me()).username
+    results = [
+        InlineQueryResultArticle(
+            id=str(channel.id),
+            title=channel.title or "Без названия",
+            description=(
+                f"👥 {channel.subscribers:,} | 👀 {channel.avg_views_5:,} | ⭐ {channel.average_rating:.1f} | "
+                f"📝 ${channel.price_post:.2f} | 📌 ${channel.price_pin:.2f}"
+            ),
+            input_message_content=InputTextMessageContent(
+                message_text=inline_card(channel),
+                parse_mode="HTML",
+                link_preview_options=LinkPreviewOptions(is_disabled=True)
+            ),
+            reply_markup=inline_channel_offer(channel.id, channel.username, bot_username)
+        )
+        for channel in channels
+    ]
+    await inline_query.answer(
+        results,
+        cache_time=config.INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=encode_cursor(next_cursor, prefix="") if next_cursor else ""
+    )
+
+
+def inline_card(channel) -> str:
+    username = f"@{channel.username}\n" if channel.username else ""
+    return (
+        f"📢 <b>{escape(channel.title or '')}</b>\n{username}\n"
+        f"👥 Подписчики: {channel.subscribers:,}\n"
+        f"👀 Просмотры: {channel.avg_views_5:,}\n"
+        f"⭐ Рейтинг: {channel.average_rating:.1f}/5.0\n\n"
+        f"💰 <b>Цены за 1 день:</b>\n"
+        f"📝 Пост: ${channel.price_post:.2f}\n"
+        f"📌 Закреп: ${channel.price_pin:.2f}"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data.startswith("order_"))
@@ -397,14 +557,16 @@ async def process_custom_price(message: Message, state: FSMContext, session: Asy
         )
         
         session.add(campaign)
-        await session.commit()
+        await session.flush()
         
-        await bot.send_message(
+        enqueue(
+            session,
             int(channel.owner_id),
             f"💬 **Новое предложение!**\n\n📢 Канал: {channel.title}\n👤 Рекламодатель: @{message.from_user.username}\n💰 Ваша цена: ${channel.price_post:.2f}\n💵 Предложение: ${price:.2f}",
             parse_mode="Markdown",
             reply_markup=negotiate_keyboard(int(campaign.id), is_owner=True)
         )
+        await session.commit()
         
         await message.answer(f"✅ **Предложение отправлено!**\n💰 Ваша цена: ${price:.2f}/день")
         await state.clear()
@@ -420,31 +582,26 @@ async def check_payment_handler(callback: CallbackQuery, session: AsyncSession,
         return
     invoice_id = int(callback.data.split("_")[2])
     
-    from utils.cryptopay import check_invoice_status
+    from models import CryptoPayment
+    from utils.cryptopay import check_invoice_status, confirm_payment
+    
+    # Оплату обычно уже подтвердил вебхук Crypto Pay - тогда API не нужен
+    payment_status = (await session.execute(
+        select(CryptoPayment.status).where(CryptoPayment.crypto_pay_invoice_id == invoice_id)
+    )).scalar_one_or_none()
+    # Закрываем читающую транзакцию: дальше сетевой запрос и запись
+    await session.commit()
+    if payment_status == "paid":
+        await callback.answer("✅ Оплата уже была подтверждена ранее")
+        return
+    if payment_status in ("expired", "cancelled"):
+        await callback.answer("⌛ Счет больше не действует. Оформите заказ заново.", show_alert=True)
+        return
+    
     status = await check_invoice_status(invoice_id)
     
     if status == "paid":
-        from sqlalchemy import select
-        from models import CryptoPayment
-        result = await session.execute(
-            select(CryptoPayment).where(CryptoPayment.crypto_pay_invoice_id == invoice_id)
-        )
-        payment = result.scalar_one_or_none()
-        
-        if payment and payment.status != "paid":
-            payment.status = "paid"
-            payment.paid_at = datetime.utcnow()
-            
-            campaign = await session.get(AdCampaign, payment.campaign_id)
-            if campaign:
-                campaign.status = AdStatus.PAID.value
-                
-                channel = await session.get(Channel, campaign.channel_id)
-                advertiser = await session.get(User, campaign.advertiser_id)
-                if channel:
-                    from handlers.publishing import send_post_for_review
-                    await send_post_for_review(bot, channel.owner_id, campaign, channel, advertiser)
-            
+        if await confirm_payment(session, invoice_id):
             await session.commit()
             await callback.message.edit_text("✅ **Оплата подтверждена!**\n\nВаш заказ отправлен на модерацию владельцу канала. Вы получите уведомление о публикации.", parse_mode="Markdown")
         else:
@@ -459,8 +616,7 @@ async def cancel_order_handler(callback: CallbackQuery, session: AsyncSession):
         return
     invoice_id = int(callback.data.split("_")[2])
     
-    from sqlalchemy import select
-    from models import CryptoPayment, AdCampaign, AdStatus
+    from models import CryptoPayment
     
     result = await session.execute(
         select(CryptoPayment).where(CryptoPayment.crypto_pay_invoice_id == invoice_id)
@@ -505,9 +661,6 @@ async def show_help(callback: CallbackQuery):
 @router.callback_query(F.data == "my_campaigns")
 async def show_my_campaigns(callback: CallbackQuery, session: AsyncSession):
     """Показать кампании рекламодателя"""
-    from models import AdCampaign, Channel, AdStatus
-    from sqlalchemy import select, desc
-    
     result = await session.execute(
         select(AdCampaign)
         .where(AdCampaign.advertiser_id == callback.from_user.id)
@@ -558,17 +711,18 @@ async def accept_offer(callback: CallbackQuery, session: AsyncSession, bot: Bot)
     campaign.status = AdStatus.PAID.value
     campaign.agreed_price_per_day = float(campaign.advertiser_price)
     campaign.price_per_day = float(campaign.advertiser_price)
-    await session.commit()
     
     from aiogram.utils.keyboard import InlineKeyboardBuilder
     builder = InlineKeyboardBuilder()
     builder.button(text="📝 Создать пост", callback_data=f"order_negotiated_{campaign.id}")
     
-    await bot.send_message(
+    enqueue(
+        session,
         int(campaign.advertiser_id),
         f"✅ **Владелец принял ваше предложение!**\n💰 Цена: ${campaign.advertiser_price:.2f}/день\n\nТеперь вы можете создать рекламный пост по этой цене:",
         reply_markup=builder.as_markup()
     )
+    await session.commit()
     
     await callback.message.edit_text("✅ Предложение принято")
     await callback.answer()
@@ -589,15 +743,9 @@ async def reject_offer(callback: CallbackQuery, session: AsyncSession, bot: Bot)
         return
     
     campaign.status = AdStatus.CANCELLED.value
+    enqueue(session, int(campaign.advertiser_id), "❌ Владелец отклонил ваше предложение по цене.")
     await session.commit()
     
-    try:
-        await bot.send_message(
-            int(campaign.advertiser_id),
-            f"❌ Владелец отклонил ваше предложение по цене."
-        )
-    except: pass
-    
     await callback.message.edit_text("❌ Предложение отклонено")
     await callback.answer()
 
@@ -658,13 +806,13 @@ async def process_owner_counter_price(message: Message, state: FSMContext, sessi
             return
         
         campaign.owner_price = price
-        await session.commit()
-        
-        await bot.send_message(
+        enqueue(
+            session,
             int(campaign.advertiser_id),
             f"💬 **Владелец предложил свою цену**\n💰 Его цена: ${price:.2f}/день\n💰 Ваша цена: ${campaign.advertiser_price:.2f}/день",
             reply_markup=negotiate_keyboard(int(campaign.id), is_owner=False)
         )
+        await session.commit()
         
         await message.answer(f"✅ Цена отправлена: ${price:.2f}/день")
         await state.clear()
@@ -679,14 +827,13 @@ async def process_rating(callback: CallbackQuery, session: AsyncSession):
     rating = int(parts[1])
     campaign_id = int(parts[2])
     
-    from models import AdCampaign, Review, Channel
+    from models import Review
     campaign = await session.get(AdCampaign, campaign_id)
     if not campaign:
         await callback.answer("Заказ не найден")
         return
         
     # Проверяем, не оставлял ли уже отзыв
-    from sqlalchemy import select
     result = await session.execute(
         select(Review).where(Review.campaign_id == campaign_id)
     )
@@ -712,15 +859,14 @@ async def process_rating(callback: CallbackQuery, session: AsyncSession):
         channel.total_reviews = new_total
         channel.completed_orders = (channel.completed_orders or 0) + 1
         
-    await session.commit()
-    await callback.message.edit_text(f"⭐ **Спасибо за вашу оценку: {rating}/5!**", parse_mode="Markdown")
-    
-    # Уведомляем владельца об отзыве
-    channel = await session.get(Channel, campaign.channel_id)
-    if channel:
-        await bot.send_message(
+        # Уведомляем владельца об отзыве
+        enqueue(
+            session,
             channel.owner_id,
             f"🌟 **Новый отзыв!**\n\n📢 Канал: {channel.title}\n⭐ Оценка: {rating}/5",
             parse_mode="Markdown"
         )
+        
+    await session.commit()
+    await callback.message.edit_text(f"⭐ **Спасибо за вашу оценку: {rating}/5!**", parse_mode="Markdown")
     await callback.answer()
@@ -1,24 +1,43 @@
 from aiogram import Bot
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.date import DateTrigger
+from datetime import timezone
+from typing import Optional
 import asyncio
 import logging
 
-from models import AdCampaign, AdStatus, Channel
+from models import AdCampaign, AdStatus, Channel, OutboxPriority
 from utils.balance import BalanceService
+from utils.outbox import enqueue
+from utils.post_checker import PostChecker, PostRef
+from utils.probe_scheduler import ProbeScheduler
 from config import config
 
 logger = logging.getLogger(__name__)
 
+# Устанавливается из bot.py; задачи в хранилище ссылаются на модульную функцию
+deletion_tracker: Optional["DeletionTracker"] = None
+
+
+async def expire_campaign_job(campaign_id: int):
+    """Задача планировщика: срок кампании истек"""
+    if deletion_tracker:
+        await deletion_tracker.expire_campaign(campaign_id)
+
 
 class DeletionTracker:
     """Отслеживание удаления постов"""
     
-    def __init__(self, bot: Bot, session_factory):
+    def __init__(self, bot: Bot, session_factory, jobs: Optional[AsyncIOScheduler] = None):
         self.bot = bot
         self.session_factory = session_factory
+        self.jobs = jobs
         self.balance_service = BalanceService(session_factory)
+        self.checker = PostChecker(bot)
+        self.scheduler = ProbeScheduler()
     
     async def on_message_deleted(self, channel_id: int, message_id: int):
         """Пост удален - применяем штраф"""
@@ -35,105 +54,168 @@ class DeletionTracker:
             
             if not campaign:
                 return
+            channel = await session.get(Channel, channel_id)
+        
+        penalty = await self.balance_service.apply_penalty(campaign.id)
+        
+        if penalty:
+            self.cancel_expiry(campaign.delete_job_id)
             
-            penalty = await self.balance_service.apply_penalty(campaign.id)
-            
-            if penalty:
-                channel = await session.get(Channel, channel_id)
-                
-                await self.bot.send_message(
+            async with self.session_factory() as session:
+                enqueue(
+                    session,
                     channel.owner_id,
                     f"⚠️ **НАРУШЕНИЕ!**\n\nВы удалили пост до срока.\n💰 Заработано: ${penalty['earned']:.2f}\n💸 Штраф 50%: -${penalty['penalty']:.2f}\n💵 Баланс: ${penalty['owner_balance']:.2f}",
+                    priority=OutboxPriority.PAYMENT,
                     parse_mode="Markdown"
                 )
-                
-                await self.bot.send_message(
+                enqueue(
+                    session,
                     campaign.advertiser_id,
                     f"✅ **Возврат средств!**\n\nВладелец удалил пост досрочно.\n💰 Вам возвращено: ${penalty['penalty']:.2f}",
+                    priority=OutboxPriority.PAYMENT,
                     parse_mode="Markdown"
                 )
+                await session.commit()
     
-    async def check_expirations(self):
-        """Проверка истечения срока размещения и автоматическое удаление"""
-        logger.info("🕒 Проверка истечения срока постов...")
+    def schedule_expiry(self, campaign: AdCampaign):
+        """Задача удаления поста ровно в end_date; переживает рестарт (хранилище persistent)"""
+        if self.jobs is None or not campaign.end_date:
+            return
+        job_id = f"expire_campaign_{campaign.id}"
+        self.jobs.add_job(
+            expire_campaign_job,
+            DateTrigger(run_date=campaign.end_date, timezone=timezone.utc),
+            args=[campaign.id],
+            id=job_id,
+            jobstore="persistent",
+            replace_existing=True,
+            # Пропущенное пока бот был выключен удаление выполняется при старте
+            misfire_grace_time=None
+        )
+        campaign.delete_job_id = job_id
+        campaign.scheduled_delete_time = campaign.end_date
+
+    def cancel_expiry(self, job_id: Optional[str]):
+        if self.jobs is None or not job_id:
+            return
+        try:
+            self.jobs.remove_job(job_id, jobstore="persistent")
+        except JobLookupError:
+            pass
+
+    async def restore_expiry_jobs(self):
+        """Поставить задачи кампаниям, у которых их нет (опубликованы до планировщика или хранилище потеряно)"""
+        if self.jobs is None:
+            return
         async with self.session_factory() as session:
-            now = datetime.utcnow()
             result = await session.execute(
                 select(AdCampaign).where(
                     AdCampaign.status == AdStatus.ACTIVE.value,
-                    AdCampaign.end_date <= now
+                    AdCampaign.end_date.isnot(None)
                 )
             )
-            campaigns = result.scalars().all()
+            restored = 0
+            for campaign in result.scalars().all():
+                if campaign.delete_job_id and self.jobs.get_job(campaign.delete_job_id, jobstore="persistent"):
+                    continue
+                self.schedule_expiry(campaign)
+                restored += 1
+            await session.commit()
+        if restored:
+            logger.info(f"🕒 Восстановлено задач удаления постов: {restored}")
+
+    async def expire_campaign(self, campaign_id: int):
+        """Срок размещения истек: удалить пост, завершить кампанию, уведомить стороны"""
+        async with self.session_factory() as session:
+            c = await session.get(AdCampaign, campaign_id)
+            if not c or c.status != AdStatus.ACTIVE.value:
+                return
             
-            for c in campaigns:
-                try:
-                    # 1. Удаляем пост из канала
-                    await self.bot.delete_message(chat_id=c.channel_id, message_id=c.channel_post_id)
-                    logger.info(f"🗑 Пост #{c.channel_post_id} удален из канала {c.channel_id} (срок истек)")
-                except Exception as e:
-                    logger.error(f"⚠️ Ошибка удаления поста #{c.channel_post_id}: {e}")
-                
-                # 2. Обновляем статус
-                c.status = AdStatus.COMPLETED.value
-                await session.commit()
-                
-                # 3. Уведомляем стороны
-                channel = await session.get(Channel, c.channel_id)
-                
-                # Владельцу
-                await self.bot.send_message(
-                    channel.owner_id,
-                    f"🏁 **Рекламная кампания завершена!**\n\n📢 Канал: {channel.title}\n🗑 Пост успешно удален из канала.\n💰 Все средства зачислены на ваш баланс.",
-                    parse_mode="Markdown"
-                )
-                
-                # Рекламодателю + предложение отзыва
-                from keyboards import rating_keyboard
-                await self.bot.send_message(
-                    c.advertiser_id,
-                    f"🏁 **Ваша рекламная кампания завершена!**\n\n📢 Канал: {channel.title}\n🗑 Пост удален согласно сроку размещения.\n\nПожалуйста, оцените работу канала:",
-                    parse_mode="Markdown",
-                    reply_markup=rating_keyboard(c.id)
+            try:
+                # 1. Удаляем пост из канала
+                await self.bot.delete_message(chat_id=c.channel_id, message_id=c.channel_post_id)
+                logger.info(f"🗑 Пост #{c.channel_post_id} удален из канала {c.channel_id} (срок истек)")
+            except Exception as e:
+                logger.error(f"⚠️ Ошибка удаления поста #{c.channel_post_id}: {e}")
+            
+            # 2. Обновляем статус и ставим уведомления в ту же транзакцию
+            c.status = AdStatus.COMPLETED.value
+            c.delete_job_id = None
+            channel = await session.get(Channel, c.channel_id)
+            
+            # Владельцу
+            enqueue(
+                session,
+                channel.owner_id,
+                f"🏁 **Рекламная кампания завершена!**\n\n📢 Канал: {channel.title}\n🗑 Пост успешно удален из канала.\n💰 Все средства зачислены на ваш баланс.",
+                parse_mode="Markdown"
+            )
+            
+            # Рекламодателю + предложение отзыва
+            from keyboards import rating_keyboard
+            enqueue(
+                session,
+                c.advertiser_id,
+                f"🏁 **Ваша рекламная кампания завершена!**\n\n📢 Канал: {channel.title}\n🗑 Пост удален согласно сроку размещения.\n\nПожалуйста, оцените работу канала:",
+                parse_mode="Markdown",
+                reply_markup=rating_keyboard(c.id)
+            )
+            await session.commit()
+            self.scheduler.forget(c.id)
+
+    def watch(self, campaign: AdCampaign):
+        """Поставить только что опубликованный пост на частые пробы"""
+        self.scheduler.watch(
+            PostRef(campaign.id, campaign.channel_id, campaign.channel_post_id,
+                    campaign.inline_button_text, campaign.inline_button_url),
+            campaign.start_date,
+            campaign.end_date
+        )
+
+    async def sync_posts(self):
+        """Сверить расписание проб с активными кампаниями в БД"""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(
+                    AdCampaign.id, AdCampaign.channel_id, AdCampaign.channel_post_id,
+                    AdCampaign.inline_button_text, AdCampaign.inline_button_url,
+                    AdCampaign.start_date, AdCampaign.end_date
+                ).where(
+                    AdCampaign.status == AdStatus.ACTIVE.value,
+                    AdCampaign.channel_post_id.isnot(None)
                 )
+            )
+            self.scheduler.sync((PostRef(*row[:5]), row[5], row[6]) for row in result.all())
+
+    async def probe_due(self) -> dict:
+        """Проверить посты, чья очередь подошла"""
+        refs = self.scheduler.due()
+        if not refs:
+            return {}
+        return await self.checker.sweep(
+            refs,
+            on_deleted=lambda ref: self.on_message_deleted(ref.channel_id, ref.post_id),
+            on_result=self.scheduler.record
+        )
 
     async def start_polling(self):
-        """Проверка каждую минуту"""
+        """Пробы по расписанию и периодическая сверка с БД"""
         logger.info("👀 Запуск отслеживания удалений...")
+        loop = asyncio.get_running_loop()
+        next_sync = 0.0
+        probes = 0
         
         while True:
             try:
-                await self.check_expirations()
-                
-                async with self.session_factory() as session:
-                    result = await session.execute(
-                        select(AdCampaign).where(AdCampaign.status == AdStatus.ACTIVE.value)
-                    )
-                    campaigns = result.scalars().all()
-                    
-                    for c in campaigns:
-                        try:
-                            if c.channel_post_id:
-                                try:
-                                    # Use bot.get_chat_member or bot.get_message to check existence
-                                    # get_chat is for chat info, not for message. 
-                                    # Actually, there is no direct "check if message exists" without fetching it.
-                                    # But we can try to get it.
-                                    await self.bot.forward_message(chat_id=config.ADMIN_IDS[0], from_chat_id=c.channel_id, message_id=c.channel_post_id, disable_notification=True)
-                                except Exception as e:
-                                    err_msg = str(e).lower()
-                                    if "message not found" in err_msg or "message to forward not found" in err_msg:
-                                        await self.on_message_deleted(c.channel_id, c.channel_post_id)
-                                    elif "chat not found" in err_msg or "bot was kicked" in err_msg or "not a member" in err_msg:
-                                        logger.warning(f"⚠️ Канал {c.channel_id} недоступен для проверки: {e}")
-                                    else:
-                                        logger.error(f"Error checking message {c.channel_post_id} in {c.channel_id}: {e}")
-                        except Exception:
-                            pass
-                        await asyncio.sleep(0.5)
-                
-                await asyncio.sleep(60)
-                
+                now = loop.time()
+                if now >= next_sync:
+                    await self.sync_posts()
+                    logger.info(f"👀 Под наблюдением постов: {len(self.scheduler)}, проб с прошлой сверки: {probes}")
+                    probes = 0
+                    next_sync = now + config.POST_PROBE_SYNC_INTERVAL
+                counts = await self.probe_due()
+                probes += sum(counts.values())
             except Exception as e:
                 logger.error(f"Ошибка: {e}")
-                await asyncio.sleep(60)
+            await asyncio.sleep(config.POST_PROBE_TICK)
@@ -6,15 +6,19 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from models import User, Channel
 from keyboards import main_menu, channels_list, channel_actions
 from utils.analytics import calculate_recommended_price
 from utils.channel_stats import ChannelStatsCollector
-from utils.balance import BalanceService
+from utils.balance import BalanceService, get_balance_snapshot
+from config import config
 
 router = Router()
 
+# Устанавливается из bot.py
+stats_refresher = None
+
 
 class AddChannelStates(StatesGroup):
     waiting_for_channel_id = State()
@@ -36,7 +40,7 @@ async def check_bot_admin(bot: Bot, channel_id: int) -> bool:
 
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, session: AsyncSession):
+async def cmd_start(message: Message, command: CommandObject, session: AsyncSession):
     user = await session.get(User, message.from_user.id)
     
     if not user:
@@ -48,6 +52,17 @@ async def cmd_start(message: Message, session: AsyncSession):
         session.add(user)
         await session.commit()
     
+    # Ссылка «Заказать рекламу» из inline-поиска: /start channel_<id>
+    if command.args and command.args.startswith("channel_"):
+        from handlers.advertisers import show_channel_offer
+        try:
+            channel_id = int(command.args[len("channel_"):])
+        except ValueError:
+            channel_id = None
+        if channel_id is not None:
+            await show_channel_offer(message, session, channel_id)
+            return
+    
     await message.answer(
         f"👋 Привет, {user.first_name}!\n\n"
         "💰 **Поденная оплата** - деньги каждый день\n"
@@ -70,33 +85,22 @@ async def cmd_balance(message: Message, session: AsyncSession):
 
 async def show_balance_logic(message: Message, session: AsyncSession, user_id: int):
     """Логика показа баланса"""
-    user = await session.get(User, user_id)
-    from database import AsyncSessionLocal
-    balance_service = BalanceService(AsyncSessionLocal)
-    stats = await balance_service.get_owner_stats(user_id)
-    
-    from models import WithdrawRequest, WithdrawStatus
-    result = await session.execute(
-        select(WithdrawRequest)
-        .where(
-            WithdrawRequest.user_id == user_id,
-            WithdrawRequest.status == WithdrawStatus.PENDING.value
-        )
-    )
-    pending = result.scalars().all()
-    pending_amount = sum(w.amount for w in pending)
-    
-    available = user.balance - user.frozen_balance - pending_amount
+    snapshot = await get_balance_snapshot(session, user_id)
+    if snapshot is None:
+        await message.answer("❌ Пользователь не найден. Нажмите /start")
+        return
+    stats = await BalanceService.get_owner_stats(session, user_id)
+    available = snapshot.available
     
     text = (
         f"💰 **Ваш кошелек**\n\n"
-        f"💵 **Баланс:** `${user.balance:.2f}`\n"
-        f"🔒 **Заморожено:** `${user.frozen_balance:.2f}`\n"
-        f"⏳ **В обработке:** `${pending_amount:.2f}`\n"
+        f"💵 **Баланс:** `${snapshot.balance:.2f}`\n"
+        f"🔒 **Заморожено:** `${snapshot.frozen:.2f}`\n"
+        f"⏳ **В обработке:** `${snapshot.pending:.2f}`\n"
         f"✅ **Доступно:** `${available:.2f}`\n\n"
         f"📊 **Статистика:**\n"
         f"📥 Всего заработано: `${stats['total_earned']:.2f}`\n"
-        f"📤 Всего выведено: `${user.total_withdrawn or 0:.2f}`\n"
+        f"📤 Всего выведено: `${snapshot.total_withdrawn:.2f}`\n"
         f"⚠️ Штрафы: `${stats['total_penalties']:.2f}`\n"
         f"📋 Нарушений: {stats['total_violations']}"
     )
@@ -290,12 +294,8 @@ async def process_price_pin(message: Message, state: FSMContext, session: AsyncS
         await state.clear()
 
 
-@router.callback_query(F.data.startswith("channel_"))
-async def channel_details(callback: CallbackQuery, session: AsyncSession):
-    channel_id = int(callback.data.split("_")[1])
-    channel = await session.get(Channel, channel_id)
-    
-    text = (
+def channel_card(channel: Channel) -> str:
+    return (
         f"📢 **{channel.title}**\n\n"
         f"📊 **Статистика:**\n"
         f"👥 Подписчики: {channel.subscribers:,}\n"
@@ -309,11 +309,46 @@ async def channel_details(callback: CallbackQuery, session: AsyncSession):
         f"✅ Заказов: {channel.completed_orders}\n"
         f"⚠️ Нарушений: {channel.violation_count}"
     )
+
+
+@router.callback_query(F.data.startswith("channel_"))
+async def channel_details(callback: CallbackQuery, session: AsyncSession):
+    channel_id = int(callback.data.split("_")[1])
+    channel = await session.get(Channel, channel_id)
     
-    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=channel_actions(channel.id))
+    await callback.message.edit_text(channel_card(channel), parse_mode="Markdown", reply_markup=channel_actions(channel.id))
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("refresh_channel_"))
+async def refresh_channel(callback: CallbackQuery, session: AsyncSession):
+    """Обновить статистику канала вне очереди"""
+    channel_id = int(callback.data.split("_")[2])
+    channel = await session.get(Channel, channel_id)
+    if not channel or channel.owner_id != callback.from_user.id:
+        await callback.answer("❌ Канал не найден", show_alert=True)
+        return
+    
+    updated_at = channel.stats_updated_at
+    if updated_at and (datetime.utcnow() - updated_at).total_seconds() < config.STATS_REFRESH_COOLDOWN:
+        await callback.answer("✅ Данные уже актуальны")
+        return
+    if stats_refresher is None:
+        await callback.answer("❌ Обновление недоступно, попробуйте позже", show_alert=True)
+        return
+    
+    # Закрываем чтение до запроса к Telegram: запись идет отдельной транзакцией
+    await session.commit()
+    result = await stats_refresher.refresh([channel_id])
+    if not result["updated"]:
+        await callback.answer("❌ Не удалось получить данные. Бот все еще администратор канала?", show_alert=True)
+        return
+    
+    await session.refresh(channel)
+    await callback.message.edit_text(channel_card(channel), parse_mode="Markdown", reply_markup=channel_actions(channel.id))
+    await callback.answer("🔄 Данные обновлены")
+
+
 @router.callback_query(F.data.startswith("set_prices_"))
 async def set_prices_start(callback: CallbackQuery, state: FSMContext):
     channel_id = int(callback.data.split("_")[2])
@@ -6,13 +6,16 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 import logging
 
-from models import AdCampaign, AdStatus, Channel, User
-from keyboards import moderation_keyboard
+from models import AdCampaign, AdStatus, Channel, User, OutboxPriority
+from keyboards import moderation_keyboard, post_keyboard
+from utils.balance import BalanceService
+from utils.outbox import enqueue
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-balance_service = None
+# Устанавливается из bot.py
+deletion_tracker = None
 
 
 class ModerationStates(StatesGroup):
@@ -42,12 +45,8 @@ async def start_moderation(callback: CallbackQuery, session: AsyncSession, bot:
     await callback.answer()
 
 
-async def send_post_for_review(bot: Bot, chat_id: int, campaign: AdCampaign, channel: Channel, advertiser: User):
-    """Отправка поста владельцу на проверку"""
-    from aiogram.utils.keyboard import InlineKeyboardBuilder
-    
-    # Сначала отправляем информацию о заказе
-    info_text = (
+def _review_info_text(campaign: AdCampaign, channel: Channel, advertiser: User) -> str:
+    return (
         f"💎 **НОВЫЙ ЗАКАЗ**\n\n"
         f"📢 **Канал:** {channel.title}\n"
         f"👤 **Рекламодатель:** @{advertiser.username or advertiser.first_name}\n"
@@ -56,14 +55,33 @@ async def send_post_for_review(bot: Bot, chat_id: int, campaign: AdCampaign, cha
         f"📌 **Тип:** {'🔝 Закреп' if campaign.is_pinned else '📝 Обычный'}\n\n"
         f"👇 **ПОСТ НИЖЕ:**"
     )
-    await bot.send_message(chat_id, info_text, parse_mode="Markdown")
 
-    # Формируем клавиатуру самого поста (если есть кнопка)
-    post_reply_markup = None
-    if campaign.inline_button_text and campaign.inline_button_url:
-        post_builder = InlineKeyboardBuilder()
-        post_builder.button(text=campaign.inline_button_text, url=campaign.inline_button_url)
-        post_reply_markup = post_builder.as_markup()
+
+def _review_keyboard(campaign_id: int):
+    from aiogram.utils.keyboard import InlineKeyboardBuilder
+    builder = InlineKeyboardBuilder()
+    builder.button(text="✅ ПРИНЯТЬ И ОПУБЛИКОВАТЬ", callback_data=f"approve_post_{campaign_id}")
+    builder.button(text="❌ ОТКЛОНИТЬ", callback_data=f"reject_post_{campaign_id}")
+    builder.button(text="📝 ЗАМЕЧАНИЕ", callback_data=f"comment_post_{campaign_id}")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+# Тип медиа -> метод Bot и имя аргумента с file_id
+_MEDIA_METHODS = {
+    "photo": ("send_photo", "photo"),
+    "video": ("send_video", "video"),
+    "animation": ("send_animation", "animation"),
+}
+
+
+async def send_post_for_review(bot: Bot, chat_id: int, campaign: AdCampaign, channel: Channel, advertiser: User):
+    """Отправка поста владельцу на проверку"""
+    # Сначала отправляем информацию о заказе
+    await bot.send_message(chat_id, _review_info_text(campaign, channel, advertiser), parse_mode="Markdown")
+
+    # Клавиатура самого поста (если есть кнопка)
+    post_reply_markup = post_keyboard(campaign)
 
     try:
         # Отправляем сам пост
@@ -76,25 +94,32 @@ async def send_post_for_review(bot: Bot, chat_id: int, campaign: AdCampaign, cha
         else:
             await bot.send_message(chat_id, campaign.message_text, reply_markup=post_reply_markup, parse_mode="HTML")
         
-        # Формируем клавиатуру модерации
-        builder = InlineKeyboardBuilder()
-        builder.button(text="✅ ПРИНЯТЬ И ОПУБЛИКОВАТЬ", callback_data=f"approve_post_{campaign.id}")
-        builder.button(text="❌ ОТКЛОНИТЬ", callback_data=f"reject_post_{campaign.id}")
-        builder.button(text="📝 ЗАМЕЧАНИЕ", callback_data=f"comment_post_{campaign.id}")
-        builder.adjust(1)
-        
         # В конце отправляем кнопки управления модерацией
-        await bot.send_message(chat_id, "✅ **Проверьте содержание выше и примите решение:**", parse_mode="Markdown", reply_markup=builder.as_markup())
+        await bot.send_message(chat_id, "✅ **Проверьте содержание выше и примите решение:**", parse_mode="Markdown", reply_markup=_review_keyboard(campaign.id))
         
     except Exception as e:
         logger.error(f"Ошибка отправки на модерацию: {e}")
         # Если произошла ошибка (например, неверный HTML), отправляем как текст
-        builder = InlineKeyboardBuilder()
-        builder.button(text="✅ ПРИНЯТЬ И ОПУБЛИКОВАТЬ", callback_data=f"approve_post_{campaign.id}")
-        builder.button(text="❌ ОТКЛОНИТЬ", callback_data=f"reject_post_{campaign.id}")
-        builder.button(text="📝 ЗАМЕЧАНИЕ", callback_data=f"comment_post_{campaign.id}")
-        builder.adjust(1)
-        await bot.send_message(chat_id, f"❌ Ошибка отображения медиа или разметки.\n\nТекст: {campaign.message_text}", reply_markup=builder.as_markup())
+        await bot.send_message(chat_id, f"❌ Ошибка отображения медиа или разметки.\n\nТекст: {campaign.message_text}", reply_markup=_review_keyboard(campaign.id))
+
+
+def queue_post_for_review(session: AsyncSession, chat_id: int, campaign: AdCampaign, channel: Channel, advertiser: User):
+    """То же через очередь сообщений: уйдет после коммита транзакции сессии"""
+    enqueue(session, chat_id, _review_info_text(campaign, channel, advertiser),
+            priority=OutboxPriority.PAYMENT, parse_mode="Markdown")
+    
+    fallback_text = f"❌ Ошибка отображения медиа или разметки.\n\nТекст: {campaign.message_text}"
+    if campaign.media_type in _MEDIA_METHODS:
+        method, media_arg = _MEDIA_METHODS[campaign.media_type]
+        enqueue(session, chat_id, method=method, priority=OutboxPriority.PAYMENT,
+                reply_markup=post_keyboard(campaign), fallback_text=fallback_text,
+                caption=campaign.message_text, parse_mode="HTML", **{media_arg: campaign.media_file_id})
+    else:
+        enqueue(session, chat_id, campaign.message_text, priority=OutboxPriority.PAYMENT,
+                reply_markup=post_keyboard(campaign), fallback_text=fallback_text, parse_mode="HTML")
+    
+    enqueue(session, chat_id, "✅ **Проверьте содержание выше и примите решение:**",
+            priority=OutboxPriority.PAYMENT, parse_mode="Markdown", reply_markup=_review_keyboard(campaign.id))
 
 
 @router.callback_query(F.data.startswith("approve_post_"))
@@ -113,6 +138,11 @@ async def approve_and_publish(callback: CallbackQuery, session: AsyncSession, bo
         campaign.start_date = datetime.utcnow()
         campaign.end_date = datetime.utcnow() + timedelta(days=campaign.duration_days)
         
+        # График поденных выплат и задача удаления по сроку сохраняются вместе с публикацией
+        BalanceService.schedule_payouts(campaign)
+        if deletion_tracker:
+            deletion_tracker.schedule_expiry(campaign)
+        
         # Если это закреп - закрепляем
         if campaign.is_pinned:
             try:
@@ -121,11 +151,18 @@ async def approve_and_publish(callback: CallbackQuery, session: AsyncSession, bo
             except Exception as e:
                 logger.error(f"⚠️ Ошибка закрепления поста: {e}")
 
+        enqueue(
+            session,
+            campaign.advertiser_id,
+            f"✅ **Реклама опубликована!**\n📢 {channel.title}\n📅 {campaign.duration_days} дн.\n🗑 Удаление: {campaign.end_date.strftime('%d.%m.%Y %H:%M')}",
+            priority=OutboxPriority.PUBLICATION,
+            parse_mode="Markdown"
+        )
         await session.commit()
         
-        # Создаем поденные выплаты
-        if balance_service:
-            await balance_service.create_daily_payments(campaign)
+        # Свежий пост проверяется часто: удаление сразу после публикации - самое частое нарушение
+        if deletion_tracker:
+            deletion_tracker.watch(campaign)
         
         await callback.message.delete()
         await callback.message.answer(
@@ -133,12 +170,6 @@ async def approve_and_publish(callback: CallbackQuery, session: AsyncSession, bo
             parse_mode="Markdown"
         )
         
-        await bot.send_message(
-            campaign.advertiser_id,
-            f"✅ **Реклама опубликована!**\n📢 {channel.title}\n📅 {campaign.duration_days} дн.\n🗑 Удаление: {campaign.end_date.strftime('%d.%m.%Y %H:%M')}",
-            parse_mode="Markdown"
-        )
-        
     except Exception as e:
         await callback.message.answer(f"❌ Ошибка публикации: {str(e)}")
     
@@ -153,6 +184,7 @@ async def reject_post(callback: CallbackQuery, session: AsyncSession, bot: Bot):
     channel = await session.get(Channel, campaign.channel_id)
     
     campaign.status = AdStatus.CANCELLED.value
+    enqueue(session, campaign.advertiser_id, f"❌ Пост отклонен в канале {channel.title}")
     await session.commit()
     
     try:
@@ -161,7 +193,6 @@ async def reject_post(callback: CallbackQuery, session: AsyncSession, bot: Bot):
         pass
         
     await callback.message.answer("❌ Пост отклонен")
-    await bot.send_message(campaign.advertiser_id, f"❌ Пост отклонен в канале {channel.title}")
 
 
 @router.callback_query(F.data.startswith("comment_post_"))
@@ -181,10 +212,12 @@ async def process_comment(message: Message, state: FSMContext, session: AsyncSes
     campaign = await session.get(AdCampaign, data['campaign_id'])
     channel = await session.get(Channel, campaign.channel_id)
     
-    await bot.send_message(
+    enqueue(
+        session,
         campaign.advertiser_id,
         f"📝 **Замечание к посту**\n📢 {channel.title}\n💬 {message.text}"
     )
+    await session.commit()
     
     await message.answer("✅ Замечание отправлено")
     await state.clear()
@@ -192,13 +225,7 @@ async def process_comment(message: Message, state: FSMContext, session: AsyncSes
 
 async def publish_to_channel(bot: Bot, campaign: AdCampaign):
     """Публикация в канал"""
-    from aiogram.utils.keyboard import InlineKeyboardBuilder
-    
-    reply_markup = None
-    if campaign.inline_button_text and campaign.inline_button_url:
-        builder = InlineKeyboardBuilder()
-        builder.button(text=campaign.inline_button_text, url=campaign.inline_button_url)
-        reply_markup = builder.as_markup()
+    reply_markup = post_keyboard(campaign)
     
     # В aiogram 3.x для публикации в канал используется ID канала (campaign.channel_id)
     if campaign.media_type == "photo":
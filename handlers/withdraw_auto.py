@@ -1,4 +1,4 @@
-from aiogram import Router, F, Bot
+from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -6,10 +6,13 @@ from sqlalchemy import select, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 import logging
+import time
+import uuid
 
-from models import User, WithdrawRequest, WithdrawStatus
+from models import WithdrawRequest
 from keyboards import withdraw_currency_keyboard, withdraw_confirmation_keyboard, withdraw_history_keyboard
 from utils.cryptopay_withdraw import CryptoPayWithdraw
+from utils.balance import get_balance_snapshot, invalidate_balance
 from config import config
 
 router = Router()
@@ -25,19 +28,8 @@ class WithdrawStates(StatesGroup):
 @router.callback_query(F.data == "withdraw_start")
 async def withdraw_start(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Начало вывода"""
-    user = await session.get(User, callback.from_user.id)
-    
-    # Считаем доступный баланс
-    result = await session.execute(
-        select(WithdrawRequest)
-        .where(
-            WithdrawRequest.user_id == callback.from_user.id,
-            WithdrawRequest.status == WithdrawStatus.PENDING.value
-        )
-    )
-    pending = result.scalars().all()
-    pending_amount = sum(w.amount for w in pending)
-    available = user.balance - user.frozen_balance - pending_amount
+    snapshot = await get_balance_snapshot(session, callback.from_user.id)
+    available = snapshot.available if snapshot else 0.0
     
     if available < 1:
         await callback.answer("❌ Минимальная сумма $1", show_alert=True)
@@ -81,7 +73,14 @@ async def process_amount(message: Message, state: FSMContext, session: AsyncSess
             await message.answer("❌ Нет доступных валют для этой суммы")
             return
         
-        await state.update_data(amount=amount)
+        # Котировка на весь диалог: дальше курсы не запрашиваются
+        await state.update_data(
+            amount=amount,
+            quotes={c['currency']: c['amount'] for c in currencies},
+            quoted_at=time.time(),
+            # Ключ идемпотентности: повторы подтверждения этого диалога - одна заявка
+            withdraw_key=uuid.uuid4().hex
+        )
         
         text = f"💰 **Сумма: ${amount:.2f}**\n\n🌐 **Выберите валюту:**\n\n"
         for c in currencies:
@@ -101,16 +100,18 @@ async def process_currency(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     amount = data['amount']
     
-    currencies = await CryptoPayWithdraw.get_available_currencies(amount)
-    selected = next((c for c in currencies if c['currency'] == currency), None)
+    amount_crypto = data.get('quotes', {}).get(currency)
+    if amount_crypto is None:
+        await callback.answer("❌ Валюта недоступна", show_alert=True)
+        return
     
-    await state.update_data(currency=currency, amount_crypto=selected['amount'])
+    await state.update_data(currency=currency, amount_crypto=amount_crypto)
     
     await callback.message.edit_text(
         f"✅ **Подтверждение**\n\n"
         f"💰 Сумма: `${amount:.2f}`\n"
         f"💱 Валюта: `{currency}`\n"
-        f"📤 Получите: `{selected['amount']} {currency}`\n\n"
+        f"📤 Получите: `{amount_crypto} {currency}`\n\n"
         f"⚠️ С баланса спишется `${amount:.2f}`\n"
         f"✅ Подтвердить?",
         parse_mode="Markdown",
@@ -121,83 +122,41 @@ async def process_currency(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "withdraw_confirm", WithdrawStates.waiting_for_confirmation)
-async def confirm_withdraw(callback: CallbackQuery, state: FSMContext, session: AsyncSession, bot: Bot):
-    """Подтверждение - создаем чек и списываем"""
+async def confirm_withdraw(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    """Подтверждение - заявка в очередь, чек придет сообщением"""
     data = await state.get_data()
-    user = await session.get(User, callback.from_user.id)
     
-    # Финальная проверка баланса
-    result = await session.execute(
-        select(WithdrawRequest)
-        .where(
-            WithdrawRequest.user_id == callback.from_user.id,
-            WithdrawRequest.status == WithdrawStatus.PENDING.value
-        )
-    )
-    pending = result.scalars().all()
-    pending_amount = sum(w.amount for w in pending)
-    available = user.balance - user.frozen_balance - pending_amount
-    
-    if available < data['amount']:
-        await callback.message.edit_text("❌ Баланс изменился. Попробуйте снова.")
+    if time.time() - data.get('quoted_at', 0) > config.RATES_QUOTE_TTL:
+        await callback.message.edit_text("❌ Курс устарел. Начните вывод заново.")
         await state.clear()
         return
     
-    # Создаем заявку
-    withdraw = WithdrawRequest(
+    # Проверка остатка и резерв суммы - одной транзакцией; повторное нажатие вернет ту же заявку
+    withdraw = await CryptoPayWithdraw.enqueue_withdrawal(
+        session,
         user_id=callback.from_user.id,
         amount=data['amount'],
         amount_crypto=data['amount_crypto'],
         currency=data['currency'],
-        status=WithdrawStatus.PENDING.value
+        key=data.get('withdraw_key') or uuid.uuid4().hex
     )
-    session.add(withdraw)
-    await session.commit()
-    await session.refresh(withdraw)
-    
-    # Обрабатываем вывод (чек + списание)
-    success = await CryptoPayWithdraw.process_withdrawal(session, withdraw.id)
-    
-    if not success:
-        withdraw.status = WithdrawStatus.REJECTED.value
-        await session.commit()
-        await callback.message.edit_text("❌ Ошибка создания чека. Попробуйте другую валюту.")
+    if withdraw is None:
+        await session.rollback()
+        await callback.message.edit_text("❌ Баланс изменился. Попробуйте снова.")
         await state.clear()
         return
-    
-    # Отправляем чек пользователю
-    await callback.message.delete()
-    
-    await callback.message.answer(
-        f"✅ **Вывод выполнен!**\n\n"
-        f"💰 Списано: `${data['amount']:.2f}`\n"
-        f"💎 Получено: `{data['amount_crypto']} {data['currency']}`\n\n"
-        f"🔗 **Ваш чек:**\n`{withdraw.cheque_url}`\n\n"
-        f"📌 Нажмите ссылку → активируйте в @CryptoBot",
-        parse_mode="Markdown",
-        disable_web_page_preview=False
-    )
-    
-    # Кнопка с чеком
-    from aiogram.utils.keyboard import InlineKeyboardBuilder
-    builder = InlineKeyboardBuilder()
-    builder.button(text=f"💎 АКТИВИРОВАТЬ {data['currency']}", url=withdraw.cheque_url)
-    
-    await callback.message.answer(
-        f"🎁 **Чек на {data['amount_crypto']} {data['currency']}**",
-        reply_markup=builder.as_markup()
-    )
-    
-    # Уведомление админам
-    for admin_id in config.ADMIN_IDS:
-        await bot.send_message(
-            admin_id,
-            f"💰 **Выплата**\n👤 @{callback.from_user.username}\n💵 ${data['amount']:.2f} → {data['amount_crypto']} {data['currency']}\n🔗 {withdraw.cheque_url}",
-            disable_web_page_preview=True
-        )
+    await session.commit()
+    invalidate_balance(callback.from_user.id)
     
     await state.clear()
-    await callback.answer("✅ Чек создан!", show_alert=False)
+    await callback.message.edit_text(
+        f"⏳ **Заявка #{withdraw.id} принята**\n\n"
+        f"💰 Сумма: `${data['amount']:.2f}`\n"
+        f"💎 К получению: `{data['amount_crypto']} {data['currency']}`\n\n"
+        f"Чек придет отдельным сообщением через несколько секунд.",
+        parse_mode="Markdown"
+    )
+    await callback.answer("✅ Заявка принята", show_alert=False)
 
 
 @router.callback_query(F.data == "withdraw_cancel", WithdrawStates.waiting_for_confirmation)
@@ -230,7 +189,7 @@ async def withdraw_history_handler(callback: CallbackQuery, session: AsyncSessio
     text = "📋 **История выводов:**\n\n"
     
     for w in withdraws[start:end]:
-        status_emoji = {"completed": "✅", "pending": "⏳", "rejected": "❌", "cancelled": "🚫"}.get(w.status, "⏳")
+        status_emoji = {"completed": "✅", "pending": "⏳", "processing": "🔄", "rejected": "❌", "cancelled": "🚫"}.get(w.status, "⏳")
         text += f"{status_emoji} **#{w.id}** {w.created_at.strftime('%d.%m.%Y')}\n   💰 `${w.amount}` → `{w.amount_crypto} {w.currency}`\n   📊 {w.status}\n\n"
     
     await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=withdraw_history_keyboard(withdraws, page))
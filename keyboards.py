@@ -1,7 +1,7 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from typing import List, Dict
-from models import Channel
+from typing import List, Optional
+from models import Channel, AdCampaign
 
 
 def main_menu(user_role: str) -> InlineKeyboardMarkup:
@@ -65,29 +65,50 @@ def channel_actions(channel_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def ad_offers(channels_data: List[Dict], page: int = 0) -> InlineKeyboardMarkup:
-    """Список каналов для рекламы"""
+def ad_offers(channels: List, page: int = 0, total: int = 0, per_page: int = 5) -> InlineKeyboardMarkup:
+    """Страница списка каналов для рекламы (каналы уже отобраны для страницы)"""
     builder = InlineKeyboardBuilder()
-    per_page = 5
-    start = page * per_page
-    end = start + per_page
     
-    for data in channels_data[start:end]:
-        channel = data['channel']
-        text = f"{channel.title} | 👥 {channel.subscribers:,} | 👀 {channel.avg_views_5:,} | ⭐ {channel.average_rating:.1f}"
-        builder.button(text=text, callback_data=f"view_channel_{channel.id}")
+    for channel in channels:
+        builder.button(text=_offer_label(channel), callback_data=f"view_channel_{channel.id}")
+    builder.adjust(1)
     
     nav_buttons = []
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"offers_page_{page-1}"))
-    if end < len(channels_data):
+    if (page + 1) * per_page < total:
         nav_buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"offers_page_{page+1}"))
     
     if nav_buttons:
         builder.row(*nav_buttons)
     
-    builder.button(text="🔙 Назад", callback_data="main_menu")
+    builder.row(InlineKeyboardButton(text="🔎 Поиск и фильтры", callback_data="search_start"))
+    builder.row(InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu"))
+    return builder.as_markup()
+
+
+def _offer_label(channel) -> str:
+    return f"{channel.title} | 👥 {channel.subscribers:,} | 👀 {channel.avg_views_5:,} | ⭐ {channel.average_rating:.1f}"
+
+
+def search_results(channels: List, next_page: Optional[str], first_page: bool) -> InlineKeyboardMarkup:
+    """Страница результатов поиска; next_page - callback_data следующей страницы"""
+    builder = InlineKeyboardBuilder()
+    
+    for channel in channels:
+        builder.button(text=_offer_label(channel), callback_data=f"view_channel_{channel.id}")
     builder.adjust(1)
+    
+    nav_buttons = []
+    if not first_page:
+        nav_buttons.append(InlineKeyboardButton(text="⏮ В начало", callback_data="search_page_"))
+    if next_page:
+        nav_buttons.append(InlineKeyboardButton(text="▶️", callback_data=next_page))
+    if nav_buttons:
+        builder.row(*nav_buttons)
+    
+    builder.row(InlineKeyboardButton(text="🔎 Изменить фильтры", callback_data="search_start"))
+    builder.row(InlineKeyboardButton(text="🔙 К каталогу", callback_data="find_ads"))
     return builder.as_markup()
 
 
@@ -106,6 +127,16 @@ def channel_offer(channel_id: int, username: str = None) -> InlineKeyboardMarkup
     return builder.as_markup()
 
 
+def inline_channel_offer(channel_id: int, username: Optional[str], bot_username: str) -> InlineKeyboardMarkup:
+    """Кнопки карточки канала из inline-поиска: сообщение отправлено от имени пользователя, поэтому только ссылки"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📝 Заказать рекламу", url=f"https://t.me/{bot_username}?start=channel_{channel_id}")
+    if username:
+        builder.button(text="🔗 Перейти в канал", url=f"https://t.me/{username}")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
 def negotiate_keyboard(campaign_id: int, is_owner: bool = False) -> InlineKeyboardMarkup:
     """Клавиатура торгов"""
     builder = InlineKeyboardBuilder()
@@ -122,6 +153,15 @@ def negotiate_keyboard(campaign_id: int, is_owner: bool = False) -> InlineKeyboa
     return builder.as_markup()
 
 
+def post_keyboard(campaign: AdCampaign) -> Optional[InlineKeyboardMarkup]:
+    """Кнопка рекламного поста (если рекламодатель ее задал)"""
+    if not (campaign.inline_button_text and campaign.inline_button_url):
+        return None
+    builder = InlineKeyboardBuilder()
+    builder.button(text=campaign.inline_button_text, url=campaign.inline_button_url)
+    return builder.as_markup()
+
+
 def moderation_keyboard(campaign_id: int) -> InlineKeyboardMarkup:
     """Модерация поста"""
     builder = InlineKeyboardBuilder()
@@ -0,0 +1,193 @@
+"""Версионированные миграции схемы.
+
+Номер версии хранится в PRAGMA user_version. Новая база создается сразу по
+актуальным моделям, существующая догоняется миграциями по порядку. Каждая
+миграция идемпотентна: базы, созданные старым create_all, проходят их без ошибок.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn
+from typing import Callable, List, Tuple
+import logging
+
+from models import Base, CHANNELS_FTS_DDL, CHANNELS_FTS_TRIGGERS
+
+logger = logging.getLogger(__name__)
+
+
+def _create_missing_tables(conn: Connection):
+    Base.metadata.create_all(conn, checkfirst=True)
+
+
+def _create_index(conn: Connection, table_name: str, index_name: str):
+    table = Base.metadata.tables[table_name]
+    index = next(i for i in table.indexes if i.name == index_name)
+    index.create(conn, checkfirst=True)
+
+
+def _hot_path_indexes(conn: Connection):
+    for table_name, index_name in [
+        ("daily_payments", "ix_daily_payments_status_date"),
+        ("daily_payments", "ix_daily_payments_campaign_status"),
+        ("daily_payments", "ix_daily_payments_owner_status"),
+        ("ad_campaigns", "ix_ad_campaigns_status_end"),
+        ("ad_campaigns", "ix_ad_campaigns_post"),
+        ("ad_campaigns", "ix_ad_campaigns_advertiser"),
+        ("withdraw_requests", "ix_withdraw_requests_user_status"),
+        ("withdraw_requests", "ix_withdraw_requests_user_created"),
+        ("crypto_payments", "ix_crypto_payments_invoice"),
+        ("channels", "ix_channels_catalog"),
+        ("channels", "ix_channels_owner"),
+        ("reviews", "ix_reviews_campaign"),
+    ]:
+        _create_index(conn, table_name, index_name)
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _create_tables(conn: Connection, *table_names: str):
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables[t] for t in table_names], checkfirst=True)
+
+
+def _payout_runs(conn: Connection):
+    _create_tables(conn, "payout_runs", "payout_chunks")
+
+
+def _add_column(conn: Connection, table_name: str, column_name: str):
+    if column_name in {c["name"] for c in inspect(conn).get_columns(table_name)}:
+        return
+    column = Base.metadata.tables[table_name].c[column_name]
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {ddl}")
+
+
+def _payout_schedules(conn: Connection):
+    _add_column(conn, "ad_campaigns", "payout_start_date")
+    _add_column(conn, "ad_campaigns", "paid_days")
+    _add_column(conn, "daily_payments", "days")
+    _create_index(conn, "ad_campaigns", "ix_ad_campaigns_status_id")
+
+    # Построчный график -> курсор в кампании; PENDING-строки больше не нужны
+    conn.exec_driver_sql(
+        "UPDATE ad_campaigns SET "
+        "payout_start_date = (SELECT min(dp.payment_date) FROM daily_payments dp "
+        "WHERE dp.campaign_id = ad_campaigns.id), "
+        "paid_days = coalesce((SELECT max(dp.day_number) FROM daily_payments dp "
+        "WHERE dp.campaign_id = ad_campaigns.id AND dp.status = 'paid'), 0) "
+        "WHERE id IN (SELECT campaign_id FROM daily_payments)"
+    )
+    conn.exec_driver_sql("DELETE FROM daily_payments WHERE status = 'pending'")
+
+    # Курсоры незавершенных прогонов указывали на daily_payments; по графику
+    # повторный проход безопасен, поэтому начинаем их заново
+    conn.exec_driver_sql("UPDATE payout_runs SET cursor_id = 0 WHERE status != 'completed'")
+
+
+def _owner_stats(conn: Connection):
+    _create_tables(conn, "owner_stats")
+
+    # Начальные значения - из истории; дальше счетчики ведутся приращениями
+    conn.exec_driver_sql(
+        "INSERT OR REPLACE INTO owner_stats "
+        "(owner_id, total_earned, paid_days, total_penalties, total_violations, total_withdrawn, updated_at) "
+        "SELECT u.id, "
+        "coalesce((SELECT sum(dp.amount) FROM daily_payments dp WHERE dp.owner_id = u.id AND dp.status = 'paid'), 0), "
+        "coalesce((SELECT sum(dp.days) FROM daily_payments dp WHERE dp.owner_id = u.id AND dp.status = 'paid'), 0), "
+        "coalesce((SELECT sum(c.total_penalty_amount) FROM channels c WHERE c.owner_id = u.id), 0), "
+        "coalesce((SELECT sum(c.violation_count) FROM channels c WHERE c.owner_id = u.id), 0), "
+        "coalesce(u.total_withdrawn, 0), "
+        "datetime('now') "
+        "FROM users u "
+        "WHERE EXISTS (SELECT 1 FROM channels c WHERE c.owner_id = u.id) OR coalesce(u.total_withdrawn, 0) > 0"
+    )
+
+
+def _outbox(conn: Connection):
+    _create_tables(conn, "outbox_messages")
+
+
+def _fsm_states(conn: Connection):
+    _create_tables(conn, "fsm_states")
+
+
+def _withdraw_queue(conn: Connection):
+    for column in ("idempotency_key", "attempts", "next_attempt_at", "lease_until", "check_requested_at"):
+        _add_column(conn, "withdraw_requests", column)
+    _create_index(conn, "withdraw_requests", "ix_withdraw_requests_key")
+    _create_index(conn, "withdraw_requests", "ix_withdraw_requests_due")
+
+
+def _channel_history(conn: Connection):
+    _create_tables(conn, "channel_history")
+
+
+def _channel_anomaly(conn: Connection):
+    _create_tables(conn, "channel_anomaly")
+
+
+def _channel_search(conn: Connection):
+    # Keyset-пагинация сравнивает рейтинг и качество: NULL выпал бы из выдачи
+    conn.exec_driver_sql("UPDATE channels SET average_rating = 0 WHERE average_rating IS NULL")
+    conn.exec_driver_sql("UPDATE channels SET quality_score = 0 WHERE quality_score IS NULL")
+    # В индекс каталога добавлен id - пересоздаем
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_channels_catalog")
+    for index_name in ("ix_channels_catalog", "ix_channels_subscribers", "ix_channels_price_post"):
+        _create_index(conn, "channels", index_name)
+    _rebuild_channels_fts(conn)
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _rebuild_channels_fts(conn: Connection):
+    # Состав колонок виртуальной таблицы не меняется через ALTER - пересоздаем с триггерами
+    for trigger in CHANNELS_FTS_TRIGGERS:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.exec_driver_sql("DROP TABLE IF EXISTS channels_fts")
+    for statement in CHANNELS_FTS_DDL:
+        conn.exec_driver_sql(statement)
+    conn.exec_driver_sql(
+        "INSERT INTO channels_fts (rowid, title, username) "
+        "SELECT id, coalesce(title, ''), coalesce(username, '') FROM channels"
+    )
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "базовая схема", _create_missing_tables),
+    (2, "индексы горячих запросов", _hot_path_indexes),
+    (3, "журнал прогонов выплат", _payout_runs),
+    (4, "графики выплат вместо строки на каждый день", _payout_schedules),
+    (5, "накопленная статистика владельцев", _owner_stats),
+    (6, "очередь исходящих сообщений", _outbox),
+    (7, "хранилище состояний диалогов", _fsm_states),
+    (8, "очередь выводов", _withdraw_queue),
+    (9, "история подписчиков каналов", _channel_history),
+    (10, "детектор накрутки подписчиков", _channel_anomaly),
+    (11, "поиск каналов: FTS5 по названиям и индексы фильтров", _channel_search),
+    (12, "FTS5 по username каналов и префиксы для inline-поиска", _rebuild_channels_fts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def _set_version(conn: Connection, version: int):
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def upgrade(conn: Connection):
+    """Привести схему к последней версии (вызывать внутри транзакции)"""
+    current = get_version(conn)
+
+    if current == 0 and not inspect(conn).get_table_names():
+        Base.metadata.create_all(conn)
+        _set_version(conn, LATEST_VERSION)
+        logger.info(f"🗄 Создана новая БД, версия схемы {LATEST_VERSION}")
+        return
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"🗄 Миграция {version}: {description}")
+        migrate(conn)
+        _set_version(conn, version)
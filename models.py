@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Column, BigInteger, String, Float, DateTime, Boolean, 
-    ForeignKey, Text, Integer, JSON
+    ForeignKey, Text, Integer, JSON, Index, LargeBinary, DDL, event
 )
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
@@ -39,6 +39,26 @@ class DailyPaymentStatus(str, enum.Enum):
     CANCELLED = "cancelled"
 
 
+class PayoutRunStatus(str, enum.Enum):
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class OutboxStatus(str, enum.Enum):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+class OutboxPriority(int, enum.Enum):
+    """Меньше - срочнее"""
+    PAYMENT = 0
+    PUBLICATION = 10
+    NOTICE = 50
+
+
 class WithdrawStatus(str, enum.Enum):
     PENDING = "pending"
     PROCESSING = "processing"
@@ -125,6 +145,36 @@ class Channel(Base):
     reviews = relationship("Review", back_populates="channel", cascade="all, delete-orphan")
     daily_payments = relationship("DailyPayment", back_populates="channel", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Каталог и поиск: фильтр по статусу, сортировка по рейтингу/качеству/id (keyset)
+        Index("ix_channels_catalog", "status", "is_suspicious", "average_rating", "quality_score", "id"),
+        # Поиск: выборочные диапазоны подписчиков и цены поста
+        Index("ix_channels_subscribers", "status", "is_suspicious", "subscribers"),
+        Index("ix_channels_price_post", "status", "is_suspicious", "price_post"),
+        Index("ix_channels_owner", "owner_id"),
+    )
+
+
+# Полнотекстовый индекс названий и username каналов (FTS5), rowid = id канала; триггеры держат его
+# в актуальном виде. prefix - готовые префиксы из 1-3 символов для поиска по мере набора (inline-режим)
+CHANNELS_FTS_TRIGGERS = ("channels_fts_insert", "channels_fts_update", "channels_fts_delete")
+CHANNELS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS channels_fts USING fts5("
+    "title, username, prefix='1 2 3', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS channels_fts_insert AFTER INSERT ON channels BEGIN "
+    "INSERT INTO channels_fts (rowid, title, username) "
+    "VALUES (new.id, coalesce(new.title, ''), coalesce(new.username, '')); END",
+    "CREATE TRIGGER IF NOT EXISTS channels_fts_update AFTER UPDATE OF id, title, username ON channels BEGIN "
+    "DELETE FROM channels_fts WHERE rowid = old.id; "
+    "INSERT INTO channels_fts (rowid, title, username) "
+    "VALUES (new.id, coalesce(new.title, ''), coalesce(new.username, '')); END",
+    "CREATE TRIGGER IF NOT EXISTS channels_fts_delete AFTER DELETE ON channels BEGIN "
+    "DELETE FROM channels_fts WHERE rowid = old.id; END",
+]
+
+for _statement in CHANNELS_FTS_DDL:
+    event.listen(Channel.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
 
 class AdCampaign(Base):
     __tablename__ = "ad_campaigns"
@@ -169,6 +219,11 @@ class AdCampaign(Base):
     end_date = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # График поденных выплат: день 1 выплачивается в payout_start_date,
+    # paid_days - сколько дней уже выплачено владельцу
+    payout_start_date = Column(DateTime, nullable=True)
+    paid_days = Column(Integer, default=0, server_default="0")
+    
     # Платеж
     payment_id = Column(Integer, nullable=True)
     payment_status = Column(String(50), default="pending")
@@ -190,8 +245,16 @@ class AdCampaign(Base):
     reviews = relationship("Review", back_populates="campaign", cascade="all, delete-orphan")
     dispute = relationship("Dispute", back_populates="campaign", uselist=False, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_ad_campaigns_status_end", "status", "end_date"),
+        Index("ix_ad_campaigns_status_id", "status", "id"),
+        Index("ix_ad_campaigns_post", "channel_id", "channel_post_id", "status"),
+        Index("ix_ad_campaigns_advertiser", "advertiser_id", "created_at"),
+    )
+
 
 class DailyPayment(Base):
+    """Проводка поденной выплаты: создается, когда деньги реально зачислены"""
     __tablename__ = "daily_payments"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -199,7 +262,9 @@ class DailyPayment(Base):
     channel_id = Column(BigInteger, ForeignKey("channels.id", ondelete="CASCADE"))
     owner_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"))
     
+    # Последний оплаченный день и число дней в проводке
     day_number = Column(Integer)
+    days = Column(Integer, default=1, server_default="1")
     amount = Column(Float)
     payment_date = Column(DateTime)
     
@@ -215,6 +280,69 @@ class DailyPayment(Base):
     channel = relationship("Channel", back_populates="daily_payments")
     owner = relationship("User", foreign_keys=[owner_id], back_populates="daily_payments_received")
 
+    __table_args__ = (
+        Index("ix_daily_payments_status_date", "status", "payment_date"),
+        Index("ix_daily_payments_campaign_status", "campaign_id", "status"),
+        Index("ix_daily_payments_owner_status", "owner_id", "status", "amount"),
+    )
+
+
+class PayoutRun(Base):
+    """Журнал ежедневных прогонов выплат"""
+    __tablename__ = "payout_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    slot = Column(DateTime, unique=True)
+    
+    status = Column(String(50), default=PayoutRunStatus.RUNNING.value)
+    
+    # Чекпоинт: id последней обработанной кампании
+    cursor_id = Column(Integer, default=0)
+    
+    chunks_done = Column(Integer, default=0)
+    paid_count = Column(Integer, default=0)
+    paid_amount = Column(Float, default=0.0)
+    
+    started_at = Column(DateTime, default=datetime.utcnow)
+    heartbeat_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+    
+    chunks = relationship("PayoutChunk", back_populates="run", cascade="all, delete-orphan")
+
+
+class PayoutChunk(Base):
+    """Примененный пакет выплат; ключ не дает применить пакет дважды"""
+    __tablename__ = "payout_chunks"
+
+    key = Column(String(64), primary_key=True)
+    run_id = Column(Integer, ForeignKey("payout_runs.id", ondelete="CASCADE"))
+    
+    # Диапазон id проводок daily_payments, созданных пакетом
+    first_payment_id = Column(Integer)
+    last_payment_id = Column(Integer)
+    payments = Column(Integer)
+    amount = Column(Float)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    run = relationship("PayoutRun", back_populates="chunks")
+
+
+class OwnerStats(Base):
+    """Накопленная статистика владельца; обновляется в транзакциях выплат, штрафов и выводов"""
+    __tablename__ = "owner_stats"
+
+    owner_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    
+    total_earned = Column(Float, default=0.0, server_default="0")
+    paid_days = Column(Integer, default=0, server_default="0")
+    total_penalties = Column(Float, default=0.0, server_default="0")
+    total_violations = Column(Integer, default=0, server_default="0")
+    total_withdrawn = Column(Float, default=0.0, server_default="0")
+    
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 
 class CryptoPayment(Base):
     __tablename__ = "crypto_payments"
@@ -237,6 +365,10 @@ class CryptoPayment(Base):
     campaign = relationship("AdCampaign", back_populates="payment")
     user = relationship("User", back_populates="payments")
 
+    __table_args__ = (
+        Index("ix_crypto_payments_invoice", "crypto_pay_invoice_id"),
+    )
+
 
 class WithdrawRequest(Base):
     __tablename__ = "withdraw_requests"
@@ -259,8 +391,95 @@ class WithdrawRequest(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     processed_at = Column(DateTime, nullable=True)
     
+    # Очередь выводов: ключ идемпотентности диалога, попытки и аренда воркера
+    idempotency_key = Column(String(64), nullable=True)
+    attempts = Column(Integer, default=0, server_default="0")
+    next_attempt_at = Column(DateTime, nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+    # Когда отправлен createCheck; при неясном исходе чек ищется, а не создается заново
+    check_requested_at = Column(DateTime, nullable=True)
+    
     user = relationship("User", back_populates="withdraw_requests")
 
+    __table_args__ = (
+        Index("ix_withdraw_requests_user_status", "user_id", "status", "amount"),
+        Index("ix_withdraw_requests_user_created", "user_id", "created_at"),
+        Index("ix_withdraw_requests_key", "idempotency_key", unique=True),
+        Index("ix_withdraw_requests_due", "status", "next_attempt_at"),
+    )
+
+
+class OutboxMessage(Base):
+    """Исходящее сообщение; отправляется диспетчером с учетом лимитов Bot API"""
+    __tablename__ = "outbox_messages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger)
+    
+    # Метод Bot (send_message, send_photo, ...) и его аргументы кроме chat_id
+    method = Column(String(50), default="send_message")
+    payload = Column(JSON)
+    reply_markup = Column(JSON, nullable=True)
+    # Отправляется вместо сообщения, если Telegram его отверг (например, кривая разметка)
+    fallback_text = Column(Text, nullable=True)
+    
+    priority = Column(Integer, default=OutboxPriority.NOTICE.value)
+    status = Column(String(20), default=OutboxStatus.PENDING.value)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    lease_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_messages_due", "status", "priority", "next_attempt_at"),
+        Index("ix_outbox_messages_chat", "chat_id", "status"),
+    )
+
+
+class FSMRecord(Base):
+    """Состояние диалога пользователя (FSM); истекает через FSM_TTL после последнего шага"""
+    __tablename__ = "fsm_states"
+
+    key = Column(String(255), primary_key=True)
+    state = Column(String(255), nullable=True)
+    # Компактный JSON данных шага
+    data = Column(Text, nullable=False, default="{}", server_default="{}")
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_fsm_states_expires", "expires_at"),
+    )
+
+
+class ChannelHistory(Base):
+    """История подписчиков канала: упакованные ряды int64 (время, значение), см. utils/timeseries.py"""
+    __tablename__ = "channel_history"
+
+    channel_id = Column(BigInteger, ForeignKey("channels.id", ondelete="CASCADE"), primary_key=True)
+    raw = Column(LargeBinary, nullable=True)
+    hourly = Column(LargeBinary, nullable=True)
+    daily = Column(LargeBinary, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ChannelAnomaly(Base):
+    """Состояние потокового детектора накрутки канала (utils/anomaly.py)"""
+    __tablename__ = "channel_anomaly"
+
+    channel_id = Column(BigInteger, ForeignKey("channels.id", ondelete="CASCADE"), primary_key=True)
+    last_value = Column(Integer, nullable=True)
+    last_at = Column(DateTime, nullable=True)
+    samples = Column(Integer, default=0, server_default="0")
+    # EWMA и дисперсия относительного прироста подписчиков в сутки
+    rate_mean = Column(Float, default=0.0, server_default="0")
+    rate_var = Column(Float, default=0.0, server_default="0")
+    cusum = Column(Float, default=0.0, server_default="0")
+    cusum_gain = Column(Integer, default=0, server_default="0")
+    flagged_at = Column(DateTime, nullable=True)
+
 
 class Review(Base):
     __tablename__ = "reviews"
@@ -279,6 +498,10 @@ class Review(Base):
     channel = relationship("Channel", back_populates="reviews")
     author = relationship("User", back_populates="reviews_written")
 
+    __table_args__ = (
+        Index("ix_reviews_campaign", "campaign_id"),
+    )
+
 
 class Dispute(Base):
     __tablename__ = "disputes"
@@ -0,0 +1,25 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations
+from database import build_engine
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Фабрика сессий на временной SQLite-базе со схемой последней версии"""
+    engine = build_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(migrations.upgrade)
+
+    asyncio.run(setup())
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(engine.dispose())
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from models import AdCampaign, AdStatus, Channel, DailyPayment, PayoutRun, PayoutRunStatus, User
+from utils.payouts import PayoutEngine, payout_slot
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingEngine(PayoutEngine):
+    """Падает после заданного числа примененных пакетов - как процесс, убитый посреди прогона"""
+
+    def __init__(self, session_factory, crash_after: int):
+        super().__init__(session_factory, chunk_size=3)
+        self.crash_after = crash_after
+
+    async def pay_chunk(self, run_id: int) -> bool:
+        if self.crash_after == 0:
+            raise Crash()
+        self.crash_after -= 1
+        return await super().pay_chunk(run_id)
+
+
+async def seed(session_factory, slot, campaigns: int, days: int, status=AdStatus.ACTIVE.value):
+    start = slot - timedelta(days=days - 1)
+    async with session_factory() as session:
+        session.add(User(id=1, first_name="owner", balance=0, frozen_balance=0, total_earned=0))
+        session.add(Channel(id=-1, owner_id=1, title="channel"))
+        for i in range(1, campaigns + 1):
+            session.add(AdCampaign(
+                id=i, advertiser_id=1, channel_id=-1, status=status, price_per_day=2.0,
+                duration_days=days, payout_start_date=start, paid_days=0
+            ))
+        await session.commit()
+
+
+async def totals(session_factory):
+    async with session_factory() as session:
+        paid = dict((await session.execute(
+            select(DailyPayment.campaign_id, func.sum(DailyPayment.days)).group_by(DailyPayment.campaign_id)
+        )).all())
+        balance = (await session.get(User, 1)).balance
+        run = (await session.execute(select(PayoutRun))).scalar_one()
+    return paid, balance, run.status
+
+
+def test_resumed_run_pays_each_day_once(db):
+    slot = payout_slot()
+
+    async def scenario():
+        await seed(db, slot, campaigns=10, days=3)
+        with pytest.raises(Crash):
+            await CrashingEngine(db, crash_after=2).run(slot)
+        paid, balance, status = await totals(db)
+        assert status == PayoutRunStatus.FAILED.value
+        assert sum(paid.values()) == 6 * 3
+
+        # Перезапуск дозавершает прогон с чекпоинта, повторный - ничего не платит
+        await PayoutEngine(db, chunk_size=3).catch_up()
+        await PayoutEngine(db, chunk_size=3).catch_up()
+        return await totals(db)
+
+    paid, balance, status = asyncio.run(scenario())
+    assert status == PayoutRunStatus.COMPLETED.value
+    assert paid == {i: 3 for i in range(1, 11)}
+    assert balance == pytest.approx(10 * 3 * 2.0)
+
+
+def test_catch_up_pays_campaigns_expired_during_outage(db):
+    slot = payout_slot()
+
+    async def scenario():
+        # Бот был выключен: задача истечения успела завершить кампании раньше догоняющего прогона
+        await seed(db, slot, campaigns=2, days=4, status=AdStatus.COMPLETED.value)
+        await PayoutEngine(db).run(slot)
+        return await totals(db)
+
+    paid, balance, _ = asyncio.run(scenario())
+    assert paid == {1: 4, 2: 4}
+    assert balance == pytest.approx(2 * 4 * 2.0)
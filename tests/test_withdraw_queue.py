@@ -0,0 +1,46 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from models import User, WithdrawRequest
+from utils.balance import get_balance_snapshot
+from utils.cryptopay_withdraw import CryptoPayWithdraw
+
+
+async def request(session_factory, key: str):
+    async with session_factory() as session:
+        withdraw = await CryptoPayWithdraw.enqueue_withdrawal(session, 1, 30.0, 30.0, "USDT", key)
+        await session.commit()
+        return withdraw.id if withdraw else None
+
+
+def test_replayed_request_reserves_once(db):
+    async def scenario():
+        async with db() as session:
+            session.add(User(id=1, first_name="owner", balance=100, frozen_balance=0, total_earned=100))
+            await session.commit()
+
+        first = await request(db, "1:withdraw:abc")
+        replay = await request(db, "1:withdraw:abc")
+
+        async with db() as session:
+            count = (await session.execute(select(func.count(WithdrawRequest.id)))).scalar_one()
+            snapshot = await get_balance_snapshot(session, 1, fresh=True)
+        return first, replay, count, snapshot.available
+
+    first, replay, count, available = asyncio.run(scenario())
+    assert first is not None and replay == first
+    assert count == 1
+    assert available == 70
+
+
+def test_distinct_keys_cannot_overdraw(db):
+    async def scenario():
+        async with db() as session:
+            session.add(User(id=1, first_name="owner", balance=50, frozen_balance=0, total_earned=50))
+            await session.commit()
+        return [await request(db, f"1:withdraw:{n}") for n in range(2)]
+
+    first, second = asyncio.run(scenario())
+    assert first is not None
+    assert second is None
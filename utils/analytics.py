@@ -1,22 +1,28 @@
-from typing import Dict
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Ступени CPM: просмотры ниже _CPM_BOUNDS[i] - цена _CPM_VALUES[i], от 50000 - последняя
+_CPM_BOUNDS = (100, 500, 1000, 5000, 10000, 50000)
+_CPM_VALUES = (0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0)
 
 
 def calculate_cpm(avg_views: int) -> float:
     """CPM за 1000 просмотров"""
-    if avg_views < 100:
-        return 0.5
-    elif avg_views < 500:
-        return 1.0
-    elif avg_views < 1000:
-        return 1.5
-    elif avg_views < 5000:
-        return 2.0
-    elif avg_views < 10000:
-        return 2.5
-    elif avg_views < 50000:
-        return 3.0
-    else:
-        return 4.0
+    return _CPM_VALUES[bisect_right(_CPM_BOUNDS, avg_views)]
+
+
+def _err_factor(err: float) -> float:
+    """Поправка CPM на вовлеченность: подозрительно высокий ERR дешевле"""
+    if err > 50:
+        return 0.7
+    elif err > 30:
+        return 1.3
+    elif err > 15:
+        return 1.1
+    elif err < 5:
+        return 0.8
+    return 1.0
 
 
 def calculate_err(subscribers: int, avg_views: int) -> float:
@@ -34,14 +40,7 @@ def calculate_recommended_price(subscribers: int, avg_views: int) -> Dict[str, f
     cpm = calculate_cpm(avg_views)
     err = calculate_err(subscribers, avg_views)
     
-    if err > 50:
-        cpm *= 0.7
-    elif err > 30:
-        cpm *= 1.3
-    elif err > 15:
-        cpm *= 1.1
-    elif err < 5:
-        cpm *= 0.8
+    cpm *= _err_factor(err)
     
     post_price = round((avg_views / 1000) * cpm, 2)
     pin_price = round(post_price * 2, 2)
@@ -60,3 +59,155 @@ def calculate_recommended_price(subscribers: int, avg_views: int) -> Dict[str, f
 def calculate_total_price(price_per_day: float, days: int) -> float:
     """Общая стоимость за N дней"""
     return round(price_per_day * days, 2)
+
+
+def calculate_quality(subscribers: int, err: float, growth_30d: Optional[float] = None) -> Tuple[int, str]:
+    """Оценка качества канала по ERR (для крупных каналов планка ниже) с поправкой
+    на прирост подписчиков за 30 дней в процентах из истории замеров"""
+    score, label = _err_quality(subscribers, err)
+    return max(0, min(100, score + _growth_adjustment(growth_30d))), label
+
+
+# Ступени качества по ERR: ERR выше _QUALITY_*_BOUNDS[i - 1] - i-я оценка; у каналов
+# от 10000 подписчиков (_BIG_CHANNEL) планка ниже
+_BIG_CHANNEL = 10000
+_QUALITY_BIG_BOUNDS = (5, 10, 15, 25)
+_QUALITY_BIG = ((25, "Низкое"), (45, "Среднее"), (65, "Хорошее"), (80, "Отличное"), (95, "Топ"))
+_QUALITY_SMALL_BOUNDS = (15, 25, 40)
+_QUALITY_SMALL = ((30, "Низкое"), (50, "Среднее"), (70, "Хорошее"), (85, "Отличное"))
+
+
+def _err_quality(subscribers: int, err: float) -> Tuple[int, str]:
+    if subscribers > _BIG_CHANNEL:
+        return _QUALITY_BIG[bisect_left(_QUALITY_BIG_BOUNDS, err)]
+    return _QUALITY_SMALL[bisect_left(_QUALITY_SMALL_BOUNDS, err)]
+
+
+def _growth_adjustment(growth_30d: Optional[float]) -> int:
+    """Отток аудитории снижает оценку, ровный рост - повышает; резкий рост
+    не поощряется (им занимается детектор накрутки). None - истории меньше 30 дней"""
+    if growth_30d is None:
+        return 0
+    if growth_30d < -10:
+        return -15
+    if growth_30d < -3:
+        return -5
+    if 2 <= growth_30d <= 50:
+        return 5
+    return 0
+
+
+def calculate_suspicion(subscribers: int, err: float, uniform_views: bool = False, growth_spike: bool = False) -> int:
+    """Детектор накрутки; uniform_views - у последних постов одинаковые ненулевые просмотры,
+    growth_spike - детектор отметил скачок подписчиков (utils/anomaly.py)"""
+    score = 0
+    if err > 70:
+        score += 50
+    elif err > 50:
+        score += 30
+    if uniform_views:
+        score += 40
+    if growth_spike:
+        score += 30
+    if subscribers > 20000 and err < 3:
+        score += 35
+    return score
+
+
+# Балл накрутки, выше которого канал скрывается из каталога
+SUSPICION_THRESHOLD = 50
+
+
+def is_suspicious(score: int, growth_spike: bool = False) -> bool:
+    """Флаг накрутки: балл выше порога или действующий флаг детектора подписчиков.
+
+    Просмотры бот не читает, поэтому у небольших каналов балл держится на одном
+    скачке (+30) и порога сам не достигает - флаг детектора решает отдельно.
+    """
+    return growth_spike or score > SUSPICION_THRESHOLD
+
+
+def is_uniform(views: Sequence[int]) -> bool:
+    return len(set(views)) == 1 and views[0] > 0
+
+
+@dataclass
+class CatalogPricing:
+    """Результат price_catalog: по списку на показатель, i-й элемент - i-й канал"""
+    post: List[float]
+    pin: List[float]
+    err: List[float]
+    quality_score: List[int]
+    quality_label: List[str]
+    suspicion_score: List[int]
+    suspicious: List[bool]
+
+
+def price_catalog(
+    subscribers: Sequence[int],
+    avg_views: Sequence[int],
+    recent_views: Optional[Sequence[Sequence[int]]] = None,
+    growth_spikes: Optional[Sequence[bool]] = None,
+    growth_30d: Optional[Sequence[Optional[float]]] = None
+) -> CatalogPricing:
+    """Цены, ERR, качество и накрутка для всего каталога по столбцам.
+
+    Дает те же значения, что calculate_recommended_price, calculate_quality,
+    calculate_suspicion и is_suspicious по каждому каналу. recent_views - просмотры последних
+    постов каналов, growth_spikes - скачки подписчиков, growth_30d - прирост
+    подписчиков за 30 дней в процентах; без них эти признаки не учитываются.
+
+    Каждый показатель считается отдельным проходом по столбцу с порогами из
+    таблиц модуля, без словаря и кортежа на канал: так каталог считается
+    быстрее поштучного расчета (benchmarks/bench_pricing.py).
+    """
+    if len(subscribers) != len(avg_views):
+        raise ValueError("subscribers и avg_views разной длины")
+    subs_col = [s or 0 for s in subscribers]
+    views_col = [v or 0 for v in avg_views]
+    err_col = [v / s * 100 if s else 0 for s, v in zip(subs_col, views_col)]
+
+    bounds, values = _CPM_BOUNDS, _CPM_VALUES
+    price_col = [
+        round((v / 1000) * (values[bisect_right(bounds, v)]
+                            * (0.7 if e > 50 else 1.3 if e > 30 else 1.1 if e > 15 else 0.8 if e < 5 else 1.0)), 2)
+        if s and v else None
+        for s, v, e in zip(subs_col, views_col, err_col)
+    ]
+    post = [0.0 if p is None else max(p, 0.5) for p in price_col]
+    pin = [0.0 if p is None else max(round(p * 2, 2), 1.0) for p in price_col]
+
+    big, small = _QUALITY_BIG, _QUALITY_SMALL
+    big_bounds, small_bounds = _QUALITY_BIG_BOUNDS, _QUALITY_SMALL_BOUNDS
+    quality = [
+        big[bisect_left(big_bounds, e)] if s > _BIG_CHANNEL else small[bisect_left(small_bounds, e)]
+        for s, e in zip(subs_col, err_col)
+    ]
+    quality_score = [q[0] for q in quality]
+    if growth_30d:
+        quality_score = [max(0, min(100, q + _growth_adjustment(g))) for q, g in zip(quality_score, growth_30d)]
+
+    suspicion = [
+        (50 if e > 70 else 30 if e > 50 else 0) + (35 if s > 20000 and e < 3 else 0)
+        for s, e in zip(subs_col, err_col)
+    ]
+    if recent_views is not None:
+        suspicion = [
+            score + 40 if v and len(set(v)) == 1 and v[0] > 0 else score
+            for score, v in zip(suspicion, recent_views)
+        ]
+    if growth_spikes:
+        suspicion = [score + 30 if spike else score for score, spike in zip(suspicion, growth_spikes)]
+        suspicious = [bool(spike) or score > SUSPICION_THRESHOLD for score, spike in zip(suspicion, growth_spikes)]
+    else:
+        suspicious = [score > SUSPICION_THRESHOLD for score in suspicion]
+
+    return CatalogPricing(
+        post=post,
+        pin=pin,
+        err=[round(e, 2) for e in err_col],
+        quality_score=quality_score,
+        quality_label=[q[1] for q in quality],
+        suspicion_score=suspicion,
+        suspicious=suspicious
+    )
@@ -0,0 +1,164 @@
+from datetime import datetime
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Iterable, Optional
+import math
+
+from models import ChannelAnomaly
+from utils.timeseries import DAY, epoch
+from config import config
+
+
+class DetectorState:
+    """Скользящая статистика канала: последний замер, EWMA и дисперсия суточного
+    прироста, накопитель CUSUM и момент последнего срабатывания"""
+
+    __slots__ = ("last_value", "last_ts", "samples", "mean", "var", "cusum", "cusum_gain", "flagged_ts")
+
+    def __init__(
+        self,
+        last_value: Optional[int] = None,
+        last_ts: Optional[int] = None,
+        samples: int = 0,
+        mean: float = 0.0,
+        var: float = 0.0,
+        cusum: float = 0.0,
+        cusum_gain: int = 0,
+        flagged_ts: Optional[int] = None
+    ):
+        self.last_value = last_value
+        self.last_ts = last_ts
+        self.samples = samples
+        self.mean = mean
+        self.var = var
+        self.cusum = cusum
+        self.cusum_gain = cusum_gain
+        self.flagged_ts = flagged_ts
+
+
+class SpikeDetector:
+    """Потоковый детектор накрученных подписчиков, O(1) на замер.
+
+    Сигнал - относительный прирост подписчиков в сутки между замерами. Его
+    EWMA и экспоненциальная дисперсия обновляются каждым нормальным замером;
+    аномальный в статистику не попадает. Срабатывание:
+    - разовый скачок: z-оценка выше ANOMALY_Z при приросте от ANOMALY_MIN_JUMP;
+    - ступенька: односторонний CUSUM по z выше ANOMALY_CUSUM_H при накопленном
+      за время роста приросте от ANOMALY_MIN_JUMP (накрутка небольшими порциями).
+    Флаг держится ANOMALY_HOLD секунд. Первые ANOMALY_WARMUP замеров только
+    обучают статистику; замеры чаще ANOMALY_MIN_INTERVAL пропускаются.
+    """
+
+    def __init__(
+        self,
+        alpha: Optional[float] = None,
+        z_threshold: Optional[float] = None,
+        cusum_k: Optional[float] = None,
+        cusum_h: Optional[float] = None,
+        min_jump: Optional[int] = None,
+        min_std: Optional[float] = None,
+        warmup: Optional[int] = None,
+        min_interval: Optional[int] = None,
+        hold: Optional[int] = None
+    ):
+        self.alpha = alpha or config.ANOMALY_ALPHA
+        self.z_threshold = z_threshold or config.ANOMALY_Z
+        self.cusum_k = cusum_k if cusum_k is not None else config.ANOMALY_CUSUM_K
+        self.cusum_h = cusum_h or config.ANOMALY_CUSUM_H
+        self.min_jump = min_jump if min_jump is not None else config.ANOMALY_MIN_JUMP
+        self.min_var = (min_std or config.ANOMALY_MIN_STD) ** 2
+        self.warmup = warmup if warmup is not None else config.ANOMALY_WARMUP
+        self.min_interval = min_interval if min_interval is not None else config.ANOMALY_MIN_INTERVAL
+        self.hold = hold or config.ANOMALY_HOLD
+
+    def is_flagged(self, state: DetectorState, t: int) -> bool:
+        return state.flagged_ts is not None and t - state.flagged_ts < self.hold
+
+    def update(self, state: DetectorState, t: int, value: int) -> bool:
+        """Учесть замер; вернуть, помечен ли канал"""
+        if state.last_value is None:
+            state.last_value, state.last_ts = value, t
+            return self.is_flagged(state, t)
+        dt = t - state.last_ts
+        if dt < self.min_interval:
+            return self.is_flagged(state, t)
+
+        jump = value - state.last_value
+        rate = jump / max(state.last_value, 1) / (dt / DAY)
+        anomaly = False
+        if state.samples >= self.warmup:
+            z = (rate - state.mean) / math.sqrt(max(state.var, self.min_var))
+            state.cusum = max(0.0, state.cusum + z - self.cusum_k)
+            state.cusum_gain = state.cusum_gain + jump if state.cusum > 0 else 0
+            spike = z > self.z_threshold and jump >= self.min_jump
+            step = state.cusum > self.cusum_h and state.cusum_gain >= self.min_jump
+            anomaly = spike or step
+
+        if anomaly:
+            state.flagged_ts = t
+            state.cusum, state.cusum_gain = 0.0, 0
+        else:
+            diff = rate - state.mean
+            increment = self.alpha * diff
+            state.mean += increment
+            state.var = (1 - self.alpha) * (state.var + diff * increment)
+            state.samples += 1
+        state.last_value, state.last_ts = value, t
+        return self.is_flagged(state, t)
+
+
+_table = ChannelAnomaly.__table__
+
+_COLUMNS = ("last_value", "last_at", "samples", "rate_mean", "rate_var", "cusum", "cusum_gain", "flagged_at")
+
+_upsert = insert(_table).values(channel_id=bindparam("b_channel_id"), **{c: bindparam(f"b_{c}") for c in _COLUMNS})
+_upsert = _upsert.on_conflict_do_update(
+    index_elements=[_table.c.channel_id],
+    set_={c: getattr(_upsert.excluded, c) for c in _COLUMNS}
+)
+
+
+def _from_epoch(t: Optional[int]) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(t) if t is not None else None
+
+
+async def load_states(session: AsyncSession, channel_ids: Iterable[int]) -> Dict[int, DetectorState]:
+    """Состояния детектора одним запросом; у канала без замеров - пустое"""
+    channel_ids = list(channel_ids)
+    states = {channel_id: DetectorState() for channel_id in channel_ids}
+    if not channel_ids:
+        return states
+    rows = await session.execute(select(_table).where(_table.c.channel_id.in_(channel_ids)))
+    for row in rows:
+        states[row.channel_id] = DetectorState(
+            last_value=row.last_value,
+            last_ts=epoch(row.last_at) if row.last_at else None,
+            samples=row.samples or 0,
+            mean=row.rate_mean or 0.0,
+            var=row.rate_var or 0.0,
+            cusum=row.cusum or 0.0,
+            cusum_gain=row.cusum_gain or 0,
+            flagged_ts=epoch(row.flagged_at) if row.flagged_at else None
+        )
+    return states
+
+
+async def save_states(session: AsyncSession, states: Dict[int, DetectorState]):
+    """Записать состояния одним пакетным upsert"""
+    if not states:
+        return
+    await session.execute(_upsert, [
+        {
+            "b_channel_id": channel_id,
+            "b_last_value": state.last_value,
+            "b_last_at": _from_epoch(state.last_ts),
+            "b_samples": state.samples,
+            "b_rate_mean": state.mean,
+            "b_rate_var": state.var,
+            "b_cusum": state.cusum,
+            "b_cusum_gain": state.cusum_gain,
+            "b_flagged_at": _from_epoch(state.flagged_ts)
+        }
+        for channel_id, state in states.items()
+    ])
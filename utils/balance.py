@@ -1,91 +1,106 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from datetime import datetime, timedelta
+from sqlalchemy import select, func
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
 import logging
+import time
 
-from models import User, Channel, AdCampaign, DailyPayment, DailyPaymentStatus, AdStatus
+from models import User, Channel, AdCampaign, AdStatus, WithdrawRequest, WithdrawStatus
+from database import begin_immediate
+from utils.owner_stats import bump_owner_stats, get_owner_stats as read_owner_stats
 from config import config
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class BalanceSnapshot:
+    """Баланс пользователя на момент чтения"""
+    balance: float
+    frozen: float
+    pending: float
+    total_withdrawn: float
+
+    @property
+    def available(self) -> float:
+        return self.balance - self.frozen - self.pending
+
+
+# user_id -> (момент устаревания, снимок)
+_snapshot_cache: Dict[int, Tuple[float, BalanceSnapshot]] = {}
+
+
+def invalidate_balance(*user_ids: int):
+    """Сбросить кэш снимков; вызывать после коммита, изменившего баланс или заявки"""
+    for user_id in user_ids:
+        _snapshot_cache.pop(user_id, None)
+
+
+async def get_balance_snapshot(session: AsyncSession, user_id: int, fresh: bool = False) -> Optional[BalanceSnapshot]:
+    """Баланс, заморозка и сумма заявок на вывод в обработке одним запросом.
+
+    fresh=True читает мимо кэша - для проверок перед списанием.
+    """
+    now = time.monotonic()
+    if not fresh:
+        cached = _snapshot_cache.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    pending = (
+        select(func.coalesce(func.sum(WithdrawRequest.amount), 0.0))
+        .where(
+            WithdrawRequest.user_id == user_id,
+            WithdrawRequest.status.in_([WithdrawStatus.PENDING.value, WithdrawStatus.PROCESSING.value])
+        )
+        .scalar_subquery()
+    )
+    row = (await session.execute(
+        select(User.balance, User.frozen_balance, User.total_withdrawn, pending)
+        .where(User.id == user_id)
+    )).first()
+    if row is None:
+        return None
+
+    snapshot = BalanceSnapshot(
+        balance=float(row[0] or 0),
+        frozen=float(row[1] or 0),
+        pending=float(row[3] or 0),
+        total_withdrawn=float(row[2] or 0)
+    )
+    _snapshot_cache[user_id] = (now + config.BALANCE_CACHE_TTL, snapshot)
+    return snapshot
+
+
 class BalanceService:
     """Сервис балансов и поденных выплат"""
     
     def __init__(self, session_factory):
         self.session_factory = session_factory
     
-    async def create_daily_payments(self, campaign: AdCampaign):
-        """Создает поденные выплаты на каждый день"""
-        async with self.session_factory() as session:
-            channel = await session.get(Channel, campaign.channel_id)
-            
-            for day in range(1, campaign.duration_days + 1):
-                payment_date = campaign.start_date.replace(hour=12, minute=0) + timedelta(days=day-1)
-                
-                daily = DailyPayment(
-                    campaign_id=campaign.id,
-                    channel_id=campaign.channel_id,
-                    owner_id=channel.owner_id,
-                    day_number=day,
-                    amount=campaign.price_per_day,
-                    payment_date=payment_date,
-                    status=DailyPaymentStatus.PENDING.value
-                )
-                session.add(daily)
-            
-            await session.commit()
-            logger.info(f"✅ Создано {campaign.duration_days} выплат для кампании #{campaign.id}")
+    @staticmethod
+    def schedule_payouts(campaign: AdCampaign):
+        """График поденных выплат: день 1 - в 12:00 дня публикации, далее раз в сутки"""
+        campaign.payout_start_date = campaign.start_date.replace(hour=12, minute=0, second=0, microsecond=0)
+        campaign.paid_days = 0
     
-    async def process_daily_payouts(self):
+    async def process_daily_payouts(self) -> dict:
         """Ежедневные выплаты в 12:00"""
-        async with self.session_factory() as session:
-            today = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
-            
-            result = await session.execute(
-                select(DailyPayment)
-                .where(
-                    DailyPayment.payment_date <= today,
-                    DailyPayment.status == DailyPaymentStatus.PENDING.value
-                )
-            )
-            payments = result.scalars().all()
-            
-            for payment in payments:
-                campaign = await session.get(AdCampaign, payment.campaign_id)
-                
-                if campaign.status != AdStatus.ACTIVE.value:
-                    payment.status = DailyPaymentStatus.CANCELLED.value
-                    continue
-                
-                owner = await session.get(User, payment.owner_id)
-                owner.balance += payment.amount
-                owner.total_earned = (owner.total_earned or 0) + payment.amount
-                
-                payment.status = DailyPaymentStatus.PAID.value
-                payment.paid_at = datetime.utcnow()
-                
-                logger.info(f"💰 Выплата ${payment.amount} владельцу {owner.id}")
-            
-            await session.commit()
+        from utils.payouts import PayoutEngine
+        return await PayoutEngine(self.session_factory).run()
     
     async def apply_penalty(self, campaign_id: int) -> dict:
         """Штраф 50% за досрочное удаление"""
         async with self.session_factory() as session:
+            # Балансы меняются и выплатами - читаем их под блокировкой записи
+            await begin_immediate(session)
             campaign = await session.get(AdCampaign, campaign_id)
             channel = await session.get(Channel, campaign.channel_id)
             owner = await session.get(User, channel.owner_id)
             
-            # Считаем уже выплаченное
-            result = await session.execute(
-                select(DailyPayment)
-                .where(
-                    DailyPayment.campaign_id == campaign_id,
-                    DailyPayment.status == DailyPaymentStatus.PAID.value
-                )
-            )
-            paid = result.scalars().all()
-            earned = sum(p.amount for p in paid)
+            # Уже выплачено по графику
+            earned = (campaign.paid_days or 0) * campaign.price_per_day
             
             penalty = earned * config.PENALTY_PERCENT
             
@@ -95,16 +110,7 @@ class BalanceService:
                 advertiser = await session.get(User, campaign.advertiser_id)
                 advertiser.balance += penalty
                 
-                # Отменяем будущие выплаты
-                await session.execute(
-                    update(DailyPayment)
-                    .where(
-                        DailyPayment.campaign_id == campaign_id,
-                        DailyPayment.status == DailyPaymentStatus.PENDING.value
-                    )
-                    .values(status=DailyPaymentStatus.CANCELLED.value)
-                )
-                
+                # Будущие выплаты прекращаются вместе с переходом кампании в VIOLATION
                 campaign.is_violated = True
                 campaign.violated_at = datetime.utcnow()
                 campaign.penalty_amount = penalty
@@ -112,8 +118,10 @@ class BalanceService:
                 
                 channel.violation_count += 1
                 channel.total_penalty_amount += penalty
+                await bump_owner_stats(session, owner.id, total_penalties=penalty, total_violations=1)
                 
                 await session.commit()
+                invalidate_balance(owner.id, advertiser.id)
                 
                 return {
                     "penalty": penalty,
@@ -124,30 +132,7 @@ class BalanceService:
             
             return None
     
-    async def get_owner_stats(self, owner_id: int) -> dict:
-        """Статистика владельца"""
-        async with self.session_factory() as session:
-            result = await session.execute(
-                select(DailyPayment)
-                .where(
-                    DailyPayment.owner_id == owner_id,
-                    DailyPayment.status == DailyPaymentStatus.PAID.value
-                )
-            )
-            payments = result.scalars().all()
-            total_earned = sum(p.amount for p in payments)
-            
-            channels_result = await session.execute(
-                select(Channel).where(Channel.owner_id == owner_id)
-            )
-            channels = channels_result.scalars().all()
-            
-            total_penalties = sum(c.total_penalty_amount for c in channels)
-            total_violations = sum(c.violation_count for c in channels)
-            
-            return {
-                "total_earned": round(float(total_earned), 2),
-                "total_penalties": round(float(total_penalties), 2),
-                "total_violations": int(total_violations),
-                "net_income": round(float(total_earned - total_penalties), 2)
-            }
+    @staticmethod
+    async def get_owner_stats(session: AsyncSession, owner_id: int) -> dict:
+        """Статистика владельца (сессия вызывающего хендлера)"""
+        return await read_owner_stats(session, owner_id)
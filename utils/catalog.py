@@ -0,0 +1,147 @@
+from bisect import bisect_left, insort
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import logging
+import time
+
+from models import Channel, ChannelStatus
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogEntry:
+    """Поля канала, нужные списку предложений"""
+
+    __slots__ = ("id", "title", "username", "subscribers", "avg_views_5", "average_rating", "quality_score",
+                 "price_post", "price_pin")
+
+    def __init__(self, id, title, username, subscribers, avg_views_5, average_rating, quality_score, price_post, price_pin):
+        self.id = id
+        self.title = title
+        self.username = username
+        self.subscribers = subscribers or 0
+        self.avg_views_5 = avg_views_5 or 0
+        self.average_rating = average_rating or 0.0
+        self.quality_score = quality_score or 0
+        self.price_post = price_post or 0.0
+        self.price_pin = price_pin or 0.0
+
+    @property
+    def sort_key(self) -> Tuple[float, int, int]:
+        # Как в каталоге: рейтинг, затем качество по убыванию; id - для устойчивого порядка
+        return -self.average_rating, -self.quality_score, self.id
+
+
+LISTING_COLUMNS = (
+    Channel.id, Channel.title, Channel.username, Channel.subscribers, Channel.avg_views_5,
+    Channel.average_rating, Channel.quality_score, Channel.price_post, Channel.price_pin
+)
+LISTED = (Channel.status == ChannelStatus.ACTIVE.value, Channel.is_suspicious == False)
+
+
+class CatalogIndex:
+    """Каталог активных неподозрительных каналов в памяти процесса, заранее отсортированный.
+
+    Страница - срез отсортированного списка ключей, O(размер страницы). Коммит,
+    изменивший канал (через ORM или помеченный touch()), помечает его устаревшим;
+    перед выдачей страницы такие каналы перечитываются одним запросом и
+    переставляются в списке. Раз в CATALOG_RELOAD_INTERVAL индекс перечитывается
+    целиком - так видны изменения из других процессов.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._entries: Dict[int, CatalogEntry] = {}
+        self._order: List[Tuple[float, int, int]] = []
+        self._stale: Set[int] = set()
+        self._loaded_at: Optional[float] = None
+        # Растет при каждом изменении каталога в процессе - по нему сбрасываются кэши выдачи
+        self.version = 0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def mark_stale(self, channel_ids: Iterable[int]):
+        self._stale.update(channel_ids)
+        self.version += 1
+
+    def _remove(self, channel_id: int):
+        entry = self._entries.pop(channel_id, None)
+        if entry is not None:
+            i = bisect_left(self._order, entry.sort_key)
+            del self._order[i]
+
+    def _put(self, entry: CatalogEntry):
+        self._remove(entry.id)
+        self._entries[entry.id] = entry
+        insort(self._order, entry.sort_key)
+
+    async def load(self, session: AsyncSession):
+        """Перечитать каталог целиком"""
+        # Изменения, закоммиченные во время чтения, останутся помеченными
+        self._stale.clear()
+        rows = (await session.execute(select(*LISTING_COLUMNS).where(*LISTED))).all()
+        entries = {row.id: CatalogEntry(*row) for row in rows}
+        self._entries = entries
+        self._order = sorted(entry.sort_key for entry in entries.values())
+        self._loaded_at = self.clock()
+        logger.info(f"📚 Каталог загружен: {len(entries)} каналов")
+
+    async def _refresh_stale(self, session: AsyncSession):
+        channel_ids, self._stale = self._stale, set()
+        rows = (await session.execute(
+            select(*LISTING_COLUMNS).where(Channel.id.in_(channel_ids), *LISTED)
+        )).all()
+        listed = {row.id for row in rows}
+        for row in rows:
+            self._put(CatalogEntry(*row))
+        for channel_id in channel_ids - listed:
+            self._remove(channel_id)
+
+    async def sync(self, session: AsyncSession):
+        """Привести индекс в актуальное состояние перед чтением"""
+        async with self._lock:
+            if self._loaded_at is None or self.clock() - self._loaded_at >= config.CATALOG_RELOAD_INTERVAL:
+                await self.load(session)
+            elif self._stale:
+                await self._refresh_stale(session)
+
+    async def page(self, session: AsyncSession, page: int, per_page: int = 5) -> Tuple[List[CatalogEntry], int]:
+        """Каналы страницы page и общее число каналов в каталоге"""
+        await self.sync(session)
+        start = max(page, 0) * per_page
+        keys = self._order[start:start + per_page]
+        return [self._entries[key[2]] for key in keys], len(self._order)
+
+
+# Общий индекс процесса
+catalog = CatalogIndex()
+
+
+def touch(session: Session, *channel_ids: int):
+    """Пометить каналы измененными в транзакции сессии (для UPDATE мимо ORM)"""
+    session.info.setdefault("catalog", set()).update(channel_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_channels(session: Session, flush_context):
+    changed = [obj.id for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, Channel)]
+    if changed:
+        touch(session, *changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _stale_after_commit(session: Session):
+    changed = session.info.pop("catalog", None)
+    if changed:
+        catalog.mark_stale(changed)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_after_rollback(session: Session, previous_transaction):
+    session.info.pop("catalog", None)
@@ -1,13 +1,23 @@
 from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Iterable, Optional
 import asyncio
 import logging
+import math
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import update
+from sqlalchemy import select, update, bindparam
 
-from models import Channel
-from utils.analytics import calculate_recommended_price, calculate_err
+from models import Channel, ChannelStatus
+from database import begin_immediate
+from utils.timeseries import DAY, epoch, growth, load_histories, record_subscribers
+from utils.anomaly import SpikeDetector, load_states, save_states
+from utils.catalog import touch
+from utils.ratelimit import RateLimiter, TokenBucket, limiter as default_limiter
+from config import config
+from utils.analytics import (
+    calculate_recommended_price, calculate_err, calculate_quality, calculate_suspicion, is_suspicious, is_uniform, price_catalog
+)
 
 logger = logging.getLogger(__name__)
 
@@ -43,61 +53,17 @@ class ChannelStatsCollector:
             views.append(0)
         return views[:limit]
     
-    async def analyze_channel(self, channel_id: int) -> Dict:
-        """Анализ канала"""
+    async def analyze_channel(self, channel_id: int, growth_30d: Optional[float] = None) -> Dict:
+        """Анализ канала; growth_30d - прирост подписчиков за 30 дней в процентах (история замеров)"""
         subscribers = await self.get_channel_subscribers(channel_id)
         views = await self.get_recent_posts_views(channel_id)
         
         avg_views = int(sum(views) / len(views)) if views else 0
         err = calculate_err(subscribers, avg_views)
         
-        # Оценка качества
-        quality_score = 0
-        quality_label = "Низкое"
-        
-        if subscribers > 10000:
-            if err > 25:
-                quality_score = 95
-                quality_label = "Топ"
-            elif err > 15:
-                quality_score = 80
-                quality_label = "Отличное"
-            elif err > 10:
-                quality_score = 65
-                quality_label = "Хорошее"
-            elif err > 5:
-                quality_score = 45
-                quality_label = "Среднее"
-            else:
-                quality_score = 25
-                quality_label = "Низкое"
-        else:
-            if err > 40:
-                quality_score = 85
-                quality_label = "Отличное"
-            elif err > 25:
-                quality_score = 70
-                quality_label = "Хорошее"
-            elif err > 15:
-                quality_score = 50
-                quality_label = "Среднее"
-            else:
-                quality_score = 30
-                quality_label = "Низкое"
-        
+        quality_score, quality_label = calculate_quality(subscribers, err, growth_30d)
         # Детектор накрутки
-        suspicion_score = 0
-        
-        if err > 70:
-            suspicion_score += 50
-        elif err > 50:
-            suspicion_score += 30
-        
-        if len(set(views)) == 1 and views[0] > 0:
-            suspicion_score += 40
-        
-        if subscribers > 20000 and err < 3:
-            suspicion_score += 35
+        suspicion_score = calculate_suspicion(subscribers, err, is_uniform(views))
         
         recommended = calculate_recommended_price(subscribers, avg_views)
         
@@ -108,7 +74,7 @@ class ChannelStatsCollector:
             "quality_score": quality_score,
             "quality_label": quality_label,
             "suspicion_score": suspicion_score,
-            "is_suspicious": suspicion_score > 50,
+            "is_suspicious": is_suspicious(suspicion_score),
             "recommended_price_post": recommended["post"],
             "recommended_price_pin": recommended["pin"]
         }
@@ -116,7 +82,8 @@ class ChannelStatsCollector:
     async def update_channel_stats(self, session: AsyncSession, channel_id: int) -> Dict:
         """Обновление статистики в БД"""
         try:
-            stats = await self.analyze_channel(channel_id)
+            history = (await load_histories(session, [channel_id]))[channel_id]
+            stats = await self.analyze_channel(channel_id, growth_30d(history.series(), datetime.utcnow()))
             
             await session.execute(
                 update(Channel)
@@ -134,9 +101,207 @@ class ChannelStatsCollector:
                     stats_updated_at=datetime.utcnow()
                 )
             )
+            # UPDATE мимо ORM: каталог и кэш поиска перечитают канал после коммита
+            touch(session, channel_id)
             await session.commit()
             return stats
         except Exception as e:
             logger.error(f"Ошибка обновления {channel_id}: {e}")
             await session.rollback()
             raise
+
+
+def growth_30d(series, now: datetime) -> Optional[float]:
+    """Прирост подписчиков за 30 дней в процентах; None - истории меньше 30 дней"""
+    change = growth(series, 30 * DAY, epoch(now))
+    return change[1] if change else None
+
+
+async def reprice_catalog(session_factory) -> int:
+    """Пересчитать рекомендованные цены всего каталога; вернуть число изменившихся каналов.
+
+    Цены считаются по сохраненным подписчикам и просмотрам одним проходом
+    price_catalog и пишутся одним UPDATE по всем изменившимся каналам.
+    """
+    table = Channel.__table__
+    async with session_factory() as session:
+        # Чтение и запись одной транзакцией: обновление статистики канала не затрется старыми ценами
+        await begin_immediate(session)
+        rows = (await session.execute(
+            select(table.c.id, table.c.subscribers, table.c.avg_views_5, table.c.suggested_price_post, table.c.suggested_price_pin)
+        )).all()
+        prices = price_catalog([r.subscribers for r in rows], [r.avg_views_5 for r in rows])
+        changed = [
+            {"b_id": r.id, "b_post": post, "b_pin": pin}
+            for r, post, pin in zip(rows, prices.post, prices.pin)
+            if r.suggested_price_post != post or r.suggested_price_pin != pin
+        ]
+        if changed:
+            await session.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values(suggested_price_post=bindparam("b_post"), suggested_price_pin=bindparam("b_pin")),
+                changed
+            )
+        await session.commit()
+    logger.info(f"💲 Пересчет цен каталога: изменено {len(changed)} из {len(rows)}")
+    return len(changed)
+
+
+class StatsRefresher:
+    """Фоновое обновление статистики каталога.
+
+    Каждый тик (STATS_REFRESH_INTERVAL) берет столько самых устаревших каналов,
+    чтобы весь каталог обновлялся за STATS_REFRESH_WINDOW. Новые и просроченные
+    каналы идут первыми, остальные - по давности с весом выручки (цена поста * заказы).
+    get_chat_member_count идут параллельно через общий лимитер Bot API и свой
+    бюджет STATS_REFRESH_RATE запросов в секунду, чтобы не теснить рассылки.
+    Замеры дописываются в историю подписчиков (utils/timeseries.py) и в потоковый
+    детектор накрутки (utils/anomaly.py), метрики пересчитываются price_catalog
+    с учетом его флагов и прироста за 30 дней по истории и пишутся одним UPDATE на тик.
+    Просмотры бот читать не может - берутся сохраненные avg_views_5.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        session_factory,
+        limiter: Optional[RateLimiter] = None,
+        concurrency: Optional[int] = None,
+        rate: Optional[float] = None
+    ):
+        self.bot = bot
+        self.session_factory = session_factory
+        self.limiter = limiter or default_limiter
+        self.concurrency = concurrency or config.STATS_REFRESH_CONCURRENCY
+        self.rate = rate or config.STATS_REFRESH_RATE
+        self.budget = TokenBucket(self.rate, capacity=1)
+        self.detector = SpikeDetector()
+
+    def batch_size(self, total: int) -> int:
+        """Каналов за тик: доля каталога на окно, но не больше бюджета запросов на тик"""
+        needed = math.ceil(total * config.STATS_REFRESH_INTERVAL / config.STATS_REFRESH_WINDOW)
+        allowed = max(1, int(self.rate * config.STATS_REFRESH_INTERVAL * 0.8))
+        if needed > allowed:
+            logger.warning(
+                f"⚠️ Статистика {total} каналов не успеет обновиться за окно: нужно {needed} за тик, бюджет {allowed}"
+            )
+        return min(needed, allowed)
+
+    async def _pick(self) -> List[int]:
+        now = datetime.utcnow()
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(Channel.id, Channel.stats_updated_at, Channel.price_post, Channel.completed_orders)
+                .where(Channel.status != ChannelStatus.BLOCKED.value)
+            )).all()
+        if not rows:
+            return []
+
+        def priority(row):
+            # Новые и просроченные сверх окна - первыми, остальные по давности с весом выручки
+            if row.stats_updated_at is None:
+                return 2, 0.0
+            age = (now - row.stats_updated_at).total_seconds()
+            if age >= config.STATS_REFRESH_WINDOW:
+                return 1, age
+            revenue = (row.price_post or 0) * (1 + (row.completed_orders or 0))
+            return 0, age * (1 + math.log1p(revenue))
+
+        rows = sorted(rows, key=priority, reverse=True)
+        return [r.id for r in rows[:self.batch_size(len(rows))]]
+
+    async def _fetch(self, channel_id: int) -> Optional[int]:
+        """Подписчики канала; None - канал недоступен, ... - повторить в следующий раз"""
+        await self.budget.acquire()
+        await self.limiter.acquire()
+        try:
+            return await self.bot.get_chat_member_count(channel_id)
+        except TelegramRetryAfter as e:
+            self.limiter.pause(e.retry_after)
+            return ...
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            logger.warning(f"⚠️ Канал {channel_id} недоступен для статистики: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка подписчиков {channel_id}: {e}")
+            return ...
+
+    async def refresh(self, channel_ids: Iterable[int]) -> Dict[str, int]:
+        """Обновить статистику каналов; вернуть число обновленных и недоступных"""
+        channel_ids = list(channel_ids)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(channel_id: int):
+            async with semaphore:
+                return await self._fetch(channel_id)
+
+        counts = await asyncio.gather(*(fetch(c) for c in channel_ids))
+        fetched = {c: n for c, n in zip(channel_ids, counts) if isinstance(n, int)}
+        unreachable = [c for c, n in zip(channel_ids, counts) if n is None]
+        now = datetime.utcnow()
+        table = Channel.__table__
+
+        async with self.session_factory() as session:
+            await begin_immediate(session)
+            ids = list(fetched)
+            views = dict((await session.execute(
+                select(table.c.id, table.c.avg_views_5).where(table.c.id.in_(ids))
+            )).all()) if ids else {}
+            ids = [c for c in ids if c in views]
+            # Замер ложится в историю и в детектор накрутки той же транзакцией
+            histories = await record_subscribers(session, {c: fetched[c] for c in ids}, now)
+            states = await load_states(session, ids)
+            t = epoch(now)
+            spikes = [self.detector.update(states[c], t, fetched[c]) for c in ids]
+            await save_states(session, states)
+            metrics = price_catalog(
+                [fetched[c] for c in ids], [views[c] for c in ids],
+                growth_spikes=spikes, growth_30d=[growth_30d(histories[c].series(), now) for c in ids]
+            )
+            params = [
+                {
+                    "b_id": channel_id,
+                    "b_subscribers": fetched[channel_id],
+                    "b_err": metrics.err[i],
+                    "b_quality_score": metrics.quality_score[i],
+                    "b_quality_label": metrics.quality_label[i],
+                    "b_suspicion_score": metrics.suspicion_score[i],
+                    "b_is_suspicious": metrics.suspicious[i],
+                    "b_post": metrics.post[i],
+                    "b_pin": metrics.pin[i]
+                }
+                for i, channel_id in enumerate(ids)
+            ]
+            if params:
+                await session.execute(
+                    update(table).where(table.c.id == bindparam("b_id")).values(
+                        subscribers=bindparam("b_subscribers"),
+                        err=bindparam("b_err"),
+                        quality_score=bindparam("b_quality_score"),
+                        quality_label=bindparam("b_quality_label"),
+                        suspicion_score=bindparam("b_suspicion_score"),
+                        is_suspicious=bindparam("b_is_suspicious"),
+                        suggested_price_post=bindparam("b_post"),
+                        suggested_price_pin=bindparam("b_pin"),
+                        stats_updated_at=now
+                    ),
+                    params
+                )
+            # UPDATE мимо ORM: подписчики и флаг накрутки видны в каталоге после коммита
+            touch(session, *ids)
+            if unreachable:
+                # Недоступный канал уходит в конец очереди, метрики остаются прежними
+                await session.execute(
+                    update(table).where(table.c.id.in_(unreachable)).values(stats_updated_at=now)
+                )
+            await session.commit()
+        return {"updated": len(params), "unreachable": len(unreachable)}
+
+    async def run_once(self) -> Dict[str, int]:
+        channel_ids = await self._pick()
+        if not channel_ids:
+            return {"updated": 0, "unreachable": 0}
+        result = await self.refresh(channel_ids)
+        logger.info(f"📊 Статистика каналов: обновлено {result['updated']}, недоступно {result['unreachable']}")
+        return result
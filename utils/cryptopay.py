@@ -1,16 +1,21 @@
-from aiocryptopay import AioCryptoPay, Networks
+from aiohttp import web
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
+from typing import Dict, Optional, Tuple
+import hashlib
+import hmac
+import json
 import logging
-from typing import Optional
+import time
 
 from config import config
-from models import CryptoPayment
+from models import CryptoPayment, AdCampaign, AdStatus, Channel, User, OutboxPriority
+from utils.cryptopay_client import cp
+from utils.outbox import enqueue
 
 logger = logging.getLogger(__name__)
 
-cp = AioCryptoPay(token=config.CRYPTO_PAY_TOKEN, network=Networks.MAIN_NET)
-
 
 async def create_invoice(amount: float, currency: str = "USDT", description: str = ""):
     try:
@@ -18,7 +23,7 @@ async def create_invoice(amount: float, currency: str = "USDT", description: str
             amount=amount,
             asset=currency,
             description=description or "Оплата рекламы",
-            expires_in=3600,
+            expires_in=config.INVOICE_EXPIRES_IN,
             paid_btn_name="openChannel",
             paid_btn_url="https://t.me/ad_bot",
             allow_comments=False,
@@ -65,12 +70,107 @@ async def create_payment(session: AsyncSession, campaign_id: int, user_id: int,
         return None
 
 
+# Последний неоплаченный статус инвойса: повторные нажатия "проверить" не ходят в API
+_status_cache: Dict[int, Tuple[float, str]] = {}
+
+
 async def check_invoice_status(invoice_id: int) -> str:
+    cached = _status_cache.get(invoice_id)
+    if cached and time.monotonic() - cached[0] < config.PAYMENT_CHECK_COOLDOWN:
+        return cached[1]
     try:
         invoices = await cp.get_invoices(invoice_ids=[invoice_id])
-        if invoices and invoices[0]:
-            return invoices[0].status
-        return "not_found"
+        status = invoices[0].status if invoices and invoices[0] else "not_found"
     except Exception as e:
         logger.error(f"Ошибка проверки статуса: {e}")
         return "error"
+    if status == "paid":
+        _status_cache.pop(invoice_id, None)
+    else:
+        _status_cache[invoice_id] = (time.monotonic(), status)
+    return status
+
+
+async def confirm_payment(session: AsyncSession, invoice_id: int, notify_advertiser: bool = False) -> bool:
+    """Инвойс оплачен: платеж -> paid, кампания -> PAID, пост - владельцу на модерацию.
+
+    Идемпотентно: переход делает только тот, чей UPDATE сменил статус платежа,
+    повторный вызов (кнопка, повтор вебхука) ничего не меняет и вернет False.
+    Коммит - за вызывающим.
+    """
+    result = await session.execute(
+        update(CryptoPayment)
+        .where(CryptoPayment.crypto_pay_invoice_id == invoice_id, CryptoPayment.status != "paid")
+        .values(status="paid", paid_at=datetime.utcnow())
+        .returning(CryptoPayment.campaign_id)
+    )
+    campaign_id = result.scalar_one_or_none()
+    if campaign_id is None:
+        return False
+    _status_cache.pop(invoice_id, None)
+    
+    campaign = await session.get(AdCampaign, campaign_id)
+    if campaign:
+        campaign.status = AdStatus.PAID.value
+        
+        channel = await session.get(Channel, campaign.channel_id)
+        advertiser = await session.get(User, campaign.advertiser_id)
+        if channel:
+            # Уходит владельцу после коммита вместе с оплатой
+            from handlers.publishing import queue_post_for_review
+            queue_post_for_review(session, channel.owner_id, campaign, channel, advertiser)
+        if notify_advertiser:
+            enqueue(
+                session,
+                campaign.advertiser_id,
+                "✅ **Оплата подтверждена!**\n\nВаш заказ отправлен на модерацию владельцу канала. Вы получите уведомление о публикации.",
+                priority=OutboxPriority.PAYMENT,
+                parse_mode="Markdown"
+            )
+    
+    logger.info(f"💳 Инвойс #{invoice_id} оплачен, кампания #{campaign_id}")
+    return True
+
+
+def verify_signature(body: bytes, signature: str) -> bool:
+    """Подпись вебхука: HMAC-SHA256 тела, ключ - SHA256 от токена приложения"""
+    secret = hashlib.sha256(config.CRYPTO_PAY_TOKEN.encode()).digest()
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class CryptoPayWebhook:
+    """Прием обновлений Crypto Pay: invoice_paid подтверждает оплату без нажатия кнопки"""
+
+    SIGNATURE_HEADER = "crypto-pay-api-signature"
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not verify_signature(body, request.headers.get(self.SIGNATURE_HEADER, "")):
+            return web.Response(status=401, text="Bad signature")
+        try:
+            update_data = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        
+        if update_data.get("update_type") != "invoice_paid":
+            return web.Response(text="OK")
+        
+        invoice_id = int(update_data["payload"]["invoice_id"])
+        try:
+            async with self.session_factory() as session:
+                confirmed = await confirm_payment(session, invoice_id, notify_advertiser=True)
+                await session.commit()
+        except Exception as e:
+            # Не 200 - Crypto Pay повторит доставку
+            logger.error(f"Ошибка подтверждения инвойса #{invoice_id}: {e}")
+            return web.Response(status=500)
+        if not confirmed:
+            logger.info(f"Инвойс #{invoice_id}: уже подтвержден или не найден")
+        return web.Response(text="OK")
@@ -0,0 +1,180 @@
+from aiocryptopay import AioCryptoPay, Networks
+from aiocryptopay.exceptions.factory import CodeErrorFactory
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+import asyncio
+import certifi
+import logging
+import ssl
+import time
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """Crypto Pay недоступен: вызов отклонен без запроса"""
+
+
+class CircuitBreaker:
+    """После failure_threshold сбоев подряд вызовы отклоняются reset_timeout секунд,
+    затем пропускается один пробный: успех закрывает цепь, сбой открывает снова."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.clock() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probing):
+            raise CircuitOpen("Crypto Pay временно недоступен")
+        if state == "half-open":
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                logger.warning(f"⚠️ Crypto Pay: цепь разомкнута после {self.failures} сбоев")
+            self.opened_at = self.clock()
+        self._probing = False
+
+
+class _MethodStats:
+    __slots__ = ("calls", "errors", "timeouts", "rejected", "latencies")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.latencies: Deque[float] = deque(maxlen=200)
+
+    def as_dict(self) -> Dict:
+        recent = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "p50_ms": round(recent[len(recent) // 2] * 1000, 1) if recent else None,
+            "p95_ms": round(recent[int(len(recent) * 0.95)] * 1000, 1) if recent else None,
+            "max_ms": round(recent[-1] * 1000, 1) if recent else None
+        }
+
+
+class _PooledAioCryptoPay(AioCryptoPay):
+    """AioCryptoPay с ограниченным пулом keep-alive соединений"""
+
+    def get_session(self, **kwargs):
+        if isinstance(self._session, ClientSession) and not self._session.closed:
+            return self._session
+        connector = TCPConnector(
+            ssl=ssl.create_default_context(cafile=certifi.where()),
+            limit=config.CRYPTOPAY_POOL_SIZE,
+            keepalive_timeout=60
+        )
+        # Общий потолок на случай, если внешний таймаут не сработал
+        self._session = ClientSession(connector=connector, timeout=ClientTimeout(total=config.CRYPTOPAY_TIMEOUT * 2))
+        return self._session
+
+
+class CryptoPayClient:
+    """Единственный клиент Crypto Pay процесса.
+
+    Методы AioCryptoPay вызываются через него как обычно (cp.create_invoice(...)),
+    но с таймаутом (get_* - CRYPTOPAY_READ_TIMEOUT, остальные - CRYPTOPAY_TIMEOUT),
+    автоматом размыкания цепи и замером задержек по методам. Ошибки API
+    (METHOD_DISABLED и т.п.) - ответ исправного сервиса, цепь размыкают только 5xx.
+    """
+
+    def __init__(self, token: Optional[str] = None, network: Networks = Networks.MAIN_NET):
+        self.token = token or config.CRYPTO_PAY_TOKEN
+        self.network = network
+        self.breaker = CircuitBreaker(config.CRYPTOPAY_BREAKER_FAILURES, config.CRYPTOPAY_BREAKER_RESET)
+        self._api: Optional[AioCryptoPay] = None
+        self._stats: Dict[str, _MethodStats] = {}
+
+    @property
+    def api(self) -> AioCryptoPay:
+        # Создается внутри работающего цикла событий, а не при импорте
+        if self._api is None:
+            self._api = _PooledAioCryptoPay(token=self.token, network=self.network)
+        return self._api
+
+    async def start(self):
+        self.api.get_session()
+
+    async def close(self):
+        if self._api is not None:
+            await self._api.close()
+            self._api = None
+
+    async def call(self, method: str, *args, **kwargs):
+        stats = self._stats.setdefault(method, _MethodStats())
+        try:
+            self.breaker.before_call()
+        except CircuitOpen:
+            stats.rejected += 1
+            raise
+        timeout = config.CRYPTOPAY_READ_TIMEOUT if method.startswith("get_") else config.CRYPTOPAY_TIMEOUT
+        stats.calls += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(getattr(self.api, method)(*args, **kwargs), timeout)
+        except CodeErrorFactory as e:
+            # Ошибка API (базовый класс всех CryptoPayAPIError); 5xx - сбой сервиса
+            stats.errors += 1
+            if e.code and e.code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            stats.errors += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            stats.latencies.append(time.perf_counter() - started)
+        self.breaker.record_success()
+        return result
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or not callable(getattr(AioCryptoPay, name, None)):
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            return await self.call(name, *args, **kwargs)
+
+        return method
+
+    def stats(self) -> Dict:
+        return {
+            "circuit": self.breaker.state,
+            "methods": {name: s.as_dict() for name, s in self._stats.items()}
+        }
+
+
+# Общий клиент процесса; сессия закрывается в main()
+cp = CryptoPayClient()
@@ -1,16 +1,41 @@
-from aiocryptopay import AioCryptoPay, Networks
+from aiocryptopay.exceptions.factory import CodeErrorFactory
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from datetime import datetime
+from sqlalchemy import select, update, or_, and_, event
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+import asyncio
 import logging
-from typing import Optional
 
 from config import config
-from models import User, WithdrawRequest, WithdrawStatus
+from models import User, WithdrawRequest, WithdrawStatus, OutboxPriority
+from database import begin_immediate
+from utils.cryptopay_client import cp, CircuitOpen
+from utils.owner_stats import bump_owner_stats
+from utils.balance import get_balance_snapshot, invalidate_balance
+from utils.outbox import enqueue
+from utils.rates import rates
 
 logger = logging.getLogger(__name__)
 
-cp = AioCryptoPay(token=config.CRYPTO_PAY_TOKEN, network=Networks.MAIN_NET)
+# Будит воркер выводов после коммита транзакции, создавшей заявку
+_wakeup = asyncio.Event()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session: Session):
+    if session.info.pop("withdraw", False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_after_rollback(session: Session, previous_transaction):
+    session.info.pop("withdraw", None)
+
+
+class AmbiguousCheque(Exception):
+    """Исход прошлого createCheck неясен, а найденных чеков несколько"""
 
 
 class CryptoPayWithdraw:
@@ -20,159 +45,340 @@ class CryptoPayWithdraw:
         "BTC": {"asset": "BTC", "min_amount": 0.0001, "decimals": 8},
         "ETH": {"asset": "ETH", "min_amount": 0.001, "decimals": 6}
     }
-    
-    @staticmethod
-    async def get_ton_price() -> float:
-        try:
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.get('https://tonapi.io/v2/rates?tokens=ton&currencies=usd') as resp:
-                    data = await resp.json()
-                    return float(data['rates']['TON']['prices']['USD'])
-        except:
-            return 2.3
-    
-    @staticmethod
-    async def get_btc_price() -> float:
-        try:
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.get('https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd') as resp:
-                    data = await resp.json()
-                    return float(data['bitcoin']['usd'])
-        except:
-            return 50000.0
-    
-    @staticmethod
-    async def get_eth_price() -> float:
-        try:
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.get('https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd') as resp:
-                    data = await resp.json()
-                    return float(data['ethereum']['usd'])
-        except:
-            return 3000.0
-    
+
     @classmethod
-    async def create_cheque(cls, user_id: int, amount_usd: float, currency: str = "USDT"):
-        try:
-            if currency not in cls.SUPPORTED_CURRENCIES:
-                return None
-            
-            if currency == "USDT":
-                rate = 1.0
-            elif currency == "TON":
-                rate = await cls.get_ton_price()
-            elif currency == "BTC":
-                rate = await cls.get_btc_price()
-            elif currency == "ETH":
-                rate = await cls.get_eth_price()
-            else:
-                rate = 1.0
-            
-            amount_crypto = round(amount_usd / rate, cls.SUPPORTED_CURRENCIES[currency]["decimals"])
-            min_amount = cls.SUPPORTED_CURRENCIES[currency]["min_amount"]
-            
-            if amount_crypto < min_amount:
-                logger.error(f"Сумма {amount_crypto} {currency} меньше минимальной")
-                return None
-            
-            logger.info(f"Creating check for {amount_crypto} {currency} for user {user_id}")
-            # Ошибка 403 METHOD_DISABLED означает, что создание чеков отключено в приложении CryptoBot.
-            # На текущий момент мы будем выводить сообщение об этом пользователю.
-            # В реальном приложении владельцу нужно включить Checks в настройках @CryptoBot -> My Apps -> [App] -> Checks
+    async def enqueue_withdrawal(
+        cls,
+        session: AsyncSession,
+        user_id: int,
+        amount: float,
+        amount_crypto: float,
+        currency: str,
+        key: str
+    ) -> Optional[WithdrawRequest]:
+        """Поставить заявку в очередь, зарезервировав сумму; вызывающий коммитит.
+
+        Первый запрос сессии: проверка доступного остатка и вставка идут одной
+        пишущей транзакцией, так что два быстрых нажатия не выведут больше баланса.
+        Повтор с тем же key возвращает уже созданную заявку; None - не хватает средств.
+        """
+        await begin_immediate(session)
+        existing = (await session.execute(
+            select(WithdrawRequest).where(WithdrawRequest.idempotency_key == key)
+        )).scalar_one_or_none()
+        if existing is not None:
+            return existing
+
+        # Заявки в очереди и в обработке уже вычтены из доступного остатка
+        snapshot = await get_balance_snapshot(session, user_id, fresh=True)
+        if snapshot is None or snapshot.available < amount:
+            return None
+
+        withdraw = WithdrawRequest(
+            user_id=user_id,
+            amount=amount,
+            amount_crypto=amount_crypto,
+            currency=currency,
+            status=WithdrawStatus.PENDING.value,
+            idempotency_key=key,
+            attempts=0,
+            next_attempt_at=datetime.utcnow()
+        )
+        session.add(withdraw)
+        await session.flush()
+        session.info["withdraw"] = True
+        return withdraw
+
+    @classmethod
+    async def get_available_currencies(cls, amount_usd: float) -> list:
+        """Суммы во всех валютах, где вывод не ниже минимума; курсы - одним обращением к кэшу"""
+        current = await rates.get_rates()
+        available = []
+
+        for currency, spec in cls.SUPPORTED_CURRENCIES.items():
+            rate = current.get(currency)
+            if not rate:
+                continue
+
+            amount_crypto = amount_usd / rate
+            if amount_crypto >= spec["min_amount"]:
+                available.append({
+                    "currency": currency,
+                    "amount": round(amount_crypto, spec["decimals"]),
+                    "min_amount": spec["min_amount"]
+                })
+
+        return available
+
+
+class WithdrawalWorker:
+    """Обработка очереди выводов: заявки забираются под аренду и идут параллельно,
+    не больше WITHDRAW_CONCURRENCY одновременно.
+
+    Сумма зарезервирована заявкой с момента постановки; списание, статус и
+    сообщение с чеком пишутся одной транзакцией после createCheck. Момент
+    отправки createCheck сохраняется заранее: если ответ потерян (таймаут, рестарт),
+    следующая попытка сначала ищет созданный чек и только потом создает новый.
+    Ошибка API 4xx отклоняет заявку; сбой сети или 5xx повторяется с паузой,
+    разомкнутая цепь Crypto Pay попытку не тратит.
+    """
+
+    # Расхождение часов бота и Crypto Pay при поиске чека прошлой попытки
+    CLOCK_SKEW = timedelta(seconds=60)
+
+    def __init__(self, session_factory, client=None, concurrency: Optional[int] = None):
+        self.session_factory = session_factory
+        self.client = client or cp
+        self.concurrency = concurrency or config.WITHDRAW_CONCURRENCY
+        self._stopping = False
+
+    async def run(self):
+        logger.info("💸 Запуск очереди выводов...")
+        while not self._stopping:
+            _wakeup.clear()
             try:
-                cheque = await cp.create_check(
-                    asset=cls.SUPPORTED_CURRENCIES[currency]["asset"],
-                    amount=amount_crypto,
-                )
-                logger.info(f"✅ Создан чек на {amount_crypto} {currency} для пользователя {user_id}")
-                return cheque
+                processed = await self.process_once()
             except Exception as e:
+                logger.error(f"Ошибка очереди выводов: {e}")
+                processed = 0
+            if not processed:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=config.WITHDRAW_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stop(self):
+        self._stopping = True
+        _wakeup.set()
+
+    async def _claim(self) -> List[WithdrawRequest]:
+        """Забрать готовые заявки и брошенные упавшим воркером"""
+        now = datetime.utcnow()
+        async with self.session_factory() as session:
+            await begin_immediate(session)
+            withdraws = (await session.execute(
+                select(WithdrawRequest)
+                .where(or_(
+                    and_(
+                        WithdrawRequest.status == WithdrawStatus.PENDING.value,
+                        WithdrawRequest.next_attempt_at <= now
+                    ),
+                    and_(
+                        WithdrawRequest.status == WithdrawStatus.PROCESSING.value,
+                        WithdrawRequest.lease_until < now
+                    )
+                ))
+                .order_by(WithdrawRequest.id)
+                .limit(self.concurrency)
+            )).scalars().all()
+            if withdraws:
+                await session.execute(
+                    update(WithdrawRequest)
+                    .where(WithdrawRequest.id.in_([w.id for w in withdraws]))
+                    .values(
+                        status=WithdrawStatus.PROCESSING.value,
+                        lease_until=now + timedelta(seconds=config.WITHDRAW_LEASE)
+                    )
+                )
+            await session.commit()
+            return list(withdraws)
+
+    async def process_once(self) -> int:
+        """Обработать один пакет заявок; вернуть их число"""
+        withdraws = await self._claim()
+        await asyncio.gather(*(self._process(w) for w in withdraws))
+        return len(withdraws)
+
+    async def _process(self, withdraw: WithdrawRequest):
+        spec = CryptoPayWithdraw.SUPPORTED_CURRENCIES.get(str(withdraw.currency))
+        if spec is None or not withdraw.amount_crypto:
+            await self._reject(withdraw, "Валюта недоступна")
+            return
+        try:
+            cheque = None
+            if withdraw.check_requested_at is not None:
+                cheque = await self._find_cheque(withdraw, spec["asset"])
+            elif not await self._has_funds(withdraw):
+                await self._reject(withdraw, "Недостаточно средств")
+                return
+            if cheque is None:
+                await self._mark_requested(withdraw)
+                cheque = await self.client.create_check(
+                    asset=spec["asset"],
+                    amount=float(withdraw.amount_crypto),
+                    pin_to_user_id=int(withdraw.user_id)
+                )
+            await self._complete(withdraw, cheque)
+        except CircuitOpen:
+            await self._retry(withdraw, config.CRYPTOPAY_BREAKER_RESET, count_attempt=False)
+        except AmbiguousCheque as e:
+            await self._hold(withdraw, str(e))
+        except CodeErrorFactory as e:
+            if e.code and e.code >= 500:
+                await self._retry(withdraw, error=str(e).strip())
+            else:
+                # METHOD_DISABLED и т.п.: чек не создан и не будет создан повтором
                 if "METHOD_DISABLED" in str(e):
-                    logger.error("❌ Ошибка: Создание чеков отключено в настройках CryptoBot (METHOD_DISABLED).")
-                raise e
-            
+                    logger.error("❌ Создание чеков отключено в настройках CryptoBot (METHOD_DISABLED)")
+                await self._reject(withdraw, f"Ошибка Crypto Pay: {str(e).strip()}")
         except Exception as e:
-            logger.error(f"Ошибка создания чека: {e}")
-            return None
-    
-    @classmethod
-    async def process_withdrawal(cls, session: AsyncSession, withdraw_id: int) -> bool:
-        try:
-            withdraw = await session.get(WithdrawRequest, withdraw_id)
-            if not withdraw or str(withdraw.status) != WithdrawStatus.PENDING.value:
-                return False
-            
+            await self._retry(withdraw, error=str(e) or type(e).__name__)
+
+    async def _has_funds(self, withdraw: WithdrawRequest) -> bool:
+        """Баланс мог уменьшиться после постановки (штраф) - проверяем до создания чека"""
+        async with self.session_factory() as session:
             user = await session.get(User, withdraw.user_id)
-            if not user or float(user.balance) < float(withdraw.amount):
-                withdraw.status = WithdrawStatus.REJECTED.value
-                withdraw.admin_note = "Недостаточно средств"
-                await session.commit()
-                return False
-            
-            cheque = await cls.create_cheque(
-                user_id=int(user.id),
-                amount_usd=float(withdraw.amount),
-                currency=str(withdraw.currency)
+            return user is not None and float(user.balance or 0) - float(user.frozen_balance or 0) >= float(withdraw.amount)
+
+    async def _mark_requested(self, withdraw: WithdrawRequest):
+        withdraw.check_requested_at = datetime.utcnow()
+        async with self.session_factory() as session:
+            await session.execute(
+                update(WithdrawRequest)
+                .where(WithdrawRequest.id == withdraw.id)
+                .values(check_requested_at=withdraw.check_requested_at)
             )
-            
-            if not cheque:
-                withdraw.status = WithdrawStatus.REJECTED.value
-                withdraw.admin_note = "Ошибка создания чека"
-                await session.commit()
-                return False
-            
-            withdraw.cheque_id = int(cheque.check_id)
-            withdraw.cheque_url = str(cheque.bot_check_url)
-            withdraw.cheque_status = "active"
-            withdraw.amount_crypto = float(cheque.amount)
-            withdraw.currency = str(cheque.asset)
-            withdraw.status = WithdrawStatus.COMPLETED.value
-            withdraw.processed_at = datetime.utcnow()
-            
-            user.balance = float(user.balance) - float(withdraw.amount)
-            user.total_withdrawn = (float(user.total_withdrawn) if user.total_withdrawn else 0.0) + float(withdraw.amount)
-            
             await session.commit()
-            logger.info(f"✅ Выплата #{withdraw.id} обработана, баланс -${withdraw.amount}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Ошибка обработки вывода: {e}")
-            await session.rollback()
-            return False
-    
-    @classmethod
-    async def get_available_currencies(cls, amount_usd: float) -> list:
-        available = []
-        
-        for currency in cls.SUPPORTED_CURRENCIES:
-            try:
-                if currency == "USDT":
-                    rate = 1.0
-                elif currency == "TON":
-                    rate = await cls.get_ton_price()
-                elif currency == "BTC":
-                    rate = await cls.get_btc_price()
-                elif currency == "ETH":
-                    rate = await cls.get_eth_price()
-                else:
-                    continue
-                
-                amount_crypto = amount_usd / rate
-                min_amount = cls.SUPPORTED_CURRENCIES[currency]["min_amount"]
-                
-                if amount_crypto >= min_amount:
-                    available.append({
-                        "currency": currency,
-                        "amount": round(amount_crypto, cls.SUPPORTED_CURRENCIES[currency]["decimals"]),
-                        "min_amount": min_amount
-                    })
-                    
-            except Exception as e:
-                logger.error(f"Ошибка проверки {currency}: {e}")
-                continue
-        
-        return available
+
+    async def _find_cheque(self, withdraw: WithdrawRequest, asset: str):
+        """Чек, созданный попыткой с потерянным ответом: активный, на ту же сумму,
+        не позже отправки запроса и еще не привязанный к другой заявке"""
+        checks = await self.client.get_checks(asset=asset, status="active", count=1000) or []
+        if not isinstance(checks, list):
+            checks = [checks]
+        since = withdraw.check_requested_at - self.CLOCK_SKEW
+        candidates = [
+            c for c in checks
+            if abs(float(c.amount) - float(withdraw.amount_crypto)) < 1e-9
+            and self._utc(c.created_at) >= since
+        ]
+        if candidates:
+            async with self.session_factory() as session:
+                linked = set((await session.execute(
+                    select(WithdrawRequest.cheque_id)
+                    .where(WithdrawRequest.cheque_id.in_([int(c.check_id) for c in candidates]))
+                )).scalars().all())
+            candidates = [c for c in candidates if int(c.check_id) not in linked]
+        if len(candidates) > 1:
+            raise AmbiguousCheque(f"Найдено чеков-кандидатов: {len(candidates)}")
+        if candidates:
+            logger.info(f"🔁 Выплата #{withdraw.id}: найден чек {candidates[0].check_id} прошлой попытки")
+        return candidates[0] if candidates else None
+
+    @staticmethod
+    def _utc(value: datetime) -> datetime:
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    async def _complete(self, withdraw: WithdrawRequest, cheque):
+        async with self.session_factory() as session:
+            await begin_immediate(session)
+            current = await session.get(WithdrawRequest, withdraw.id)
+            if current is None or current.status != WithdrawStatus.PROCESSING.value:
+                logger.error(f"❌ Выплата #{withdraw.id}: заявка уже {current.status if current else 'удалена'}, чек {cheque.check_id} не привязан")
+                await session.rollback()
+                return
+            user = await session.get(User, current.user_id)
+
+            current.cheque_id = int(cheque.check_id)
+            current.cheque_url = str(cheque.bot_check_url)
+            current.cheque_status = "active"
+            current.amount_crypto = float(cheque.amount)
+            current.currency = str(cheque.asset)
+            current.status = WithdrawStatus.COMPLETED.value
+            current.processed_at = datetime.utcnow()
+            current.lease_until = None
+
+            user.balance = float(user.balance) - float(current.amount)
+            user.total_withdrawn = (float(user.total_withdrawn) if user.total_withdrawn else 0.0) + float(current.amount)
+            await bump_owner_stats(session, int(user.id), total_withdrawn=float(current.amount))
+
+            builder = InlineKeyboardBuilder()
+            builder.button(text=f"💎 АКТИВИРОВАТЬ {current.currency}", url=current.cheque_url)
+            enqueue(
+                session,
+                int(user.id),
+                f"✅ <b>Вывод #{current.id} выполнен!</b>\n\n"
+                f"💰 Списано: <code>${float(current.amount):.2f}</code>\n"
+                f"💎 Чек: <code>{current.amount_crypto} {current.currency}</code>\n\n"
+                f"📌 Нажмите кнопку → активируйте в @CryptoBot",
+                priority=OutboxPriority.PAYMENT,
+                reply_markup=builder.as_markup(),
+                parse_mode="HTML"
+            )
+            for admin_id in config.ADMIN_IDS:
+                enqueue(
+                    session,
+                    admin_id,
+                    f"💰 Выплата #{current.id}\n👤 @{user.username}\n💵 ${float(current.amount):.2f} → {current.amount_crypto} {current.currency}\n🔗 {current.cheque_url}",
+                    parse_mode=None,
+                    disable_web_page_preview=True
+                )
+            await session.commit()
+        invalidate_balance(int(withdraw.user_id))
+        logger.info(f"✅ Выплата #{withdraw.id} обработана, баланс -${withdraw.amount}")
+
+    async def _reject(self, withdraw: WithdrawRequest, reason: str):
+        """Отклонить заявку: резерв снимается, пользователю - сообщение"""
+        async with self.session_factory() as session:
+            await session.execute(
+                update(WithdrawRequest)
+                .where(WithdrawRequest.id == withdraw.id)
+                .values(status=WithdrawStatus.REJECTED.value, admin_note=reason, lease_until=None, processed_at=datetime.utcnow())
+            )
+            enqueue(
+                session,
+                int(withdraw.user_id),
+                f"❌ Вывод #{withdraw.id} на ${float(withdraw.amount):.2f} не выполнен: {reason}.\nСредства остались на балансе.",
+                priority=OutboxPriority.PAYMENT,
+                parse_mode=None
+            )
+            await session.commit()
+        invalidate_balance(int(withdraw.user_id))
+        logger.warning(f"⚠️ Выплата #{withdraw.id} отклонена: {reason}")
+
+    async def _retry(self, withdraw: WithdrawRequest, delay: Optional[float] = None, count_attempt: bool = True, error: Optional[str] = None):
+        attempts = (withdraw.attempts or 0) + (1 if count_attempt else 0)
+        if attempts >= config.WITHDRAW_MAX_ATTEMPTS:
+            if withdraw.check_requested_at is not None:
+                await self._hold(withdraw, f"попытки исчерпаны: {error}")
+            else:
+                await self._reject(withdraw, "Crypto Pay недоступен")
+            return
+        if delay is None:
+            delay = min(config.WITHDRAW_RETRY_MAX, config.WITHDRAW_RETRY_BASE * 2 ** (attempts - 1))
+        async with self.session_factory() as session:
+            await session.execute(
+                update(WithdrawRequest)
+                .where(WithdrawRequest.id == withdraw.id)
+                .values(
+                    status=WithdrawStatus.PENDING.value,
+                    attempts=attempts,
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+                    lease_until=None
+                )
+            )
+            await session.commit()
+        if error:
+            logger.warning(f"⚠️ Выплата #{withdraw.id}: попытка {attempts} не удалась ({error}), повтор через {delay:.0f} с")
+
+    async def _hold(self, withdraw: WithdrawRequest, reason: str):
+        """Чек мог быть создан, но не найден однозначно: заявка остается в обработке
+        (сумма зарезервирована), воркер ее больше не берет - разбирает админ"""
+        async with self.session_factory() as session:
+            await session.execute(
+                update(WithdrawRequest)
+                .where(WithdrawRequest.id == withdraw.id)
+                .values(lease_until=None, admin_note=f"Проверить вручную: {reason}")
+            )
+            for admin_id in config.ADMIN_IDS:
+                enqueue(
+                    session,
+                    admin_id,
+                    f"⚠️ Выплата #{withdraw.id} (${float(withdraw.amount):.2f}, {withdraw.amount_crypto} {withdraw.currency}) "
+                    f"требует ручной проверки чеков в @CryptoBot: {reason}",
+                    parse_mode=None
+                )
+            await session.commit()
+        logger.error(f"❌ Выплата #{withdraw.id} остановлена для ручной проверки: {reason}")
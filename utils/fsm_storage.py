@@ -0,0 +1,122 @@
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.dialects.sqlite import insert
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import json
+import logging
+
+from models import FSMRecord
+from database import begin_immediate
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_table = FSMRecord.__table__
+
+_upsert = insert(_table).values(
+    key=bindparam("b_key"),
+    state=bindparam("b_state"),
+    data=bindparam("b_data"),
+    expires_at=bindparam("b_expires_at")
+)
+_upsert = _upsert.on_conflict_do_update(
+    index_elements=[_table.c.key],
+    set_={"state": _upsert.excluded.state, "data": _upsert.excluded.data, "expires_at": _upsert.excluded.expires_at}
+)
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM в таблице fsm_states: переживает рестарт и общая для нескольких процессов.
+
+    В памяти ничего не копится: каждая операция - короткая транзакция. Запись
+    продлевает срок жизни на FSM_TTL; истекшая запись читается как пустая и
+    удаляется sweep(). Пустое состояние с пустыми данными удаляет строку сразу.
+    """
+
+    def __init__(self, session_factory, ttl: Optional[int] = None):
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl or config.FSM_TTL)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def _read(self, session, key: StorageKey):
+        row = (await session.execute(
+            select(_table.c.state, _table.c.data).where(
+                _table.c.key == self._key(key),
+                _table.c.expires_at > datetime.utcnow()
+            )
+        )).first()
+        if row is None:
+            return None, {}
+        return row.state, json.loads(row.data)
+
+    async def _write(self, session, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        if state is None and not data:
+            await session.execute(delete(_table).where(_table.c.key == self._key(key)))
+            return
+        await session.execute(_upsert, {
+            "b_key": self._key(key),
+            "b_state": state,
+            "b_data": _dumps(data),
+            "b_expires_at": datetime.utcnow() + self.ttl
+        })
+
+    async def _modify(self, key: StorageKey, state=..., data: Optional[Dict[str, Any]] = None, merge: bool = False) -> Dict[str, Any]:
+        """Прочитать и записать запись одной пишущей транзакцией (без гонки между процессами)"""
+        async with self.session_factory() as session:
+            await begin_immediate(session)
+            current_state, current_data = await self._read(session, key)
+            if state is not ...:
+                current_state = state
+            if data is not None:
+                current_data = {**current_data, **data} if merge else dict(data)
+            await self._write(session, key, current_state, current_data)
+            await session.commit()
+        return current_data
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._modify(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with self.session_factory() as session:
+            state, _ = await self._read(session, key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._modify(key, data=data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with self.session_factory() as session:
+            _, data = await self._read(session, key)
+        return data
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        return (await self._modify(key, data=data, merge=True)).copy()
+
+    async def sweep(self) -> int:
+        """Удалить истекшие записи"""
+        async with self.session_factory() as session:
+            result = await session.execute(delete(_table).where(_table.c.expires_at <= datetime.utcnow()))
+            await session.commit()
+        if result.rowcount:
+            logger.info(f"🧹 Удалено истекших состояний диалогов: {result.rowcount}")
+        return result.rowcount
+
+    async def close(self) -> None:
+        pass
+
+
+def create_fsm_storage(session_factory) -> BaseStorage:
+    """Redis, если задан FSM_REDIS_URL (нужен пакет redis), иначе таблица в БД бота"""
+    if config.FSM_REDIS_URL:
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(config.FSM_REDIS_URL, state_ttl=config.FSM_TTL, data_ttl=config.FSM_TTL)
+    return SQLiteStorage(session_factory)
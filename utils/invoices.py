@@ -0,0 +1,129 @@
+from sqlalchemy import select, update, delete, exists, and_, or_
+from datetime import datetime, timedelta
+from typing import Dict, List
+import asyncio
+import logging
+
+from config import config
+from models import CryptoPayment, AdCampaign, AdStatus
+from database import begin_immediate
+from utils.cryptopay import confirm_payment
+
+logger = logging.getLogger(__name__)
+
+
+class InvoiceReconciler:
+    """Сверка активных инвойсов с Crypto Pay и уборка брошенных заказов.
+
+    Все активные инвойсы проверяются пакетами getInvoices (до INVOICE_RECONCILE_BATCH
+    id в запросе). Оплаченные подтверждаются тем же переходом, что кнопка и вебхук,
+    истекшие закрываются вместе с ожидающими их кампаниями одним UPDATE. Старше
+    INVOICE_GC_AGE удаляются только брошенные заказы: неоплаченные PENDING и кампании,
+    отмененные сверкой из-за истекшего счета. Переговоры и отказы владельцев остаются.
+    """
+
+    def __init__(self, session_factory, client=None):
+        self.session_factory = session_factory
+        self.client = client
+        self.batch_size = min(config.INVOICE_RECONCILE_BATCH, 1000)
+
+    async def _statuses(self, invoice_ids: List[int]) -> Dict[int, str]:
+        if self.client is None:
+            from utils.cryptopay_client import cp
+            self.client = cp
+        batches = [invoice_ids[i:i + self.batch_size] for i in range(0, len(invoice_ids), self.batch_size)]
+        semaphore = asyncio.Semaphore(4)
+
+        async def fetch(batch: List[int]) -> Dict[int, str]:
+            async with semaphore:
+                # count: по умолчанию API отдает только 100 записей
+                invoices = await self.client.get_invoices(invoice_ids=batch, count=len(batch))
+            return {int(i.invoice_id): str(i.status) for i in invoices or []}
+
+        statuses: Dict[int, str] = {}
+        for result in await asyncio.gather(*(fetch(b) for b in batches), return_exceptions=True):
+            if isinstance(result, BaseException):
+                logger.error(f"Ошибка сверки инвойсов: {result}")
+                continue
+            statuses.update(result)
+        return statuses
+
+    async def reconcile(self) -> Dict[str, int]:
+        """Сверить все активные инвойсы; вернуть число подтвержденных и закрытых"""
+        now = datetime.utcnow()
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(CryptoPayment.crypto_pay_invoice_id, CryptoPayment.created_at)
+                .where(CryptoPayment.status == "active", CryptoPayment.crypto_pay_invoice_id.isnot(None))
+            )).all()
+        if not rows:
+            return {"paid": 0, "expired": 0}
+
+        statuses = await self._statuses([int(r.crypto_pay_invoice_id) for r in rows])
+        # Неизвестный API инвойс после срока жизни считается истекшим (удален в @CryptoBot)
+        lost_before = now - timedelta(seconds=config.INVOICE_EXPIRES_IN * 2)
+        paid = [invoice_id for invoice_id, status in statuses.items() if status == "paid"]
+        expired = [invoice_id for invoice_id, status in statuses.items() if status == "expired"]
+        expired += [
+            int(r.crypto_pay_invoice_id) for r in rows
+            if int(r.crypto_pay_invoice_id) not in statuses and r.created_at and r.created_at < lost_before
+        ]
+
+        confirmed = 0
+        async with self.session_factory() as session:
+            for invoice_id in paid:
+                confirmed += await confirm_payment(session, invoice_id, notify_advertiser=True)
+            if expired:
+                campaign_ids = (await session.execute(
+                    update(CryptoPayment)
+                    .where(CryptoPayment.crypto_pay_invoice_id.in_(expired), CryptoPayment.status == "active")
+                    .values(status="expired")
+                    .returning(CryptoPayment.campaign_id)
+                )).scalars().all()
+                await session.execute(
+                    update(AdCampaign)
+                    .where(AdCampaign.id.in_(campaign_ids), AdCampaign.status == AdStatus.PENDING.value)
+                    .values(status=AdStatus.CANCELLED.value)
+                )
+            await session.commit()
+
+        if confirmed or expired:
+            logger.info(f"💳 Сверка инвойсов: подтверждено {confirmed}, истекло {len(expired)} из {len(rows)}")
+        return {"paid": confirmed, "expired": len(expired)}
+
+    async def collect_garbage(self) -> int:
+        """Удалить брошенные заказы старше INVOICE_GC_AGE вместе с их счетами"""
+        cutoff = datetime.utcnow() - timedelta(seconds=config.INVOICE_GC_AGE)
+        has_live_payment = exists().where(
+            CryptoPayment.campaign_id == AdCampaign.id,
+            CryptoPayment.status.in_(["paid", "active"])
+        )
+        # CANCELLED с истекшим счетом - отмена сверкой; отказ владельца счета не имеет
+        has_expired_invoice = exists().where(
+            CryptoPayment.campaign_id == AdCampaign.id,
+            CryptoPayment.status == "expired"
+        )
+        async with self.session_factory() as session:
+            await begin_immediate(session)
+            ids = (await session.execute(
+                select(AdCampaign.id).where(
+                    or_(
+                        AdCampaign.status == AdStatus.PENDING.value,
+                        and_(AdCampaign.status == AdStatus.CANCELLED.value, has_expired_invoice)
+                    ),
+                    AdCampaign.channel_post_id.is_(None),
+                    AdCampaign.created_at < cutoff,
+                    ~has_live_payment
+                )
+            )).scalars().all()
+            if ids:
+                await session.execute(delete(CryptoPayment).where(CryptoPayment.campaign_id.in_(ids)))
+                await session.execute(delete(AdCampaign).where(AdCampaign.id.in_(ids)))
+            await session.commit()
+        if ids:
+            logger.info(f"🧹 Удалено брошенных заказов: {len(ids)}")
+        return len(ids)
+
+    async def run_once(self):
+        await self.reconcile()
+        await self.collect_garbage()
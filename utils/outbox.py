@@ -0,0 +1,293 @@
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import select, update, delete, or_, and_, bindparam, func, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+from models import OutboxMessage, OutboxStatus, OutboxPriority
+from database import begin_immediate
+from utils.ratelimit import RateLimiter, limiter as default_limiter
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Будит диспетчер после коммита транзакции, поставившей сообщения в очередь
+_wakeup = asyncio.Event()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session: Session):
+    if session.info.pop("outbox", False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_after_rollback(session: Session, previous_transaction):
+    session.info.pop("outbox", None)
+
+
+def enqueue(
+    session: AsyncSession,
+    chat_id: int,
+    text: Optional[str] = None,
+    *,
+    method: str = "send_message",
+    priority: OutboxPriority = OutboxPriority.NOTICE,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    fallback_text: Optional[str] = None,
+    **payload
+) -> OutboxMessage:
+    """Поставить сообщение в очередь в транзакции сессии; уйдет после коммита.
+
+    payload - остальные аргументы метода Bot (parse_mode, photo, caption, ...).
+    """
+    if text is not None:
+        payload["text"] = text
+    message = OutboxMessage(
+        chat_id=chat_id,
+        method=method,
+        payload=payload,
+        reply_markup=reply_markup.model_dump(exclude_none=True) if reply_markup else None,
+        fallback_text=fallback_text,
+        priority=int(priority),
+        status=OutboxStatus.PENDING.value,
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    session.add(message)
+    session.info["outbox"] = True
+    return message
+
+
+_SENT = "sent"
+_RETRY = "retry"
+_DEFER = "defer"
+_FALLBACK = "fallback"
+_FAILED = "failed"
+
+
+class OutboxDispatcher:
+    """Отправка очереди: пакет забирается под аренду, сообщения одного чата уходят по
+    порядку, разные чаты - параллельно, в пределах общего и поканального лимитов.
+
+    429 от Telegram не тратит попытку: сообщение и все следующие в этот чат
+    откладываются на retry_after. Прочие ошибки повторяются с экспоненциальной
+    паузой, пока не кончатся попытки; отказ Telegram (бот заблокирован) - сразу.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        session_factory,
+        limiter: Optional[RateLimiter] = None,
+        concurrency: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ):
+        self.bot = bot
+        self.session_factory = session_factory
+        self.limiter = limiter or default_limiter
+        self.concurrency = concurrency or config.OUTBOX_CONCURRENCY
+        self.batch_size = batch_size or config.OUTBOX_BATCH_SIZE
+        self._stopping = False
+
+    async def run(self):
+        logger.info("📨 Запуск очереди сообщений...")
+        next_purge = datetime.utcnow()
+        while not self._stopping:
+            # Сброс до выборки: коммит во время отправки пакета разбудит следующий круг
+            _wakeup.clear()
+            try:
+                sent = await self.dispatch_once()
+                if datetime.utcnow() >= next_purge:
+                    await self.purge()
+                    next_purge = datetime.utcnow() + timedelta(hours=1)
+            except Exception as e:
+                logger.error(f"Ошибка очереди сообщений: {e}")
+                sent = 0
+            if not sent:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=config.OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stop(self):
+        self._stopping = True
+        _wakeup.set()
+
+    async def _claim(self) -> List[OutboxMessage]:
+        """Забрать пакет готовых к отправке (и брошенных упавшим диспетчером) сообщений"""
+        now = datetime.utcnow()
+        async with self.session_factory() as session:
+            await begin_immediate(session)
+            messages = (await session.execute(
+                select(OutboxMessage)
+                .where(or_(
+                    and_(
+                        OutboxMessage.status == OutboxStatus.PENDING.value,
+                        OutboxMessage.next_attempt_at <= now
+                    ),
+                    and_(
+                        OutboxMessage.status == OutboxStatus.SENDING.value,
+                        OutboxMessage.lease_until < now
+                    )
+                ))
+                .order_by(OutboxMessage.priority, OutboxMessage.id)
+                .limit(self.batch_size)
+            )).scalars().all()
+            if messages:
+                await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_([m.id for m in messages]))
+                    .values(
+                        status=OutboxStatus.SENDING.value,
+                        lease_until=now + timedelta(seconds=config.OUTBOX_LEASE)
+                    )
+                )
+            await session.commit()
+            return list(messages)
+
+    async def dispatch_once(self) -> int:
+        """Отправить один пакет; вернуть число обработанных сообщений"""
+        messages = await self._claim()
+        if not messages:
+            return 0
+
+        by_chat: Dict[int, List[OutboxMessage]] = {}
+        for message in messages:
+            by_chat.setdefault(message.chat_id, []).append(message)
+
+        results: List[Tuple[OutboxMessage, str, Optional[float], Optional[str]]] = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_chat(chat_messages: List[OutboxMessage]):
+            async with semaphore:
+                chat_messages.sort(key=lambda m: m.id)
+                for i, message in enumerate(chat_messages):
+                    outcome, delay, error = await self._send(message)
+                    results.append((message, outcome, delay, error))
+                    if outcome in (_RETRY, _DEFER):
+                        # Порядок в чате: остальные ждут вместе с этим
+                        results.extend((m, _DEFER, delay, None) for m in chat_messages[i + 1:])
+                        break
+                    if outcome == _FALLBACK:
+                        # Запасной текст уйдет следующим пакетом - остальные за ним
+                        results.extend((m, _DEFER, 0.0, None) for m in chat_messages[i + 1:])
+                        break
+
+        await asyncio.gather(*(send_chat(chat_messages) for chat_messages in by_chat.values()))
+        await self._save(results)
+        return len(messages)
+
+    async def _send(self, message: OutboxMessage) -> Tuple[str, Optional[float], Optional[str]]:
+        wait = self.limiter.chat_wait(message.chat_id)
+        if wait > config.OUTBOX_MAX_WAIT:
+            return _DEFER, wait, None
+
+        await self.limiter.acquire(message.chat_id)
+        kwargs = dict(message.payload or {})
+        if message.reply_markup:
+            kwargs["reply_markup"] = InlineKeyboardMarkup.model_validate(message.reply_markup)
+        try:
+            await getattr(self.bot, message.method)(chat_id=message.chat_id, **kwargs)
+            return _SENT, None, None
+        except TelegramRetryAfter as e:
+            self.limiter.pause(e.retry_after, message.chat_id)
+            return _DEFER, float(e.retry_after), None
+        except TelegramForbiddenError as e:
+            return _FAILED, None, str(e)
+        except TelegramBadRequest as e:
+            if message.fallback_text:
+                return _FALLBACK, None, str(e)
+            return _FAILED, None, str(e)
+        except Exception as e:
+            attempts = (message.attempts or 0) + 1
+            if attempts >= config.OUTBOX_MAX_ATTEMPTS:
+                return _FAILED, None, str(e)
+            return _RETRY, float(min(config.OUTBOX_RETRY_MAX, config.OUTBOX_RETRY_BASE * 2 ** (attempts - 1))), str(e)
+
+    async def _save(self, results: List[Tuple[OutboxMessage, str, Optional[float], Optional[str]]]):
+        now = datetime.utcnow()
+        sent, failed, rescheduled, fallbacks = [], [], [], []
+        for message, outcome, delay, error in results:
+            if outcome == _SENT:
+                sent.append({"b_id": message.id})
+            elif outcome == _FAILED:
+                logger.warning(f"⚠️ Сообщение #{message.id} в {message.chat_id} не доставлено: {error}")
+                failed.append({"b_id": message.id, "b_error": error})
+            elif outcome == _FALLBACK:
+                # Запасной текст без разметки: ошибка обычно в ней
+                fallbacks.append({
+                    "b_id": message.id,
+                    "b_payload": {"text": message.fallback_text, "parse_mode": None},
+                    "b_error": error
+                })
+            else:
+                rescheduled.append({
+                    "b_id": message.id,
+                    "b_chat_id": message.chat_id,
+                    "b_next": now + timedelta(seconds=delay),
+                    "b_attempts": (message.attempts or 0) + (1 if outcome == _RETRY else 0),
+                    "b_error": error if error is not None else message.last_error
+                })
+
+        table = OutboxMessage.__table__
+        by_id = table.c.id == bindparam("b_id")
+        async with self.session_factory() as session:
+            if sent:
+                await session.execute(
+                    update(table).where(by_id).values(status=OutboxStatus.SENT.value, sent_at=now, lease_until=None),
+                    sent
+                )
+            if failed:
+                await session.execute(
+                    update(table).where(by_id).values(
+                        status=OutboxStatus.FAILED.value, last_error=bindparam("b_error"), lease_until=None
+                    ),
+                    failed
+                )
+            if fallbacks:
+                await session.execute(
+                    update(table).where(by_id).values(
+                        status=OutboxStatus.PENDING.value, method="send_message", payload=bindparam("b_payload"),
+                        reply_markup=None, fallback_text=None, last_error=bindparam("b_error"),
+                        next_attempt_at=now, lease_until=None
+                    ),
+                    fallbacks
+                )
+            if rescheduled:
+                await session.execute(
+                    update(table).where(by_id).values(
+                        status=OutboxStatus.PENDING.value, next_attempt_at=bindparam("b_next"),
+                        attempts=bindparam("b_attempts"), last_error=bindparam("b_error"), lease_until=None
+                    ),
+                    rescheduled
+                )
+                # Следующие сообщения в те же чаты не обгоняют отложенные
+                await session.execute(
+                    update(table)
+                    .where(
+                        table.c.chat_id == bindparam("b_chat_id"),
+                        table.c.status == OutboxStatus.PENDING.value,
+                        table.c.id > bindparam("b_id")
+                    )
+                    .values(next_attempt_at=func.max(table.c.next_attempt_at, bindparam("b_next"))),
+                    rescheduled
+                )
+            await session.commit()
+
+    async def purge(self):
+        """Удалить отправленные и окончательно неотправленные сообщения старше срока хранения"""
+        cutoff = datetime.utcnow() - timedelta(days=config.OUTBOX_RETENTION_DAYS)
+        async with self.session_factory() as session:
+            await session.execute(
+                delete(OutboxMessage).where(
+                    OutboxMessage.status.in_([OutboxStatus.SENT.value, OutboxStatus.FAILED.value]),
+                    OutboxMessage.created_at < cutoff
+                )
+            )
+            await session.commit()
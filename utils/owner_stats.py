@@ -0,0 +1,60 @@
+from sqlalchemy import bindparam
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import Dict, List
+
+from models import OwnerStats
+
+_COUNTERS = ("total_earned", "paid_days", "total_penalties", "total_violations", "total_withdrawn")
+
+_table = OwnerStats.__table__
+
+# Upsert с приращением всех счетчиков; нулевые дельты ничего не меняют
+_bump = insert(_table).values(
+    owner_id=bindparam("b_owner_id"),
+    updated_at=bindparam("b_updated_at"),
+    **{name: bindparam(f"b_{name}") for name in _COUNTERS}
+)
+_bump = _bump.on_conflict_do_update(
+    index_elements=[_table.c.owner_id],
+    set_={
+        "updated_at": _bump.excluded.updated_at,
+        **{name: _table.c[name] + _bump.excluded[name] for name in _COUNTERS}
+    }
+)
+
+
+def _params(owner_id: int, now: datetime, deltas: Dict) -> Dict:
+    params = {"b_owner_id": owner_id, "b_updated_at": now}
+    for name in _COUNTERS:
+        params[f"b_{name}"] = deltas.get(name, 0)
+    return params
+
+
+async def bump_owner_stats(session: AsyncSession, owner_id: int, **deltas):
+    """Прибавить дельты к статистике владельца в текущей транзакции сессии"""
+    await session.execute(_bump, _params(owner_id, datetime.utcnow(), deltas))
+
+
+async def bump_many_owner_stats(session: AsyncSession, deltas_by_owner: Dict[int, Dict]):
+    """То же для пакета владельцев одним executemany"""
+    if not deltas_by_owner:
+        return
+    now = datetime.utcnow()
+    params: List[Dict] = [_params(owner_id, now, deltas) for owner_id, deltas in deltas_by_owner.items()]
+    await session.execute(_bump, params)
+
+
+async def get_owner_stats(session: AsyncSession, owner_id: int) -> Dict:
+    """Статистика владельца: одно чтение по первичному ключу"""
+    stats = await session.get(OwnerStats, owner_id)
+    total_earned = float(stats.total_earned or 0) if stats else 0.0
+    total_penalties = float(stats.total_penalties or 0) if stats else 0.0
+    return {
+        "total_earned": round(total_earned, 2),
+        "total_penalties": round(total_penalties, 2),
+        "total_violations": int(stats.total_violations or 0) if stats else 0,
+        "total_withdrawn": round(float(stats.total_withdrawn or 0), 2) if stats else 0.0,
+        "net_income": round(total_earned - total_penalties, 2)
+    }
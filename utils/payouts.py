@@ -0,0 +1,268 @@
+from sqlalchemy import select, update, func, bindparam
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import asyncio
+import logging
+
+from models import (
+    User, Channel, AdCampaign, DailyPayment, DailyPaymentStatus, AdStatus,
+    PayoutRun, PayoutRunStatus, PayoutChunk
+)
+from database import begin_immediate
+from utils.owner_stats import bump_many_owner_stats
+from utils.balance import invalidate_balance
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def payout_slot(moment: Optional[datetime] = None) -> datetime:
+    """Момент выплаты (12:00) для указанного дня"""
+    moment = moment or datetime.utcnow()
+    return moment.replace(hour=12, minute=0, second=0, microsecond=0)
+
+
+def last_due_slot(moment: Optional[datetime] = None) -> datetime:
+    """Последний наступивший момент выплаты"""
+    moment = moment or datetime.utcnow()
+    slot = payout_slot(moment)
+    return slot if moment >= slot else slot - timedelta(days=1)
+
+
+_credit_owner = (
+    update(User.__table__)
+    .where(User.__table__.c.id == bindparam("b_owner_id"))
+    .values(
+        balance=User.__table__.c.balance + bindparam("b_amount"),
+        total_earned=func.coalesce(User.__table__.c.total_earned, 0) + bindparam("b_amount")
+    )
+)
+
+_advance_schedule = (
+    update(AdCampaign.__table__)
+    .where(AdCampaign.__table__.c.id == bindparam("b_campaign_id"))
+    .values(paid_days=bindparam("b_paid_days"))
+)
+
+
+def _run_stats(run: PayoutRun) -> Dict:
+    return {
+        "slot": run.slot,
+        "status": run.status,
+        "paid": run.paid_count or 0,
+        "amount": float(run.paid_amount or 0),
+        "chunks": run.chunks_done or 0
+    }
+
+
+class PayoutEngine:
+    """Пакетные поденные выплаты по графикам кампаний с журналом прогонов.
+
+    Пакет - короткая транзакция: сдвигает paid_days кампаний, пишет проводки,
+    зачисляет деньги владельцам и обновляет их статистику, сдвигает чекпоинт
+    прогона и записывает ключ пакета. Перезапущенный прогон продолжает с чекпоинта и не платит дважды.
+    """
+
+    def __init__(self, session_factory, chunk_size: Optional[int] = None):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size or config.PAYOUT_CHUNK_SIZE
+
+    async def run(self, slot: Optional[datetime] = None) -> Optional[Dict]:
+        """Выплатить все дни графиков, наступившие к slot (или продолжить прогон)"""
+        slot = slot or payout_slot()
+
+        run_id = await self._acquire_run(slot)
+        if run_id is None:
+            return None
+
+        try:
+            while await self.pay_chunk(run_id):
+                # Пауза между транзакциями, чтобы хендлеры успели взять блокировку записи
+                await asyncio.sleep(config.PAYOUT_CHUNK_PAUSE)
+
+            async with self.session_factory() as session:
+                run = await session.get(PayoutRun, run_id)
+                run.status = PayoutRunStatus.COMPLETED.value
+                run.finished_at = datetime.utcnow()
+                run.error = None
+                await session.commit()
+                stats = _run_stats(run)
+        except Exception as e:
+            logger.error(f"❌ Прогон выплат за {slot:%d.%m.%Y} прерван: {e}")
+            async with self.session_factory() as session:
+                await session.execute(
+                    update(PayoutRun)
+                    .where(PayoutRun.id == run_id)
+                    .values(status=PayoutRunStatus.FAILED.value, error=str(e))
+                )
+                await session.commit()
+            raise
+
+        logger.info(
+            f"💰 Выплаты на {slot:%d.%m.%Y}: {stats['paid']} дн. на ${stats['amount']:.2f}, "
+            f"пакетов {stats['chunks']}"
+        )
+        return stats
+
+    async def _acquire_run(self, slot: datetime) -> Optional[int]:
+        """Создать прогон или забрать незавершенный; None - выполнять нечего"""
+        now = datetime.utcnow()
+        async with self.session_factory() as session:
+            await begin_immediate(session)
+            run = (await session.execute(
+                select(PayoutRun).where(PayoutRun.slot == slot)
+            )).scalar_one_or_none()
+
+            if run is None:
+                run = PayoutRun(slot=slot, status=PayoutRunStatus.RUNNING.value, started_at=now, heartbeat_at=now)
+                session.add(run)
+            elif run.status == PayoutRunStatus.COMPLETED.value:
+                logger.info(f"💰 Выплаты за {slot:%d.%m.%Y} уже выполнены")
+                return None
+            elif (
+                run.status == PayoutRunStatus.RUNNING.value
+                and run.heartbeat_at
+                and run.heartbeat_at > now - timedelta(seconds=config.PAYOUT_RUN_LEASE)
+            ):
+                logger.info(f"💰 Выплаты за {slot:%d.%m.%Y} уже выполняются другим процессом")
+                return None
+            else:
+                logger.info(f"🔁 Продолжаем прогон выплат за {slot:%d.%m.%Y} с пакета {run.chunks_done}")
+                run.status = PayoutRunStatus.RUNNING.value
+                run.heartbeat_at = now
+
+            await session.commit()
+            return run.id
+
+    async def catch_up(self) -> List[Dict]:
+        """Дозавершить прерванные прогоны и догнать пропущенные дни"""
+        async with self.session_factory() as session:
+            unfinished = (await session.execute(
+                select(PayoutRun.slot)
+                .where(PayoutRun.status != PayoutRunStatus.COMPLETED.value)
+                .order_by(PayoutRun.slot)
+            )).scalars().all()
+            last_slot = (await session.execute(select(func.max(PayoutRun.slot)))).scalar()
+
+        results = []
+        for slot in unfinished:
+            stats = await self.run(slot)
+            if stats:
+                results.append(stats)
+
+        # Пропущенные дни закрываются одним прогоном: он платит все дни, наступившие к slot
+        due = last_due_slot()
+        if last_slot is None or last_slot < due:
+            if last_slot is not None:
+                logger.info(f"⏰ Пропущено выплат: {(due - last_slot).days}, догоняем за {due:%d.%m.%Y}")
+            stats = await self.run(due)
+            if stats:
+                results.append(stats)
+
+        return results
+
+    async def pay_chunk(self, run_id: int) -> bool:
+        """Одна короткая транзакция: пакет кампаний, проводки, зачисление владельцам и чекпоинт"""
+        async with self.session_factory() as session:
+            await begin_immediate(session)
+            run = await session.get(PayoutRun, run_id)
+
+            rows = (await session.execute(
+                select(
+                    AdCampaign.id, AdCampaign.channel_id, Channel.owner_id, AdCampaign.price_per_day,
+                    AdCampaign.duration_days, AdCampaign.payout_start_date, AdCampaign.paid_days
+                )
+                .join(Channel, Channel.id == AdCampaign.channel_id)
+                .where(
+                    # Завершенные тоже: кампания, истекшая пока бот был выключен, получает
+                    # недоплаченные дни при догоняющем прогоне (график ограничен duration_days)
+                    AdCampaign.status.in_([AdStatus.ACTIVE.value, AdStatus.COMPLETED.value]),
+                    AdCampaign.id > run.cursor_id,
+                    AdCampaign.payout_start_date <= run.slot,
+                    AdCampaign.paid_days < AdCampaign.duration_days
+                )
+                .order_by(AdCampaign.id)
+                .limit(self.chunk_size)
+            )).all()
+            if not rows:
+                await session.rollback()
+                return False
+
+            now = datetime.utcnow()
+            entries: List[DailyPayment] = []
+            advances = []
+            owner_totals: Dict[int, float] = {}
+            owner_days: Dict[int, int] = {}
+            for row in rows:
+                due_days = min(row.duration_days, (run.slot - row.payout_start_date).days + 1)
+                days = due_days - (row.paid_days or 0)
+                if days <= 0:
+                    continue
+                amount = days * row.price_per_day
+                entries.append(DailyPayment(
+                    campaign_id=row.id,
+                    channel_id=row.channel_id,
+                    owner_id=row.owner_id,
+                    day_number=due_days,
+                    days=days,
+                    amount=amount,
+                    payment_date=run.slot,
+                    status=DailyPaymentStatus.PAID.value,
+                    created_at=now,
+                    paid_at=now
+                ))
+                advances.append({"b_campaign_id": row.id, "b_paid_days": due_days})
+                owner_totals[row.owner_id] = owner_totals.get(row.owner_id, 0.0) + amount
+                owner_days[row.owner_id] = owner_days.get(row.owner_id, 0) + days
+
+            # Ключ пакета определяется его первой кампанией; нужен и для пакета без проводок (в логе ошибки)
+            key = f"{run.slot:%Y%m%d}:{rows[0].id}"
+            if entries:
+                # Проводки пишутся одной пакетной вставкой
+                session.add_all(entries)
+                await session.flush()
+                await session.execute(_advance_schedule, advances)
+                await session.execute(
+                    _credit_owner,
+                    [{"b_owner_id": owner_id, "b_amount": total} for owner_id, total in owner_totals.items()]
+                )
+                await bump_many_owner_stats(session, {
+                    owner_id: {"total_earned": total, "paid_days": owner_days[owner_id]}
+                    for owner_id, total in owner_totals.items()
+                })
+
+                # Ключ пакета фиксируется в той же транзакции, что и деньги
+                amount = float(sum(owner_totals.values()))
+                paid_days = sum(e.days for e in entries)
+                session.add(PayoutChunk(
+                    key=key,
+                    run_id=run.id,
+                    first_payment_id=entries[0].id,
+                    last_payment_id=entries[-1].id,
+                    payments=len(entries),
+                    amount=amount
+                ))
+                run.chunks_done = (run.chunks_done or 0) + 1
+                run.paid_count = (run.paid_count or 0) + paid_days
+                run.paid_amount = (run.paid_amount or 0) + amount
+
+            run.cursor_id = rows[-1].id
+            run.heartbeat_at = now
+
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                applied = (await session.execute(
+                    select(PayoutChunk.key).where(PayoutChunk.key == key)
+                )).scalar_one_or_none()
+                if applied is not None:
+                    # Пакет применил другой процесс: его кампании уже сдвинуты, следующий пакет их не выберет
+                    logger.warning(f"⚠️ Пакет выплат {key} прогона #{run_id} уже применен, продолжаем")
+                    return True
+                # Иное нарушение целостности: повтор с того же чекпоинта упадет снова - прогон помечается FAILED
+                logger.error(f"❌ Пакет выплат {key} прогона #{run_id} не записан: {e}")
+                raise
+            invalidate_balance(*owner_totals)
+            return True
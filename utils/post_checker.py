@@ -0,0 +1,142 @@
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import asyncio
+import logging
+import time
+
+from keyboards import post_keyboard
+from utils.ratelimit import RateLimiter, limiter as default_limiter
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class PostRef(NamedTuple):
+    """Что нужно знать о посте для проверки (без ORM-объекта)"""
+    campaign_id: int
+    channel_id: int
+    post_id: int
+    inline_button_text: Optional[str] = None
+    inline_button_url: Optional[str] = None
+
+
+EXISTS = "exists"
+DELETED = "deleted"
+UNREACHABLE = "unreachable"
+SKIPPED = "skipped"
+ERROR = "error"
+
+_DELETED_ERRORS = ("message to edit not found", "message not found", "message_id_invalid")
+_UNREACHABLE_ERRORS = ("chat not found", "bot was kicked", "not a member", "not enough rights", "have no rights")
+
+
+def interleave_by_channel(refs: Iterable[PostRef]) -> List[PostRef]:
+    """Чередовать каналы, чтобы лимит одного чата не занимал все воркеры"""
+    queues: Dict[int, List[PostRef]] = {}
+    for ref in refs:
+        queues.setdefault(ref.channel_id, []).append(ref)
+    ordered = []
+    for depth in range(max((len(q) for q in queues.values()), default=0)):
+        ordered.extend(queue[depth] for queue in queues.values() if depth < len(queue))
+    return ordered
+
+
+class PostChecker:
+    """Конкурентная проверка наличия постов в каналах с соблюдением лимитов Bot API.
+
+    Проба - edit_message_reply_markup с той же клавиатурой, с которой пост
+    опубликован: "message is not modified" значит пост на месте, "message to
+    edit not found" - удален. В отличие от forward_message, проба ничего
+    никуда не пересылает. Если владелец убрал кнопку, проба ее вернет.
+    """
+
+    MAX_ATTEMPTS = 3
+
+    def __init__(
+        self,
+        bot: Bot,
+        limiter: Optional[RateLimiter] = None,
+        concurrency: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.bot = bot
+        self.limiter = limiter or default_limiter
+        self.concurrency = concurrency or config.POST_CHECK_CONCURRENCY
+        self.clock = clock
+        # channel_id -> (подряд неудачных проб, когда пробовать снова)
+        self._backoff: Dict[int, Tuple[int, float]] = {}
+
+    def is_backed_off(self, channel_id: int) -> bool:
+        state = self._backoff.get(channel_id)
+        return state is not None and state[1] > self.clock()
+
+    def _mark_unreachable(self, channel_id: int):
+        failures = self._backoff.get(channel_id, (0, 0.0))[0] + 1
+        delay = min(config.POST_CHECK_BACKOFF_MAX, config.POST_CHECK_BACKOFF_BASE * 2 ** (failures - 1))
+        self._backoff[channel_id] = (failures, self.clock() + delay)
+
+    async def probe(self, ref: PostRef) -> str:
+        """Проверить один пост"""
+        if self.is_backed_off(ref.channel_id):
+            return SKIPPED
+
+        for _ in range(self.MAX_ATTEMPTS):
+            await self.limiter.acquire(ref.channel_id)
+            try:
+                await self.bot.edit_message_reply_markup(
+                    chat_id=ref.channel_id,
+                    message_id=ref.post_id,
+                    reply_markup=post_keyboard(ref)
+                )
+                # Клавиатура отличалась и восстановлена - пост на месте
+                self._backoff.pop(ref.channel_id, None)
+                return EXISTS
+            except TelegramRetryAfter as e:
+                # Флуд-лимит чата: ждут только запросы в этот чат
+                self.limiter.pause(e.retry_after, ref.channel_id)
+                continue
+            except TelegramForbiddenError as e:
+                logger.warning(f"⚠️ Канал {ref.channel_id} недоступен для проверки: {e}")
+                self._mark_unreachable(ref.channel_id)
+                return UNREACHABLE
+            except Exception as e:
+                err_msg = str(e).lower()
+                if "message is not modified" in err_msg:
+                    self._backoff.pop(ref.channel_id, None)
+                    return EXISTS
+                if any(marker in err_msg for marker in _DELETED_ERRORS):
+                    return DELETED
+                if any(marker in err_msg for marker in _UNREACHABLE_ERRORS):
+                    logger.warning(f"⚠️ Канал {ref.channel_id} недоступен для проверки: {e}")
+                    self._mark_unreachable(ref.channel_id)
+                    return UNREACHABLE
+                logger.error(f"Ошибка проверки поста {ref.post_id} в {ref.channel_id}: {e}")
+                return ERROR
+        return ERROR
+
+    async def sweep(
+        self,
+        refs: Iterable[PostRef],
+        on_deleted: Optional[Callable[[PostRef], Awaitable]] = None,
+        on_result: Optional[Callable[[PostRef, str], None]] = None
+    ) -> Dict[str, int]:
+        """Проверить все посты; on_deleted вызывается сразу для каждого удаленного,
+        on_result - для каждого поста с результатом пробы"""
+        pending = iter(interleave_by_channel(refs))
+        counts = {EXISTS: 0, DELETED: 0, UNREACHABLE: 0, SKIPPED: 0, ERROR: 0}
+
+        async def worker():
+            for ref in pending:
+                result = await self.probe(ref)
+                counts[result] += 1
+                if on_result:
+                    on_result(ref, result)
+                if result == DELETED and on_deleted:
+                    try:
+                        await on_deleted(ref)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки удаления поста {ref.post_id}: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return counts
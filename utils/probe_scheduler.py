@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import heapq
+import itertools
+import random
+
+from utils.post_checker import PostRef, EXISTS, DELETED, UNREACHABLE, SKIPPED
+from utils.payouts import payout_slot
+from utils.ratelimit import TokenBucket
+from config import config
+
+
+class _Watch:
+    __slots__ = ("ref", "published_at", "end_date", "stable", "due")
+
+    def __init__(self, ref: PostRef, published_at: Optional[datetime], end_date: Optional[datetime]):
+        self.ref = ref
+        self.published_at = published_at
+        self.end_date = end_date
+        self.stable = 0
+        self.due: Optional[datetime] = None
+
+
+class ProbeScheduler:
+    """Кому и когда делать следующую пробу.
+
+    Следующая проба каждого поста лежит в куче по времени. Часто (раз в
+    POST_PROBE_MIN_INTERVAL) проверяются свежие посты и посты в окнах риска:
+    перед выплатой в 12:00 - чтобы удаленный пост не получил еще один день -
+    и перед окончанием срока. Стабильные посты проверяются все реже, вплоть до
+    POST_PROBE_MAX_INTERVAL, но никогда не проскакивают начало окна риска.
+    Общее число проб ограничено бюджетом POST_PROBE_BUDGET в час.
+    """
+
+    def __init__(self, budget_per_hour: Optional[int] = None, clock: Callable[[], datetime] = datetime.utcnow):
+        self.clock = clock
+        budget = budget_per_hour or config.POST_PROBE_BUDGET
+        self.budget = TokenBucket(budget / 3600, capacity=max(1.0, budget / 60), clock=lambda: self.clock().timestamp())
+        self._heap: List[Tuple[datetime, int, int]] = []
+        self._seq = itertools.count()
+        self._watches: Dict[int, _Watch] = {}
+        self._synced = False
+
+    def __len__(self) -> int:
+        return len(self._watches)
+
+    def _risk_starts(self, watch: _Watch, now: datetime) -> List[datetime]:
+        slot = payout_slot(now)
+        if slot <= now:
+            slot += timedelta(days=1)
+        window = timedelta(seconds=config.POST_PROBE_RISK_WINDOW)
+        starts = [slot - window]
+        if watch.end_date:
+            starts.append(watch.end_date - window)
+        return starts
+
+    def interval(self, watch: _Watch, now: datetime) -> timedelta:
+        """Пауза до следующей пробы поста"""
+        dense = timedelta(seconds=config.POST_PROBE_MIN_INTERVAL)
+        if watch.published_at and now - watch.published_at < timedelta(seconds=config.POST_PROBE_DENSE_PERIOD):
+            return dense
+
+        window = timedelta(seconds=config.POST_PROBE_RISK_WINDOW)
+        risk_starts = self._risk_starts(watch, now)
+        if any(start <= now < start + window for start in risk_starts):
+            return dense
+
+        backoff = timedelta(seconds=min(
+            config.POST_PROBE_MAX_INTERVAL,
+            config.POST_PROBE_BASE_INTERVAL * 2 ** min(watch.stable, 16)
+        ))
+        # Не проспать начало ближайшего окна риска
+        upcoming = [start - now for start in risk_starts if start > now]
+        if upcoming:
+            backoff = min(backoff, min(upcoming))
+        return max(backoff, dense)
+
+    def _schedule(self, watch: _Watch, due: datetime):
+        watch.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), watch.ref.campaign_id))
+
+    def watch(self, ref: PostRef, published_at: Optional[datetime] = None, end_date: Optional[datetime] = None):
+        """Начать следить за только что опубликованным постом"""
+        now = self.clock()
+        watch = _Watch(ref, published_at or now, end_date)
+        self._watches[ref.campaign_id] = watch
+        self._schedule(watch, now + timedelta(seconds=config.POST_PROBE_MIN_INTERVAL))
+
+    def forget(self, campaign_id: int):
+        # Запись в куче остается и отбрасывается при извлечении
+        self._watches.pop(campaign_id, None)
+
+    def sync(self, posts: Iterable[Tuple[PostRef, Optional[datetime], Optional[datetime]]]):
+        """Сверить с активными кампаниями в БД: (пост, начало, конец)"""
+        now = self.clock()
+        seen = set()
+        for ref, published_at, end_date in posts:
+            seen.add(ref.campaign_id)
+            watch = self._watches.get(ref.campaign_id)
+            if watch is not None:
+                watch.ref, watch.end_date = ref, end_date
+                if watch.due is None:
+                    # Выдан в due(), но record() не было (обход упал) - вернуть в очередь
+                    self._schedule(watch, now + self.interval(watch, now))
+                continue
+            watch = _Watch(ref, published_at, end_date)
+            self._watches[ref.campaign_id] = watch
+            delay = self.interval(watch, now)
+            if not self._synced:
+                # После рестарта размазываем первые пробы, чтобы не упереться в бюджет разом
+                delay = delay * random.random()
+            self._schedule(watch, now + delay)
+        for campaign_id in [cid for cid in self._watches if cid not in seen]:
+            self.forget(campaign_id)
+        self._synced = True
+
+    def due(self) -> List[PostRef]:
+        """Посты, которые пора проверить, в пределах бюджета"""
+        now = self.clock()
+        refs = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, campaign_id = self._heap[0]
+            watch = self._watches.get(campaign_id)
+            if watch is None or watch.due != due:
+                heapq.heappop(self._heap)
+                continue
+            if not self.budget.try_acquire():
+                break
+            heapq.heappop(self._heap)
+            watch.due = None
+            refs.append(watch.ref)
+        return refs
+
+    def record(self, ref: PostRef, result: str):
+        """Запланировать следующую пробу по результату текущей"""
+        watch = self._watches.get(ref.campaign_id)
+        if watch is None:
+            return
+        if result == DELETED:
+            self.forget(ref.campaign_id)
+            return
+
+        now = self.clock()
+        if result == EXISTS:
+            watch.stable += 1
+            self._schedule(watch, now + self.interval(watch, now))
+        elif result in (UNREACHABLE, SKIPPED):
+            # Канал в backoff у PostChecker - раньше пробовать бессмысленно
+            self._schedule(watch, now + timedelta(seconds=config.POST_PROBE_MAX_INTERVAL))
+        else:
+            self._schedule(watch, now + timedelta(seconds=config.POST_PROBE_BASE_INTERVAL))
@@ -0,0 +1,115 @@
+from typing import Callable, Dict, Optional
+import asyncio
+import time
+
+from config import config
+
+
+class TokenBucket:
+    """Token bucket с резервированием: каждый вызов получает свое время старта.
+
+    Токены могут уходить в минус - это очередь уже выданных резервов, поэтому
+    ожидающие обслуживаются по порядку и суммарный темп не превышает rate.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Забрать токен; вернуть, сколько секунд ждать до его появления"""
+        now = self.clock()
+        self._refill(now)
+        self.tokens -= 1
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait_time(self) -> float:
+        """Сколько ждать следующего токена (без резервирования)"""
+        now = self.clock()
+        self._refill(now)
+        delay = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    def try_acquire(self) -> bool:
+        """Забрать токен без ожидания, если он есть"""
+        now = self.clock()
+        self._refill(now)
+        if self.tokens < 1 or self.blocked_until > now:
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (ответ retry_after от Telegram)"""
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+
+    def is_idle(self) -> bool:
+        now = self.clock()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class RateLimiter:
+    """Общий лимит запросов к Bot API плюс отдельный лимит на каждый чат"""
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(
+        self,
+        global_rate: Optional[float] = None,
+        chat_rate: Optional[float] = None,
+        chat_burst: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.clock = clock
+        self.chat_rate = chat_rate or config.TG_CHAT_RATE
+        self.chat_burst = chat_burst or config.TG_CHAT_BURST
+        # Общий лимит без запаса: всплеск поверх темпа и есть то, за что Telegram отвечает 429
+        self.global_bucket = TokenBucket(global_rate or config.TG_GLOBAL_RATE, capacity=1, clock=clock)
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                # Полные простаивающие ведра ничего не помнят - их можно выбросить
+                for idle_id in [cid for cid, b in self._chats.items() if b.is_idle()]:
+                    del self._chats[idle_id]
+            bucket = TokenBucket(self.chat_rate, self.chat_burst, clock=self.clock)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: Optional[int] = None):
+        """Дождаться права на один запрос (в чат chat_id, если указан)"""
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def chat_wait(self, chat_id: int) -> float:
+        """Сколько ждать права на запрос в чат"""
+        return self._chat_bucket(chat_id).wait_time()
+
+    def pause(self, seconds: float, chat_id: Optional[int] = None):
+        """Учесть retry_after: для чата или для всех запросов"""
+        if chat_id is not None:
+            self._chat_bucket(chat_id).pause(seconds)
+        else:
+            self.global_bucket.pause(seconds)
+
+
+# Общий лимитер процесса: все фоновые рассылки и проверки идут через него
+limiter = RateLimiter()
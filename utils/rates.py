@@ -0,0 +1,181 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional
+import aiohttp
+import asyncio
+import logging
+import time
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Курс в долларах за единицу; USDT считается равным доллару
+Rates = Dict[str, float]
+
+
+class RateSource(ABC):
+    """Источник курсов: возвращает {актив: цена в USD} для тех активов, что знает"""
+
+    name = "base"
+
+    @abstractmethod
+    async def fetch(self, http: aiohttp.ClientSession, assets: Iterable[str]) -> Rates:
+        ...
+
+
+class CryptoPayRateSource(RateSource):
+    """getExchangeRates самого Crypto Pay - по этим курсам и считаются чеки"""
+
+    name = "cryptopay"
+
+    def __init__(self, client=None):
+        self.client = client
+
+    async def fetch(self, http: aiohttp.ClientSession, assets: Iterable[str]) -> Rates:
+        if self.client is None:
+            from utils.cryptopay_client import cp
+            self.client = cp
+        wanted = set(assets)
+        return {
+            r.source: float(r.rate)
+            for r in await self.client.get_exchange_rates()
+            if r.is_valid and r.target == "USD" and r.source in wanted and r.rate
+        }
+
+
+class CoinGeckoRateSource(RateSource):
+    """Все активы одним запросом simple/price"""
+
+    name = "coingecko"
+    URL = "https://api.coingecko.com/api/v3/simple/price"
+    IDS = {"TON": "the-open-network", "BTC": "bitcoin", "ETH": "ethereum"}
+
+    async def fetch(self, http: aiohttp.ClientSession, assets: Iterable[str]) -> Rates:
+        ids = {self.IDS[a]: a for a in assets if a in self.IDS}
+        if not ids:
+            return {}
+        async with http.get(self.URL, params={"ids": ",".join(ids), "vs_currencies": "usd"}) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        return {asset: float(data[cid]["usd"]) for cid, asset in ids.items() if data.get(cid, {}).get("usd")}
+
+
+class StaticRateSource(RateSource):
+    """Фиксированные курсы с искусственной задержкой - для тестов и бенчмарков"""
+
+    name = "static"
+
+    def __init__(self, rates: Rates, latency: float = 0.0):
+        self.rates = dict(rates)
+        self.latency = latency
+        self.calls = 0
+
+    async def fetch(self, http: aiohttp.ClientSession, assets: Iterable[str]) -> Rates:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return {a: self.rates[a] for a in assets if a in self.rates}
+
+
+SOURCES = {
+    CryptoPayRateSource.name: CryptoPayRateSource,
+    CoinGeckoRateSource.name: CoinGeckoRateSource,
+}
+
+
+class RateProvider:
+    """Курсы валют вывода: общий кэш на процесс.
+
+    Свежие (моложе RATES_TTL) отдаются сразу. Устаревшие, но не старше
+    RATES_STALE_TTL, тоже отдаются сразу, а обновление идет в фоне. Иначе
+    вызывающий ждет обновления. Одновременные обновления сливаются в одно;
+    источники опрашиваются параллельно через одну HTTP-сессию, актив берется
+    из первого по приоритету источника, который его знает. Актив, который
+    не знает никто, в результат не попадает - по нему вывод не предлагается.
+    """
+
+    def __init__(
+        self,
+        sources: Optional[List[RateSource]] = None,
+        assets: Iterable[str] = ("TON", "BTC", "ETH"),
+        ttl: Optional[float] = None,
+        stale_ttl: Optional[float] = None,
+        timeout: Optional[float] = None,
+        clock=time.monotonic
+    ):
+        if sources is None:
+            sources = [SOURCES[name.strip()]() for name in config.RATE_SOURCES.split(",") if name.strip() in SOURCES]
+        self.sources = sources
+        self.assets = tuple(assets)
+        self.ttl = ttl if ttl is not None else config.RATES_TTL
+        self.stale_ttl = stale_ttl if stale_ttl is not None else config.RATES_STALE_TTL
+        self.timeout = timeout if timeout is not None else config.RATES_TIMEOUT
+        self.clock = clock
+        self._rates: Rates = {}
+        self._updated: Optional[float] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._http: Optional[aiohttp.ClientSession] = None
+        self.fetches = 0
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._http
+
+    async def _fetch(self) -> Rates:
+        self.fetches += 1
+        http = self._session()
+        results = await asyncio.gather(
+            *(asyncio.wait_for(source.fetch(http, self.assets), self.timeout) for source in self.sources),
+            return_exceptions=True
+        )
+        rates: Rates = {}
+        for source, result in zip(self.sources, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"⚠️ Курсы {source.name} недоступны: {result!r}")
+                continue
+            for asset, rate in result.items():
+                rates.setdefault(asset, rate)
+        if rates:
+            # Актив, пропавший из всех источников, оставляем с прошлым значением
+            self._rates = {**self._rates, **rates}
+            self._updated = self.clock()
+        return self._rates
+
+    def refresh(self) -> asyncio.Task:
+        """Запустить обновление, если оно еще не идет"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._fetch())
+        return self._refreshing
+
+    async def get_rates(self) -> Rates:
+        age = None if self._updated is None else self.clock() - self._updated
+        if age is None or age >= self.stale_ttl:
+            try:
+                await asyncio.shield(self.refresh())
+            except Exception as e:
+                logger.error(f"Ошибка обновления курсов: {e}")
+        elif age >= self.ttl:
+            self.refresh()
+        if self._updated is None or self.clock() - self._updated >= self.stale_ttl:
+            # Слишком старые курсы хуже, чем отказ от валюты
+            return {"USDT": 1.0}
+        return {"USDT": 1.0, **self._rates}
+
+    async def run(self, interval: Optional[float] = None):
+        """Фоновое обновление: в рабочем режиме пользователи всегда попадают в кэш"""
+        interval = interval or self.ttl * 0.8
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка обновления курсов: {e}")
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+
+
+# Общий провайдер процесса
+rates = RateProvider()
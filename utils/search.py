@@ -0,0 +1,255 @@
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, fields
+from sqlalchemy import and_, desc, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Callable, Dict, List, Optional, Tuple
+import math
+import re
+import time
+
+from models import Channel
+from utils.catalog import CatalogEntry, LISTED, LISTING_COLUMNS, catalog
+from config import config
+
+# Позиция в выдаче: рейтинг, качество, id последнего показанного канала
+Cursor = Tuple[float, int, int]
+
+CURSOR_PREFIX = "search_page_"
+
+
+@dataclass(frozen=True)
+class SearchFilters:
+    """Условия поиска; None - без ограничения"""
+
+    query: str = ""
+    min_subscribers: Optional[int] = None
+    max_subscribers: Optional[int] = None
+    min_price_post: Optional[float] = None
+    max_price_post: Optional[float] = None
+    min_price_pin: Optional[float] = None
+    max_price_pin: Optional[float] = None
+    min_err: Optional[float] = None
+    min_quality: Optional[int] = None
+    min_rating: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SearchFilters":
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in names})
+
+    def describe(self) -> str:
+        parts = []
+        if self.query:
+            parts.append(f"название: `{self.query}`")
+        for label, low, high, unit in (
+            ("👥", self.min_subscribers, self.max_subscribers, ""),
+            ("📝 пост", self.min_price_post, self.max_price_post, "$"),
+            ("📌 закреп", self.min_price_pin, self.max_price_pin, "$"),
+        ):
+            if low is not None or high is not None:
+                parts.append(f"{label} {_fmt(low)}–{_fmt(high)}{unit}")
+        if self.min_err is not None:
+            parts.append(f"ERR от {_fmt(self.min_err)}%")
+        if self.min_quality is not None:
+            parts.append(f"качество от {self.min_quality}")
+        if self.min_rating is not None:
+            parts.append(f"⭐ от {_fmt(self.min_rating)}")
+        return ", ".join(parts) or "без фильтров"
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return "…"
+    return f"{value:g}" if isinstance(value, float) else f"{value:,}"
+
+
+# Ключ фильтра -> (поле минимума, поле максимума, тип); максимум None - задается только нижняя граница
+_KEYS = {
+    "подписчики": ("min_subscribers", "max_subscribers", int),
+    "пост": ("min_price_post", "max_price_post", float),
+    "закреп": ("min_price_pin", "max_price_pin", float),
+    "err": ("min_err", None, float),
+    "качество": ("min_quality", None, int),
+    "рейтинг": ("min_rating", None, float),
+}
+
+
+def _number(value: str, kind: type):
+    value = value.replace(",", ".").replace(" ", "")
+    if not value:
+        return None
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise ValueError
+    return int(number) if kind is int else number
+
+
+def normalize_query(text: str) -> str:
+    """Слова запроса без знаков (@username -> username)"""
+    return " ".join(re.findall(r"\w+", text))[:100]
+
+
+def parse_filters(message: str) -> SearchFilters:
+    """Разобрать строку вида «крипто подписчики 1000-50000 пост -30 рейтинг 4».
+
+    Диапазон: «от-до», «от-» или «-до»; одно число - нижняя граница. Слова
+    вне ключей ищутся в названии. Ошибку формата - ValueError с текстом для пользователя.
+    """
+    values: Dict = {}
+    words: List[str] = []
+    tokens = message.split()
+    i = 0
+    while i < len(tokens):
+        key = tokens[i].lower()
+        if key not in _KEYS:
+            words.append(tokens[i])
+            i += 1
+            continue
+        if i + 1 == len(tokens):
+            raise ValueError(f"После «{key}» нужно значение")
+        low_field, high_field, kind = _KEYS[key]
+        raw = tokens[i + 1]
+        try:
+            if "-" in raw:
+                if high_field is None:
+                    raise ValueError
+                low, high = (_number(part, kind) for part in raw.split("-", 1))
+                if low is not None and high is not None and low > high:
+                    low, high = high, low
+            else:
+                low, high = _number(raw, kind), None
+        except ValueError:
+            raise ValueError(f"Не понял значение «{raw}» для «{key}»")
+        values[low_field] = low
+        if high_field:
+            values[high_field] = high
+        i += 2
+    return SearchFilters(query=normalize_query(" ".join(words)), **values)
+
+
+def fts_query(query: str) -> Optional[str]:
+    """Запрос FTS5 по названию и username: все слова как префиксы («крипт» найдет «Крипто»)"""
+    words = re.findall(r"\w+", query.lower())[:8]
+    return " ".join(f'"{word}"*' for word in words) or None
+
+
+def encode_cursor(cursor: Optional[Cursor], prefix: str = CURSOR_PREFIX) -> str:
+    # repr(float) обратим без потерь: сравнение рейтинга на равенство остается точным
+    if cursor is None:
+        return prefix
+    rating, quality, channel_id = cursor
+    return f"{prefix}{rating!r}_{quality}_{channel_id}"
+
+
+def decode_cursor(data: str, prefix: str = CURSOR_PREFIX) -> Optional[Cursor]:
+    """Курсор из callback_data (или offset inline-запроса с prefix=""); ValueError - если поврежден"""
+    payload = data[len(prefix):]
+    if not payload:
+        return None
+    rating, quality, channel_id = payload.split("_")
+    return float(rating), int(quality), int(channel_id)
+
+
+def _conditions(filters: SearchFilters) -> list:
+    conditions = list(LISTED)
+    for column, low, high in (
+        (Channel.subscribers, filters.min_subscribers, filters.max_subscribers),
+        (Channel.price_post, filters.min_price_post, filters.max_price_post),
+        (Channel.price_pin, filters.min_price_pin, filters.max_price_pin),
+        (Channel.err, filters.min_err, None),
+        (Channel.quality_score, filters.min_quality, None),
+        (Channel.average_rating, filters.min_rating, None),
+    ):
+        if low is not None:
+            conditions.append(column >= low)
+        if high is not None:
+            conditions.append(column <= high)
+    match = fts_query(filters.query)
+    if match:
+        conditions.append(Channel.id.in_(
+            select(text("rowid")).select_from(text("channels_fts"))
+            .where(text("channels_fts MATCH :match").bindparams(match=match))
+        ))
+    return conditions
+
+
+def _after(cursor: Cursor):
+    rating, quality, channel_id = cursor
+    return or_(
+        Channel.average_rating < rating,
+        and_(Channel.average_rating == rating, or_(
+            Channel.quality_score < quality,
+            and_(Channel.quality_score == quality, Channel.id < channel_id)
+        ))
+    )
+
+
+class ChannelSearch:
+    """Поиск по каталогу с keyset-пагинацией и LRU-кэшем страниц.
+
+    Порядок - рейтинг, качество и id по убыванию: это обратный обход
+    ix_channels_catalog, поэтому страница читается с позиции курсора без OFFSET
+    и без сортировки. Страницы кэшируются по (фильтры, курсор) на SEARCH_CACHE_TTL
+    секунд; любое изменение каталога в процессе сбрасывает кэш целиком.
+    """
+
+    def __init__(self, size: Optional[int] = None, ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.size = size or config.SEARCH_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else config.SEARCH_CACHE_TTL
+        self.clock = clock
+        self._cache: "OrderedDict[Tuple, Tuple[float, List[CatalogEntry], Optional[Cursor]]]" = OrderedDict()
+        self._version = catalog.version
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key: Tuple):
+        if self._version != catalog.version:
+            self._cache.clear()
+            self._version = catalog.version
+        cached = self._cache.get(key)
+        if cached is None or self.clock() - cached[0] >= self.ttl:
+            return None
+        self._cache.move_to_end(key)
+        return cached[1:]
+
+    def _store(self, key: Tuple, entries: List[CatalogEntry], next_cursor: Optional[Cursor]):
+        self._cache[key] = (self.clock(), entries, next_cursor)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+
+    async def page(
+        self,
+        session: AsyncSession,
+        filters: SearchFilters,
+        after: Optional[Cursor] = None,
+        per_page: int = 5
+    ) -> Tuple[List[CatalogEntry], Optional[Cursor]]:
+        """Каналы после курсора after и курсор следующей страницы (None - страница последняя)"""
+        key = (filters, after, per_page)
+        cached = self._cached(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        query = select(*LISTING_COLUMNS).where(*_conditions(filters))
+        if after is not None:
+            query = query.where(_after(after))
+        query = query.order_by(desc(Channel.average_rating), desc(Channel.quality_score), desc(Channel.id))
+        rows = (await session.execute(query.limit(per_page + 1))).all()
+
+        entries = [CatalogEntry(*row) for row in rows[:per_page]]
+        next_cursor = None
+        if len(rows) > per_page:
+            last = entries[-1]
+            next_cursor = (last.average_rating, last.quality_score, last.id)
+        self._store(key, entries, next_cursor)
+        return entries, next_cursor
+
+
+# Общий поиск процесса
+search = ChannelSearch()
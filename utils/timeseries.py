@@ -0,0 +1,235 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Iterable, Optional, Tuple
+import sys
+
+from models import ChannelHistory
+from config import config
+
+HOUR = 3600
+DAY = 86400
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def epoch(moment: datetime) -> int:
+    """Секунды Unix для наивного UTC-времени (как datetime.utcnow())"""
+    return int((moment - _EPOCH).total_seconds())
+
+
+class Series:
+    """Ряд (время, значение) на двух массивах int64; время - секунды Unix по возрастанию.
+
+    Точка занимает 16 байт, поиск по времени - бисекцией.
+    """
+
+    __slots__ = ("ts", "values")
+
+    def __init__(self, ts: Optional[array] = None, values: Optional[array] = None):
+        self.ts = ts if ts is not None else array("q")
+        self.values = values if values is not None else array("q")
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def append(self, t: int, value: int):
+        if self.ts and t < self.ts[-1]:
+            raise ValueError("В ряд дописываются только более поздние точки")
+        if self.ts and t == self.ts[-1]:
+            self.values[-1] = value
+            return
+        self.ts.append(t)
+        self.values.append(value)
+
+    def extend(self, other: "Series"):
+        if other.ts and self.ts and other.ts[0] <= self.ts[-1]:
+            raise ValueError("В ряд дописываются только более поздние точки")
+        self.ts.extend(other.ts)
+        self.values.extend(other.values)
+
+    def slice(self, start: int, end: int) -> "Series":
+        """Точки с start <= t < end"""
+        lo, hi = bisect_left(self.ts, start), bisect_left(self.ts, end)
+        return Series(self.ts[lo:hi], self.values[lo:hi])
+
+    def split(self, t: int) -> Tuple["Series", "Series"]:
+        """Точки до t и начиная с t"""
+        i = bisect_left(self.ts, t)
+        return Series(self.ts[:i], self.values[:i]), Series(self.ts[i:], self.values[i:])
+
+    def value_at(self, t: int) -> Optional[int]:
+        """Последнее значение не позже t"""
+        i = bisect_right(self.ts, t)
+        return self.values[i - 1] if i else None
+
+    def last(self) -> Optional[int]:
+        return self.values[-1] if self.values else None
+
+    def mean(self, start: int, end: int) -> Optional[float]:
+        lo, hi = bisect_left(self.ts, start), bisect_left(self.ts, end)
+        if lo == hi:
+            return None
+        return sum(self.values[lo:hi]) / (hi - lo)
+
+    def rolling_mean(self, window: int) -> "Series":
+        """Среднее по окну window секунд, заканчивающемуся в каждой точке; за один проход"""
+        out = Series()
+        total, lo = 0, 0
+        ts, values = self.ts, self.values
+        for hi in range(len(ts)):
+            total += values[hi]
+            while ts[lo] <= ts[hi] - window:
+                total -= values[lo]
+                lo += 1
+            out.ts.append(ts[hi])
+            out.values.append(round(total / (hi - lo + 1)))
+        return out
+
+    def downsample(self, bucket: int) -> "Series":
+        """Среднее по корзинам в bucket секунд; время точки - начало корзины"""
+        out = Series()
+        current, total, count = None, 0, 0
+        for t, value in zip(self.ts, self.values):
+            start = t - t % bucket
+            if start != current:
+                if count:
+                    out.ts.append(current)
+                    out.values.append(round(total / count))
+                current, total, count = start, 0, 0
+            total += value
+            count += 1
+        if count:
+            out.ts.append(current)
+            out.values.append(round(total / count))
+        return out
+
+    def pack(self) -> bytes:
+        ts, values = self.ts, self.values
+        if sys.byteorder == "big":
+            ts, values = array("q", ts), array("q", values)
+            ts.byteswap()
+            values.byteswap()
+        return ts.tobytes() + values.tobytes()
+
+    @classmethod
+    def unpack(cls, data: Optional[bytes]) -> "Series":
+        if not data:
+            return cls()
+        half = len(data) // 2
+        ts, values = array("q"), array("q")
+        ts.frombytes(data[:half])
+        values.frombytes(data[half:])
+        if sys.byteorder == "big":
+            ts.byteswap()
+            values.byteswap()
+        return cls(ts, values)
+
+
+class History:
+    """История подписчиков канала: сырые точки, почасовые и посуточные средние.
+
+    Сырые точки старше HISTORY_RAW_RETENTION сворачиваются в часы, часы старше
+    HISTORY_HOURLY_RETENTION - в сутки, сутки старше HISTORY_DAILY_RETENTION
+    отбрасываются. Границы сворачивания выровнены по часу и суткам, поэтому
+    уровни не пересекаются и вместе дают один ряд по возрастанию времени.
+    """
+
+    __slots__ = ("raw", "hourly", "daily")
+
+    def __init__(self, raw: Optional[Series] = None, hourly: Optional[Series] = None, daily: Optional[Series] = None):
+        self.raw = raw if raw is not None else Series()
+        self.hourly = hourly if hourly is not None else Series()
+        self.daily = daily if daily is not None else Series()
+
+    def append(self, t: int, value: int):
+        # Замер с отставшими часами не ломает порядок ряда - отбрасываем
+        last = self.raw.ts[-1] if self.raw.ts else self.hourly.ts[-1] if self.hourly.ts else None
+        if last is None or t >= last:
+            self.raw.append(t, value)
+
+    def compact(self, now: int):
+        cutoff = (now - config.HISTORY_RAW_RETENTION) // HOUR * HOUR
+        old, self.raw = self.raw.split(cutoff)
+        self.hourly.extend(old.downsample(HOUR))
+
+        cutoff = (now - config.HISTORY_HOURLY_RETENTION) // DAY * DAY
+        old, self.hourly = self.hourly.split(cutoff)
+        self.daily.extend(old.downsample(DAY))
+
+        _, self.daily = self.daily.split(now - config.HISTORY_DAILY_RETENTION)
+
+    def series(self) -> Series:
+        merged = Series(array("q", self.daily.ts), array("q", self.daily.values))
+        merged.extend(self.hourly)
+        merged.extend(self.raw)
+        return merged
+
+
+_table = ChannelHistory.__table__
+
+_upsert = insert(_table).values(
+    channel_id=bindparam("b_channel_id"),
+    raw=bindparam("b_raw"),
+    hourly=bindparam("b_hourly"),
+    daily=bindparam("b_daily"),
+    updated_at=bindparam("b_updated_at")
+)
+_upsert = _upsert.on_conflict_do_update(
+    index_elements=[_table.c.channel_id],
+    set_={
+        "raw": _upsert.excluded.raw,
+        "hourly": _upsert.excluded.hourly,
+        "daily": _upsert.excluded.daily,
+        "updated_at": _upsert.excluded.updated_at
+    }
+)
+
+
+async def load_histories(session: AsyncSession, channel_ids: Iterable[int]) -> Dict[int, History]:
+    """Истории каналов одним запросом; у канала без истории - пустая"""
+    channel_ids = list(channel_ids)
+    histories = {channel_id: History() for channel_id in channel_ids}
+    if not channel_ids:
+        return histories
+    rows = await session.execute(
+        select(_table.c.channel_id, _table.c.raw, _table.c.hourly, _table.c.daily)
+        .where(_table.c.channel_id.in_(channel_ids))
+    )
+    for row in rows:
+        histories[row.channel_id] = History(Series.unpack(row.raw), Series.unpack(row.hourly), Series.unpack(row.daily))
+    return histories
+
+
+async def record_subscribers(session: AsyncSession, counts: Dict[int, int], now: Optional[datetime] = None) -> Dict[int, History]:
+    """Дописать замеры подписчиков, свернуть старые точки и сохранить; вернуть истории"""
+    now = now or datetime.utcnow()
+    t = epoch(now)
+    histories = await load_histories(session, counts)
+    for channel_id, history in histories.items():
+        history.append(t, counts[channel_id])
+        history.compact(t)
+    if histories:
+        await session.execute(_upsert, [
+            {
+                "b_channel_id": channel_id,
+                "b_raw": history.raw.pack(),
+                "b_hourly": history.hourly.pack(),
+                "b_daily": history.daily.pack(),
+                "b_updated_at": now
+            }
+            for channel_id, history in histories.items()
+        ])
+    return histories
+
+
+def growth(series: Series, period: int, now: int) -> Optional[Tuple[int, float]]:
+    """Прирост подписчиков за period секунд: абсолютный и в процентах"""
+    before, latest = series.value_at(now - period), series.last()
+    if before is None or latest is None:
+        return None
+    return latest - before, ((latest - before) / before * 100) if before else 0.0
+
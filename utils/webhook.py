@@ -0,0 +1,155 @@
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiohttp import web
+from collections import OrderedDict
+from typing import List, Optional
+import asyncio
+import hashlib
+import hmac
+import logging
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_secret() -> str:
+    """Секрет вебхука: из конфига или производный от токена (одинаков во всех процессах)"""
+    # В секрете допустимы только A-Z, a-z, 0-9, _ и -
+    return config.WEBHOOK_SECRET or hashlib.sha256(config.BOT_TOKEN.encode()).hexdigest()
+
+
+class TelegramWebhook:
+    """Прием апдейтов вебхуком: ограниченная очередь и фиксированный пул обработчиков.
+
+    Ответ Telegram дается сразу после постановки в очередь. Если очередь полна,
+    запрос ждет места до WEBHOOK_QUEUE_TIMEOUT, а потом получает 503 - Telegram
+    повторит доставку позже. Так Telegram сам притормаживает, а память и число
+    одновременных обработчиков не растут.
+    """
+
+    # Сколько последних update_id помнить, чтобы не обработать повтор доставки
+    SEEN_LIMIT = 10000
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        secret: Optional[str] = None,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        put_timeout: Optional[float] = None
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret if secret is not None else webhook_secret()
+        self.workers = workers or config.WEBHOOK_WORKERS
+        self.put_timeout = put_timeout if put_timeout is not None else config.WEBHOOK_QUEUE_TIMEOUT
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or config.WEBHOOK_QUEUE_SIZE)
+        self._tasks: List[asyncio.Task] = []
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle)
+        app.on_startup.append(lambda _: self.start())
+        app.on_shutdown.append(lambda _: self.stop())
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10):
+        """Доработать принятые апдейты (не дольше timeout) и остановить обработчики"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Вебхук остановлен, в очереди осталось апдейтов: {self.queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            return True
+        self._seen[update_id] = None
+        if len(self._seen) > self.SEEN_LIMIT:
+            self._seen.popitem(last=False)
+        return False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"⚠️ Некорректный апдейт вебхука: {e}")
+            return web.Response(status=400)
+
+        self.received += 1
+        if self._is_duplicate(update.update_id):
+            return web.Response()
+        try:
+            await asyncio.wait_for(self.queue.put(update), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            # Забываем id: Telegram пришлет этот апдейт снова
+            self._seen.pop(update.update_id, None)
+            self.rejected += 1
+            return web.Response(status=503, text="Busy")
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                result = await self.dp.feed_update(self.bot, update)
+                if isinstance(result, TelegramMethod):
+                    await self.dp.silent_call_request(self.bot, result)
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+            finally:
+                self.processed += 1
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "received": self.received,
+            "processed": self.processed,
+            "rejected": self.rejected
+        }
+
+
+def create_app(telegram: Optional[TelegramWebhook] = None, cryptopay=None) -> web.Application:
+    """Общий HTTP-сервер бота: вебхуки Telegram и Crypto Pay (если включены) и служебные эндпоинты"""
+    app = web.Application()
+
+    async def health(request: web.Request) -> web.Response:
+        from utils.cryptopay_client import cp
+        return web.json_response({
+            "ok": True,
+            "telegram": telegram.stats() if telegram else None,
+            "cryptopay": cp.stats()
+        })
+
+    app.router.add_get("/healthz", health)
+    if telegram is not None:
+        telegram.register(app, config.TELEGRAM_WEBHOOK_PATH)
+    if cryptopay is not None:
+        cryptopay.register(app, config.CRYPTOPAY_WEBHOOK_PATH)
+    return app
+
+
+async def start_server(app: web.Application, host: Optional[str] = None, port: Optional[int] = None) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host or config.WEBHOOK_HOST, port or config.WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"🌐 HTTP-сервер слушает {host or config.WEBHOOK_HOST}:{port or config.WEBHOOK_PORT}")
+    return runner